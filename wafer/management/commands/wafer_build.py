@@ -0,0 +1,362 @@
+import json
+import multiprocessing
+import os
+import posixpath
+import time
+from collections import namedtuple
+
+from django.db import connections
+from django.db.models import Max
+from django.urls import get_callable
+
+import reversion
+from bakery.filesystem import join_path, normalize_path
+from bakery.management.commands.build import Command as BuildCommand
+from bakery.views import BuildableDetailView
+from reversion.models import Version
+
+from wafer import __version__
+from wafer.menu import get_cached_menus
+from wafer.schedule.models import get_schedule_version
+from wafer.sponsors.models import Sponsor, SponsorshipPackage
+from wafer.utils import (
+    PRECOMPRESSED_SUFFIXES, PreloadedBuildMixin, build_state, model_fields)
+
+
+# A unit of work for the pool. Detail views are split into chunks of
+# objects, given by their primary keys, and the other views are built
+# by a single task, with pks set to None.
+BuildTask = namedtuple('BuildTask', ('view', 'pks'))
+
+# The manifest of the incremental build, in the build directory
+MANIFEST_NAME = '.wafer_build.json'
+MANIFEST_FORMAT = 1
+
+
+def is_splittable(view):
+    """Can the view be built an object at a time?
+
+       That's the case for detail views that use django-bakery's
+       build_queryset, or PreloadedBuildMixin's, although they may
+       customise build_object."""
+    return (isinstance(view, BuildableDetailView) and
+            view.build_method == view.build_queryset and
+            type(view).build_queryset in (
+                BuildableDetailView.build_queryset,
+                PreloadedBuildMixin.build_queryset))
+
+
+def get_build_queryset(view):
+    """The queryset the view builds its objects from"""
+    return getattr(view, 'get_build_queryset', view.get_queryset)()
+
+
+def get_site_state():
+    """The state of the inputs shared by every page: the menus, and
+       the sponsors shown on each page"""
+    return build_state(
+        __version__, get_cached_menus().items,
+        [model_fields(sponsor) for sponsor in Sponsor.objects.all()],
+        [model_fields(package)
+         for package in SponsorshipPackage.objects.all()])
+
+
+def get_view_state(view):
+    """The state of a view that isn't split, or None if the view
+       doesn't tell us what it's built from"""
+    if not hasattr(view, 'get_build_inputs'):
+        return None
+    return build_state(view.get_build_inputs())
+
+
+def get_object_states(view):
+    """Return (pk, state) for the objects of a detail view.
+
+       The state includes the latest revision of the object, if the
+       model is versioned, so changes to the objects that reversion
+       follows are noticed."""
+    queryset = get_build_queryset(view).order_by('pk')
+    revisions = {}
+    if reversion.is_registered(queryset.model):
+        revisions = dict(
+            Version.objects.get_for_model(queryset.model).order_by()
+            .values_list('object_id').annotate(revision=Max('revision_id')))
+    get_inputs = getattr(view, 'get_build_inputs', model_fields)
+    return [(obj.pk, build_state(get_inputs(obj),
+                                 revisions.get(str(obj.pk))))
+            for obj in queryset]
+
+
+class OutputRecorder(object):
+    """Record the files a view writes"""
+
+    def __init__(self, view):
+        self.paths = []
+        self._build_file = view.build_file
+        view.build_file = self.build_file
+
+    def build_file(self, target_path, *args, **kwargs):
+        self.paths.append(str(target_path))
+        return self._build_file(target_path, *args, **kwargs)
+
+    def take(self):
+        """Return the files written since the last call"""
+        paths, self.paths = self.paths, []
+        return paths
+
+
+def build_task(task):
+    """Build the task.
+
+       Returns the number of objects built (None for views that aren't
+       split), the time taken, and the files written, for each object
+       (by primary key, as a string), or for the whole view (with the key
+       '')."""
+    start = time.monotonic()
+    view = get_callable(task.view)()
+    recorder = OutputRecorder(view)
+    outputs = {}
+    if task.pks is None:
+        view.build_method()
+        outputs[''] = recorder.take()
+        count = None
+    else:
+        queryset = get_build_queryset(view).filter(
+            pk__in=task.pks).order_by('pk')
+        count = 0
+        for obj in queryset:
+            view.build_object(obj)
+            outputs[str(obj.pk)] = recorder.take()
+            count += 1
+    return count, time.monotonic() - start, outputs
+
+
+def _build_indexed_task(indexed_task):
+    index, task = indexed_task
+    return index, build_task(task)
+
+
+class Command(BuildCommand):
+    help = ("Bake out the site as flat files in the build directory,"
+            " like build, but spreading the views, and chunks of the"
+            " objects of the detail views, over a pool of processes.")
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help='Number of processes to build with. 1'
+                                 ' builds everything in this process.'
+                                 ' The default is the number of CPUs.')
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help='Number of objects of a detail view to'
+                                 ' build in each task (default 100)')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only rebuild the pages whose inputs have'
+                                 ' changed since the last incremental'
+                                 ' build, and remove the pages that are'
+                                 ' no longer built')
+
+    def handle(self, *args, **options):
+        self.processes = max(1, options['processes'] or 1)
+        self.chunk_size = max(1, options['chunk_size'])
+        self.incremental = options['incremental']
+        super().handle(*args, **options)
+
+    def set_options(self, *args, **kwargs):
+        super().set_options(*args, **kwargs)
+        self.manifest = None
+        if self.incremental:
+            self.site_state = get_site_state()
+            self.manifest = self.read_manifest()
+
+    def init_build_dir(self):
+        # An incremental build updates the existing build
+        if self.manifest is None:
+            super().init_build_dir()
+
+    def _manifest_path(self):
+        return join_path(self.build_dir, MANIFEST_NAME)
+
+    def read_manifest(self):
+        """Return the views in the manifest of the last incremental
+           build, or None if we need to build everything"""
+        path = self._manifest_path()
+        if not self.fs.exists(path):
+            return None
+        with self.fs.open(path, 'rb') as f:
+            try:
+                manifest = json.loads(f.read().decode('utf-8'))
+            except ValueError:
+                return None
+        if manifest.get('format') != MANIFEST_FORMAT:
+            return None
+        if manifest.get('site') != self.site_state:
+            if self.verbosity > 1:
+                self.stdout.write('The menus or sponsors have changed,'
+                                  ' rebuilding everything')
+            return None
+        return manifest['views']
+
+    def write_manifest(self, views):
+        manifest = {
+            'format': MANIFEST_FORMAT,
+            'site': self.site_state,
+            'views': views,
+        }
+        with self.fs.open(self._manifest_path(), 'wb') as f:
+            f.write(json.dumps(manifest, sort_keys=True).encode('utf-8'))
+
+    def is_stale(self, view_str, key, state):
+        """Note the state of the view or object, and return whether it
+           needs to be built"""
+        if not self.incremental:
+            return True
+        self.states.setdefault(view_str, {})[key] = state
+        if state is None or self.manifest is None:
+            return True
+        entry = self.manifest.get(view_str, {}).get(key)
+        return entry is None or entry[0] != state
+
+    def get_tasks(self):
+        """Split the views into tasks, in the order of the view list.
+
+           Each object is built by exactly one task, so the output doesn't
+           depend on the order the tasks finish in."""
+        tasks = []
+        self.split_views = set()
+        self.states = {}
+        for view_str in self.view_list:
+            view = self.get_view_instance(get_callable(view_str))
+            if not is_splittable(view):
+                state = get_view_state(view) if self.incremental else None
+                if self.is_stale(view_str, '', state):
+                    tasks.append(BuildTask(view_str, None))
+                continue
+            self.split_views.add(view_str)
+            if self.incremental:
+                pks = [pk for pk, state in get_object_states(view)
+                       if self.is_stale(view_str, str(pk), state)]
+            else:
+                pks = list(view.get_queryset().order_by('pk').values_list(
+                    'pk', flat=True))
+            for pos in range(0, len(pks), self.chunk_size):
+                tasks.append(BuildTask(
+                    view_str, tuple(pks[pos:pos + self.chunk_size])))
+        return tasks
+
+    def run_tasks(self, tasks):
+        """Yield (task index, result) as each task finishes"""
+        if self.processes == 1:
+            for index, task in enumerate(tasks):
+                yield index, build_task(task)
+            return
+        # The workers are forked, so they inherit our settings (including
+        # BUILD_DIR) and caches. If the wafer cache is a local memory
+        # cache, each worker has its own copy, so we make sure the
+        # schedule version is there, otherwise each worker would make up
+        # its own.
+        get_schedule_version()
+        # Each worker opens its own database connection on its first
+        # query, rather than sharing ours.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(self.processes) as pool:
+            # imap_unordered keeps the workers busy, but we need to
+            # know which task each result is for
+            results = pool.imap_unordered(_build_indexed_task,
+                                          enumerate(tasks))
+            yield from results
+
+    def build_views(self):
+        start = time.monotonic()
+        tasks = self.get_tasks()
+        results = [None] * len(tasks)
+        for done, (index, result) in enumerate(self.run_tasks(tasks), 1):
+            results[index] = result
+            if self.verbosity > 1:
+                task = tasks[index]
+                if task.pks is None:
+                    name = task.view
+                else:
+                    name = '%s (%s-%s)' % (task.view, task.pks[0],
+                                           task.pks[-1])
+                self.stdout.write('[%d/%d] Built %s in %.2fs' % (
+                    done, len(tasks), name, result[1]))
+        removed = 0
+        if self.incremental:
+            removed = self.update_manifest(tasks, results)
+        if self.verbosity > 0:
+            self.report(tasks, results, removed, time.monotonic() - start)
+
+    def _relative_path(self, path):
+        return posixpath.relpath(normalize_path(path), self.build_dir)
+
+    def update_manifest(self, tasks, results):
+        """Record the new states and outputs in the manifest, and remove
+           the files that are no longer built.
+
+           Those are the files of objects that have gone, or are no longer
+           public, or have moved. Returns the number of files removed."""
+        old = self.manifest or {}
+        # Views that weren't part of this build are left as they were
+        views = dict((view_str, entries) for view_str, entries in old.items()
+                     if view_str not in self.states)
+        built = {}
+        for task, (_count, _taken, outputs) in zip(tasks, results):
+            for key, paths in outputs.items():
+                built[(task.view, key)] = sorted(
+                    self._relative_path(path) for path in paths)
+        for view_str, states in self.states.items():
+            entries = views[view_str] = {}
+            for key, state in states.items():
+                if (view_str, key) in built:
+                    entries[key] = [state, built[(view_str, key)]]
+                elif key in old.get(view_str, {}):
+                    entries[key] = old[view_str][key]
+                else:
+                    # The object went before its task ran
+                    entries[key] = [state, []]
+        current = set()
+        for entries in views.values():
+            for _state, paths in entries.values():
+                current.update(paths)
+        removed = 0
+        for entries in old.values():
+            for _state, paths in entries.values():
+                for path in paths:
+                    if path in current:
+                        continue
+                    # Along with any compressed copies
+                    for suffix in ('',) + PRECOMPRESSED_SUFFIXES:
+                        target = join_path(self.build_dir, path + suffix)
+                        if self.fs.exists(target):
+                            self.fs.removetree(target)
+                            removed += 1
+        self.write_manifest(views)
+        return removed
+
+    def report(self, tasks, results, removed, elapsed):
+        """Write the objects built and time taken by each view.
+
+           The times are the total over the view's tasks, so with more
+           than one process they can add up to more than the elapsed
+           time."""
+        views = dict(
+            (view_str, [0 if view_str in self.split_views else None, 0.0])
+            for view_str in self.view_list)
+        for task, (count, taken, _outputs) in zip(tasks, results):
+            view = views[task.view]
+            if count is not None:
+                view[0] += count
+            view[1] += taken
+        width = max([len(view) for view in views] + [4])
+        self.stdout.write('%-*s %8s %9s' % (width, 'View', 'Objects', 'Time'))
+        for view_str, (count, taken) in views.items():
+            self.stdout.write('%-*s %8s %8.2fs' % (
+                width, view_str, '-' if count is None else count, taken))
+        if self.incremental:
+            self.stdout.write('Removed %d files that are no longer built'
+                              % removed)
+        self.stdout.write('Built %d views in %d tasks in %.2fs with %d'
+                          ' processes' % (len(views), len(tasks), elapsed,
+                                          self.processes))
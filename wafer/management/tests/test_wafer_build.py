@@ -0,0 +1,183 @@
+# Test the wafer_build command
+
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from wafer.management.commands.wafer_build import (
+    BuildTask, Command, is_splittable)
+from wafer.pages.models import Page
+from wafer.pages.views import ShowPage
+from wafer.schedule.views import ICalView
+from wafer.talks.models import ACCEPTED, REJECTED, SUBMITTED
+from wafer.talks.tests.fixtures import create_talk
+from wafer.talks.views import TalkView
+from wafer.users.views import ProfileView, UsersView
+
+VIEWS = [
+    'wafer.pages.views.ShowPage',
+    'wafer.talks.views.TalkView',
+    'wafer.schedule.views.ICalView',
+]
+
+
+class WaferBuildMixin(object):
+
+    def setUp(self):
+        self.build_dir = tempfile.mkdtemp()
+        self.pages = [Page.objects.create(name='Page %d' % i,
+                                          slug='page%d' % i)
+                      for i in range(5)]
+        self.talk = create_talk('Accepted', ACCEPTED, 'author1')
+        self.submitted = create_talk('Submitted', SUBMITTED, 'author2')
+
+    def tearDown(self):
+        shutil.rmtree(self.build_dir)
+
+    def _build(self, views=VIEWS, processes=1, **kwargs):
+        out = StringIO()
+        call_command('wafer_build', *views, build_dir=self.build_dir,
+                     skip_static=True, skip_media=True, processes=processes,
+                     stdout=out, **kwargs)
+        return out.getvalue()
+
+    def _exists(self, url):
+        return os.path.exists(os.path.join(
+            self.build_dir, url.lstrip('/'), 'index.html'))
+
+    def _read_tree(self):
+        tree = {}
+        for dirpath, _dirnames, filenames in os.walk(self.build_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                with open(path, 'rb') as f:
+                    tree[os.path.relpath(path, self.build_dir)] = f.read()
+        return tree
+
+
+class WaferBuildTests(WaferBuildMixin, TestCase):
+
+    def test_is_splittable(self):
+        self.assertTrue(is_splittable(ShowPage()))
+        self.assertTrue(is_splittable(TalkView()))
+        self.assertTrue(is_splittable(ProfileView()))
+        self.assertFalse(is_splittable(UsersView()))
+        self.assertFalse(is_splittable(ICalView()))
+
+    def test_tasks(self):
+        command = Command()
+        command.view_list = VIEWS
+        command.chunk_size = 2
+        command.incremental = False
+        pks = [page.pk for page in self.pages]
+        self.assertEqual(command.get_tasks(), [
+            BuildTask('wafer.pages.views.ShowPage', (pks[0], pks[1])),
+            BuildTask('wafer.pages.views.ShowPage', (pks[2], pks[3])),
+            BuildTask('wafer.pages.views.ShowPage', (pks[4],)),
+            BuildTask('wafer.talks.views.TalkView',
+                      (self.talk.pk, self.submitted.pk)),
+            BuildTask('wafer.schedule.views.ICalView', None),
+        ])
+
+    def test_build(self):
+        output = self._build(chunk_size=2, verbosity=2)
+        for page in self.pages:
+            self.assertTrue(self._exists(page.get_absolute_url()))
+        self.assertTrue(self._exists(self.talk.get_absolute_url()))
+        # Not public
+        self.assertFalse(self._exists(self.submitted.get_absolute_url()))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.build_dir, 'schedule', 'schedule.ics')))
+        lines = output.splitlines()
+        self.assertEqual(lines[0], 'Initializing build directory')
+        self.assertIn('[1/5] Built wafer.pages.views.ShowPage (%d-%d) in'
+                      % (self.pages[0].pk, self.pages[1].pk), lines[1])
+        report = lines[-5:]
+        self.assertEqual(report[0].split(), ['View', 'Objects', 'Time'])
+        self.assertEqual(report[1].split()[:2],
+                         ['wafer.pages.views.ShowPage', '5'])
+        self.assertEqual(report[2].split()[:2],
+                         ['wafer.talks.views.TalkView', '2'])
+        self.assertEqual(report[3].split()[:2],
+                         ['wafer.schedule.views.ICalView', '-'])
+        self.assertTrue(report[4].startswith('Built 3 views in 5 tasks in'))
+
+    def test_deterministic(self):
+        """Building in chunks gives the same output as a single chunk"""
+        self._build(chunk_size=1)
+        first = self._read_tree()
+        self._build(chunk_size=100)
+        self.assertEqual(first, self._read_tree())
+
+    def test_incremental(self):
+        views = VIEWS + ['wafer.talks.views.UsersTalks']
+        talk_url = self.talk.get_absolute_url()
+        self._build(views, incremental=True)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.build_dir, '.wafer_build.json')))
+        self.assertTrue(self._exists(talk_url))
+        # Nothing has changed
+        output = self._build(views, incremental=True)
+        self.assertIn('Built 4 views in 0 tasks', output)
+        # Changing a talk rebuilds it and the talk list. The talk's URL
+        # includes the title, so the old page is removed
+        self.talk.title = 'A changed title'
+        self.talk.save()
+        output = self._build(views, incremental=True, verbosity=2)
+        lines = output.splitlines()
+        self.assertIn('[1/2] Built wafer.talks.views.TalkView (%d-%d)' % (
+            self.talk.pk, self.talk.pk), lines[0])
+        self.assertIn('[2/2] Built wafer.talks.views.UsersTalks', lines[1])
+        self.assertIn('Removed 1 files that are no longer built', output)
+        self.assertFalse(self._exists(talk_url))
+        talk_url = self.talk.get_absolute_url()
+        with open(os.path.join(self.build_dir, talk_url.lstrip('/'),
+                               'index.html')) as f:
+            self.assertIn('A changed title', f.read())
+        for page in self.pages:
+            self.assertTrue(self._exists(page.get_absolute_url()))
+        # A talk that is no longer public, and a deleted page, are removed
+        self.talk.status = REJECTED
+        self.talk.save()
+        page_url = self.pages[0].get_absolute_url()
+        self.pages[0].delete()
+        output = self._build(views, incremental=True)
+        self.assertIn('Removed 1 files that are no longer built', output)
+        self.assertFalse(self._exists(talk_url))
+        self.assertFalse(self._exists(page_url))
+        self.assertTrue(self._exists(self.pages[1].get_absolute_url()))
+        # A full build gives the same result
+        tree = self._read_tree()
+        self._build(views, incremental=False)
+        del tree['.wafer_build.json']
+        self.assertEqual(tree, self._read_tree())
+
+
+class WaferBuildProcessesTests(WaferBuildMixin, TransactionTestCase):
+    """Build with a pool of worker processes.
+
+       The workers open their own database connections, so they can only
+       see the test data if it's committed to a database in a file."""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('The build workers need a file-backed database')
+        super().setUp()
+
+    def test_processes(self):
+        output = self._build(chunk_size=2, processes=2)
+        self.assertIn('Built 3 views in 5 tasks', output)
+        self.assertIn('with 2 processes', output)
+        for page in self.pages:
+            self.assertTrue(self._exists(page.get_absolute_url()))
+        self.assertTrue(self._exists(self.talk.get_absolute_url()))
+        self.assertFalse(self._exists(self.submitted.get_absolute_url()))
+        # The workers build the same pages as a single process
+        tree = self._read_tree()
+        self._build(chunk_size=2)
+        self.assertEqual(tree, self._read_tree())
@@ -13,6 +13,7 @@ from wafer.compare.admin import make_diff, get_author, get_date
 from wafer.pages.models import Page
 from wafer.pages.serializers import PageSerializer
 from wafer.pages.forms import PageForm
+from wafer.utils import model_fields
 
 
 class ShowPage(BuildableDetailView):
@@ -28,6 +29,15 @@ class ShowPage(BuildableDetailView):
         # This does create a directory, but that's usually what we want
         # for container pages, so we leave it.
 
+    def get_build_inputs(self, obj):
+        """The data the static page is built from"""
+        return [
+            model_fields(obj), obj.get_absolute_url(),
+            [(person.username, person.userprofile.display_name())
+             for person in obj.people.all()],
+            [model_fields(page_file) for page_file in obj.files.all()],
+        ]
+
 
 class EditPage(UpdateView):
     template_name = 'wafer.pages/page_form.html'
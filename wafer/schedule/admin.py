@@ -1,6 +1,10 @@
 import datetime
+import random
 from collections import defaultdict
 
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
 from django.db.models import Q
 from django.urls import re_path
 from django.core.exceptions import ValidationError
@@ -13,22 +17,84 @@ from django import forms
 from reversion.admin import VersionAdmin
 
 from wafer.compare.admin import CompareVersionAdmin
-from wafer.schedule.models import ScheduleBlock, Venue, Slot, ScheduleItem
+from wafer.schedule.models import (
+    ScheduleBlock, Venue, Slot, ScheduleItem, batch_schedule_updates,
+    find_overlaps, validate_slots)
 from wafer.talks.models import Talk, ACCEPTED, CANCELLED
 from wafer.pages.models import Page
-from wafer.utils import cache_result
+
+
+class ScheduleIndex(object):
+    """In-memory index of the schedule, shared by the built-in validators.
+
+       This is built in a single pass over the (prefetched) schedule items,
+       with one extra query for the venue blocks, so validating the
+       schedule doesn't cost queries per item."""
+
+    def __init__(self, all_items):
+        self.items = list(all_items)
+        # item pk -> slots, ordered by end time
+        self.slots_by_item = {}
+        # item pk -> speakers
+        self.speakers_by_item = {}
+        # venue -> (slot, item) entries, for finding overlaps
+        self.entries_by_venue = {}
+        # speaker -> (slot, item) entries, for finding overlaps
+        self.entries_by_speaker = {}
+        for item in self.items:
+            slots = sorted(item.slots.all(), key=lambda slot: slot.end_time)
+            self.slots_by_item[item.pk] = slots
+            for slot in slots:
+                self.entries_by_venue.setdefault(item.venue, []).append(
+                    (slot, item))
+            if item.talk:
+                speakers = list(item.talk.authors.all())
+            elif item.page:
+                speakers = list(item.page.people.all())
+            else:
+                speakers = []
+            self.speakers_by_item[item.pk] = speakers
+            for speaker in speakers:
+                self.entries_by_speaker.setdefault(speaker, []).extend(
+                    (slot, item) for slot in slots)
+        # venue pk -> block pks
+        self.venue_blocks = defaultdict(set)
+        venue_ids = set(item.venue_id for item in self.items)
+        for venue_id, block_id in Venue.blocks.through.objects.filter(
+                venue_id__in=venue_ids).values_list('venue_id',
+                                                    'scheduleblock_id'):
+            self.venue_blocks[venue_id].add(block_id)
+
+
+class ScheduleItemList(list):
+    """A list of schedule items, which lazily builds a ScheduleIndex
+       for the validators to share."""
+
+    _index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = ScheduleIndex(self)
+        return self._index
+
+
+def get_schedule_index(all_items):
+    """Return the ScheduleIndex for the given items, reusing the index
+       from prefetch_schedule_items if possible."""
+    if isinstance(all_items, ScheduleItemList):
+        return all_items.index
+    return ScheduleIndex(all_items)
 
 
 # Schedule item validators
 def find_non_contiguous(all_items):
     """Find any items that have slots that aren't contiguous"""
+    index = get_schedule_index(all_items)
     non_contiguous = []
-    for item in all_items:
-        if item.slots.count() < 2:
-            # No point in checking
-            continue
+    for item in index.items:
         last_slot = None
-        for slot in item.slots.all().order_by('end_time'):
+        for slot in index.slots_by_item[item.pk]:
             if last_slot:
                 if last_slot.end_time != slot.get_start_time():
                     non_contiguous.append(item)
@@ -71,19 +137,31 @@ def find_duplicate_schedule_items(all_items):
     return duplicates
 
 
+def _group_overlaps(entries_by_key):
+    """Group the overlapping (slot, item) entries for each key.
+
+       Returns a dictionary of (slot, key) -> items, where slot is the
+       earliest slot of the overlap."""
+    clashes = {}
+    for key, entries in entries_by_key.items():
+        for (slot, item), (_other_slot, other) in find_overlaps(entries):
+            if item == other:
+                continue
+            items = clashes.setdefault((slot, key), [])
+            for clashing in (item, other):
+                if clashing not in items:
+                    items.append(clashing)
+    return clashes
+
+
 def find_clashes(all_items):
-    """Find schedule items which clash (common slot and venue)"""
+    """Find schedule items which clash (overlapping slots in the same
+       venue)"""
+    index = get_schedule_index(all_items)
     clashes = {}
-    seen_venue_slots = {}
-    for item in all_items:
-        for slot in item.slots.all():
-            pos = (item.venue, slot)
-            if pos in seen_venue_slots:
-                if seen_venue_slots[pos] not in clashes:
-                    clashes[pos] = [seen_venue_slots[pos]]
-                clashes[pos].append(item)
-            else:
-                seen_venue_slots[pos] = item
+    for (slot, venue), items in _group_overlaps(
+            index.entries_by_venue).items():
+        clashes[(venue, slot)] = items
     # We return a list, to match other validators
     return clashes.items()
 
@@ -91,15 +169,15 @@ def find_clashes(all_items):
 def find_invalid_venues(all_items):
     """Find venues assigned slots that aren't on the allowed list
        of blocks."""
+    index = get_schedule_index(all_items)
     venues = {}
-    for item in all_items:
+    for item in index.items:
+        item_blocks = index.venue_blocks[item.venue_id]
         valid = False
-        item_blocks = list(item.venue.blocks.all())
-        for slot in item.slots.all():
-            for block in item_blocks:
-                if block == slot.get_block():
-                    valid = True
-                    break
+        for slot in index.slots_by_item[item.pk]:
+            if slot.block_id in item_blocks:
+                valid = True
+                break
         if not valid:
             venues.setdefault(item.venue, [])
             venues[item.venue].append(item)
@@ -109,37 +187,26 @@ def find_invalid_venues(all_items):
 def find_speaker_clashes(all_items):
     """Find items that have the same speaker and also have overlapping
        slots"""
-    clashes = {}
-    seen_slots_speakers = {}
-    for item in all_items:
-        if item.talk:
-            speakers = list(item.talk.authors.all())
-        elif item.page:
-            speakers = list(item.page.people.all())
-        else:
-            speakers = []
-        for speaker in speakers:
-            for slot in item.slots.all():
-                candidate = (slot, speaker)
-                if candidate in seen_slots_speakers:
-                    if seen_slots_speakers[candidate] not in clashes:
-                        clashes[candidate] = [seen_slots_speakers[candidate]]
-                    clashes[candidate].append(item)
-                else:
-                    seen_slots_speakers[candidate] = item
+    index = get_schedule_index(all_items)
+    clashes = _group_overlaps(index.entries_by_speaker)
     # We return a list, to match other validators
     return clashes.items()
 
 
 # Helper methods for calling the validators
-def prefetch_schedule_items():
-    """Prefetch all schedule items and related objects."""
-    return list(ScheduleItem.objects
-                .select_related(
-                    'talk', 'page', 'venue')
-                .prefetch_related(
-                    'slots', 'slots__previous_slot')
-                .all())
+def prefetch_schedule_items(item_ids=None):
+    """Prefetch all schedule items and related objects.
+
+       If item_ids is given, only those schedule items are fetched."""
+    items = ScheduleItem.objects.all()
+    if item_ids is not None:
+        items = items.filter(pk__in=item_ids)
+    return ScheduleItemList(
+        items
+        .select_related(
+            'talk', 'page', 'venue')
+        .prefetch_related(
+            'slots', 'talk__authors', 'page__people'))
 
 
 def prefetch_slots():
@@ -149,6 +216,8 @@ def prefetch_slots():
 # Validators are listed as (function, error type, error message) tuples
 SLOT_VALIDATORS = []
 SCHEDULE_ITEM_VALIDATORS = []
+# Schedule item validators which can be rerun on part of the schedule
+LOCAL_VALIDATORS = set()
 
 
 # Helpers for people extending the tests
@@ -157,59 +226,350 @@ def register_slot_validator(function, err_type, msg):
     SLOT_VALIDATORS.append((function, err_type, msg))
 
 
-def register_schedule_item_validator(function, err_type, msg):
+def register_schedule_item_validator(function, err_type, msg, local=False):
+    """Register a schedule item validator.
+
+       If local is True, the validator only compares schedule items that
+       share a talk or have overlapping slots, and can be rerun on just
+       the items affected by an edit."""
     global SCHEDULE_ITEM_VALIDATORS
     SCHEDULE_ITEM_VALIDATORS.append((function, err_type, msg))
+    if local:
+        LOCAL_VALIDATORS.add(function)
 
 
 # Register our validators
 register_schedule_item_validator(
         find_clashes, 'clashes',
-        _('Clashes found in schedule.'))
+        _('Clashes found in schedule.'),
+        local=True)
 register_schedule_item_validator(
         find_duplicate_schedule_items, 'duplicates',
-        _('Duplicate schedule items found in schedule.'))
+        _('Duplicate schedule items found in schedule.'),
+        local=True)
 register_schedule_item_validator(
         validate_items, 'validation',
-        _('Invalid schedule items found in schedule.'))
+        _('Invalid schedule items found in schedule.'),
+        local=True)
 register_schedule_item_validator(
         find_non_contiguous, 'non_contiguous',
-        _('Non contiguous slots found in schedule.'))
+        _('Non contiguous slots found in schedule.'),
+        local=True)
 register_schedule_item_validator(
         find_invalid_venues, 'venues',
-        _('Invalid venues found in schedule.'))
+        _('Invalid venues found in schedule.'),
+        local=True)
 register_schedule_item_validator(
         find_speaker_clashes, 'speaker_clashes',
-        _('Common speaker in simultaneous schedule items'))
+        _('Common speaker in simultaneous schedule items'),
+        local=True)
 
 
 # Utility functions for checking the schedule state
-@cache_result('wafer_schedule_check_schedule', 60*60)
+VALIDATION_CACHE_KEY = 'wafer_schedule_validation'
+# A number that changes with every edit, so we can tell if the cached
+# validation state is out of date
+VALIDATION_EDIT_KEY = 'wafer_schedule_validation_edit'
+VALIDATION_TIMEOUT = 60*60
+
+
+def _entry_key(entry):
+    """The key identifying a validation error.
+
+       Errors for a single item are keyed by the item's pk, and grouped
+       errors by their key, so we don't store the items themselves."""
+    if isinstance(entry, tuple):
+        return ('group', entry[0])
+    return ('item', entry.pk)
+
+
+def _entry_items(entry):
+    """The schedule items involved in a validation error"""
+    if isinstance(entry, ScheduleItem):
+        return [entry]
+    if isinstance(entry, tuple):
+        return [x for x in entry[1] if isinstance(x, ScheduleItem)]
+    return []
+
+
+class ScheduleValidation(object):
+    """The validation state of the schedule.
+
+       The errors are indexed by error type and key, and by the schedule
+       items involved, so the errors affected by an edit can be rechecked
+       without revalidating the whole schedule. Only the primary keys of
+       the items are kept, so the state stays small, and the items are
+       loaded again when the errors are reported."""
+
+    def __init__(self, edit=None):
+        # The edit number this state is up to date with
+        self.edit = edit
+        # err_type -> {key: item pks}
+        self.item_errors = {}
+        # item pk -> set of (err_type, key)
+        self.errors_by_item = defaultdict(set)
+        # err_type -> list of slots
+        self.slot_errors = {}
+        # item pk -> (talk pk, slot pks), for the items with errors, to
+        # find the items that need rechecking when they change
+        self.item_relations = {}
+        all_items = prefetch_schedule_items()
+        for validator, err_type, _msg in SCHEDULE_ITEM_VALIDATORS:
+            self.item_errors[err_type] = {}
+            self._add_errors(err_type, validator(all_items))
+        self._update_relations(all_items)
+        self.update_slots()
+
+    def _add_errors(self, err_type, entries, item_ids=None, dropped=()):
+        for entry in entries:
+            entry_items = set(x.pk for x in _entry_items(entry))
+            key = _entry_key(entry)
+            if (item_ids is not None and not (entry_items & item_ids) and
+                    (err_type, key) not in dropped):
+                # Not affected by the edit, so we already have this
+                continue
+            errors = self.item_errors.setdefault(err_type, {})
+            if key[0] == 'group' and key in errors:
+                # We've only rechecked part of the schedule, so merge
+                # with the existing error for the unaffected items
+                entry_items.update(errors[key])
+            errors[key] = sorted(entry_items)
+            for pk in entry_items:
+                self.errors_by_item[pk].add((err_type, key))
+
+    def _remove_errors(self, item_ids):
+        """Remove the errors involving the given items.
+
+           Returns the removed errors, and all the items involved in
+           them, which need to be rechecked."""
+        dropped = set()
+        involved = set()
+        for pk in item_ids:
+            for err_type, key in self.errors_by_item.pop(pk, ()):
+                pks = self.item_errors[err_type].pop(key, None)
+                if pks is None:
+                    continue
+                dropped.add((err_type, key))
+                for other in pks:
+                    involved.add(other)
+                    self.errors_by_item[other].discard((err_type, key))
+        return dropped, involved
+
+    def _update_relations(self, items):
+        for item in items:
+            if self.errors_by_item.get(item.pk):
+                self.item_relations[item.pk] = (
+                    item.talk_id,
+                    frozenset(slot.pk for slot in item.slots.all()))
+            else:
+                self.errors_by_item.pop(item.pk, None)
+                self.item_relations.pop(item.pk, None)
+
+    def _related_item_ids(self, item_ids):
+        """Find the schedule items that share a talk or have overlapping
+           slots with the given items, both before and after the change.
+
+           We only need the relations before the change for the items
+           that had errors, since the others didn't make any errors that
+           the change could fix."""
+        slot_ids = set(ScheduleItem.slots.through.objects.filter(
+            scheduleitem_id__in=item_ids).values_list('slot_id', flat=True))
+        talk_ids = set(ScheduleItem.objects.filter(
+            pk__in=item_ids, talk__isnull=False).values_list('talk_id',
+                                                            flat=True))
+        for pk in item_ids:
+            if pk in self.item_relations:
+                talk_id, old_slot_ids = self.item_relations[pk]
+                if talk_id is not None:
+                    talk_ids.add(talk_id)
+                slot_ids.update(old_slot_ids)
+        # Items in overlapping slots can clash with the changed items
+        overlapping = Q(pk__in=slot_ids)
+        for start_time, end_time in Slot.objects.filter(
+                pk__in=slot_ids).values_list('effective_start_time',
+                                             'end_time'):
+            overlapping |= Q(effective_start_time__lt=end_time,
+                             end_time__gt=start_time)
+        slot_ids = Slot.objects.filter(overlapping).values_list('pk',
+                                                                flat=True)
+        return set(ScheduleItem.objects.filter(
+            Q(pk__in=item_ids) | Q(slots__in=slot_ids) |
+            Q(talk_id__in=talk_ids)).values_list('pk', flat=True))
+
+    def update_items(self, item_ids):
+        """Recheck the schedule items that may be affected by changes to
+           the given items."""
+        deleted = set(item_ids)
+        item_ids = set(item_ids) | self._related_item_ids(item_ids)
+        dropped, involved = self._remove_errors(item_ids)
+        items = prefetch_schedule_items(item_ids | involved)
+        deleted.difference_update(item.pk for item in items)
+        for pk in deleted:
+            self.item_relations.pop(pk, None)
+        all_items = None
+        for validator, err_type, _msg in SCHEDULE_ITEM_VALIDATORS:
+            if validator in LOCAL_VALIDATORS:
+                self._add_errors(err_type, validator(items), item_ids,
+                                 dropped)
+                continue
+            # We can't tell which part of the schedule other validators
+            # depend on, so we need to rerun them over everything
+            if all_items is None:
+                all_items = prefetch_schedule_items()
+            for key, pks in self.item_errors.get(err_type, {}).items():
+                for pk in pks:
+                    self.errors_by_item[pk].discard((err_type, key))
+            self.item_errors[err_type] = {}
+            self._add_errors(err_type, validator(all_items))
+        self._update_relations(all_items if all_items is not None
+                               else items)
+
+    def update_slots(self):
+        """Recheck the slots"""
+        all_slots = prefetch_slots()
+        self.slot_errors = {}
+        for validator, err_type, _msg in SLOT_VALIDATORS:
+            self.slot_errors[err_type] = list(validator(all_slots))
+
+    def get_slot_errors(self):
+        return self.slot_errors
+
+    def get_item_errors(self):
+        """Return the schedule item errors as lists, by error type"""
+        item_ids = set(pk for errors in self.item_errors.values()
+                       for pks in errors.values() for pk in pks)
+        items = dict((item.pk, item)
+                     for item in prefetch_schedule_items(item_ids))
+        result = {}
+        for err_type, errors in self.item_errors.items():
+            entries = result[err_type] = []
+            for (kind, key), pks in errors.items():
+                if kind == 'item':
+                    if key in items:
+                        entries.append(items[key])
+                else:
+                    entries.append((key, [items[pk] for pk in pks
+                                          if pk in items]))
+        return result
+
+    def is_valid(self):
+        for errors in self.item_errors.values():
+            if errors:
+                return False
+        for errors in self.get_slot_errors().values():
+            if errors:
+                return False
+        return True
+
+
+def _get_cache():
+    return caches[settings.WAFER_CACHE]
+
+
+def _get_edit():
+    cache = _get_cache()
+    cache.add(VALIDATION_EDIT_KEY, random.getrandbits(48), None)
+    edit = cache.get(VALIDATION_EDIT_KEY)
+    if edit is None:
+        edit = _new_edit()
+    return edit
+
+
+def _new_edit():
+    """Move on to a new edit number, and return it.
+
+       Each number is claimed with cache.add, so no two edits get the
+       same number, even with caches whose incr isn't atomic."""
+    cache = _get_cache()
+    cache.add(VALIDATION_EDIT_KEY, random.getrandbits(48), None)
+    while True:
+        try:
+            edit = cache.incr(VALIDATION_EDIT_KEY)
+        except ValueError:
+            # The cache has lost the number. We start again from a
+            # random one, so the old states don't match the new numbers
+            edit = random.getrandbits(48)
+            cache.set(VALIDATION_EDIT_KEY, edit, None)
+        if cache.add('%s_%d' % (VALIDATION_EDIT_KEY, edit), True,
+                     VALIDATION_TIMEOUT):
+            return edit
+
+
+def get_cached_schedule_validation():
+    """Return the validation state of the schedule if we have it, and
+       it's up to date, or None, without checking the schedule."""
+    cache = _get_cache()
+    state = cache.get(VALIDATION_CACHE_KEY)
+    if state is None or state.edit != cache.get(VALIDATION_EDIT_KEY):
+        return None
+    return state
+
+
+def get_schedule_validation():
+    """Return the current validation state of the schedule, checking
+       the whole schedule if we don't have it, or it is out of date."""
+    state = get_cached_schedule_validation()
+    if state is None:
+        # If the schedule is edited while we check it, the edit number
+        # changes, so the state we store is already out of date
+        state = ScheduleValidation(_get_edit())
+        _get_cache().set(VALIDATION_CACHE_KEY, state, VALIDATION_TIMEOUT)
+    return state
+
+
+def update_validation(item_ids=(), slots_changed=False):
+    """Update the validation state after the given schedule items
+       have changed.
+
+       If slots_changed is True, the slot validators are rerun
+       as well. This is called once the edit has committed. If another
+       edit is made while we're updating the state, we don't store it,
+       and the whole schedule is checked again when it is next needed,
+       rather than waiting for the other edit."""
+    state = get_cached_schedule_validation()
+    if state is None:
+        # Nothing to update, this will be checked from scratch. Any
+        # check that's in progress may have missed this edit
+        _new_edit()
+        return
+    if item_ids:
+        state.update_items(item_ids)
+    if slots_changed:
+        state.update_slots()
+    edit = _new_edit()
+    if edit == state.edit + 1:
+        state.edit = edit
+        _get_cache().set(VALIDATION_CACHE_KEY, state, VALIDATION_TIMEOUT)
+
+
+def invalidate_validation():
+    """Discard the validation state, so the whole schedule is
+       checked again"""
+    _new_edit()
+    _get_cache().delete(VALIDATION_CACHE_KEY)
+
+
 def check_schedule():
     """Helper routine to easily test if the schedule is valid"""
-    all_items = prefetch_schedule_items()
-    for validator, _type, _msg in SCHEDULE_ITEM_VALIDATORS:
-        if validator(all_items):
-            return False
+    return get_schedule_validation().is_valid()
 
-    all_slots = prefetch_slots()
-    for validator, _type, _msg in SLOT_VALIDATORS:
-        if validator(all_slots):
-            return False
-    return True
 
+check_schedule.invalidate = invalidate_validation
 
-def validate_schedule():
+
+def validate_schedule(state=None):
     """Helper routine to report issues with the schedule"""
-    all_items = prefetch_schedule_items()
+    if state is None:
+        state = get_schedule_validation()
+    item_errors = state.get_item_errors()
     errors = []
-    for validator, _type, msg in SCHEDULE_ITEM_VALIDATORS:
-        for item in validator(all_items):
+    for _validator, err_type, msg in SCHEDULE_ITEM_VALIDATORS:
+        for item in item_errors.get(err_type, []):
             errors.append('%s: %s' % (msg, item))
 
-    all_slots = prefetch_slots()
-    for validator, _type, msg in SLOT_VALIDATORS:
-        for slot in validator(all_slots):
+    slot_errors = state.get_slot_errors()
+    for _validator, err_type, msg in SLOT_VALIDATORS:
+        for slot in slot_errors.get(err_type, []):
             errors.append('%s: %s' % (msg, slot))
     return errors
 
@@ -232,19 +592,9 @@ class BaseBlockFilter(admin.SimpleListFilter):
     def _get_slots(self):
         if self.value():
             block_pk = int(self.value())
-            block = ScheduleBlock.objects.get(pk=block_pk)
-            # Find all slots with a start_time are in the given block
-            slots = list(Slot.objects.filter(
-                start_time__gte=block.start_time,
-                end_time__lte=block.end_time))
-            all_slots = slots[:]
-            # Extend with all the slots that have a previous slot
             # Return the filtered list of slot ids
-            while Slot.objects.filter(previous_slot__in=slots).exists():
-                slots = list(Slot.objects.filter(
-                    previous_slot__in=slots).all())
-                all_slots.extend(slots)
-            return [x.pk for x in all_slots]
+            return list(Slot.objects.filter(block_id=block_pk)
+                        .values_list('pk', flat=True))
         return None
 
 
@@ -292,12 +642,9 @@ class BaseStartTimeFilter(admin.SimpleListFilter):
             base_time = datetime.datetime.strptime(self.value(), '%H:%M')
             max_time = base_time + datetime.timedelta(seconds=59)
             # We find all start times between base_time and max_time
-            # or slots with the previous_slot end time in this range
             slots = Slot.objects.filter(
-                Q(start_time__time__gte=base_time.time(),
-                  start_time__time__lte=max_time.time()) |
-                Q(previous_slot__end_time__time__gte=base_time.time(),
-                  previous_slot__end_time__time__lte=max_time.time()))
+                effective_start_time__time__gte=base_time.time(),
+                effective_start_time__time__lte=max_time.time())
             # Return the queryset
             return slots
         return None
@@ -358,7 +705,31 @@ class ScheduleItemAdminForm(forms.ModelForm):
         self.fields['page'].queryset = Page.objects.all()
 
 
-class ScheduleItemAdmin(CompareVersionAdmin):
+class BatchScheduleUpdatesMixin(object):
+    """Apply the schedule updates from the objects changed by a
+       request once, after the request's changes are committed."""
+
+    def changeform_view(self, request, *args, **kwargs):
+        if request.method != 'POST':
+            return super().changeform_view(request, *args, **kwargs)
+        with batch_schedule_updates():
+            return super().changeform_view(request, *args, **kwargs)
+
+    def delete_view(self, request, *args, **kwargs):
+        if request.method != 'POST':
+            return super().delete_view(request, *args, **kwargs)
+        with batch_schedule_updates():
+            return super().delete_view(request, *args, **kwargs)
+
+    def changelist_view(self, request, *args, **kwargs):
+        # This covers list_editable changes and bulk actions
+        if request.method != 'POST':
+            return super().changelist_view(request, *args, **kwargs)
+        with batch_schedule_updates():
+            return super().changelist_view(request, *args, **kwargs)
+
+
+class ScheduleItemAdmin(BatchScheduleUpdatesMixin, CompareVersionAdmin):
     form = ScheduleItemAdminForm
 
     change_list_template = 'admin/scheduleitem_list.html'
@@ -377,10 +748,9 @@ class ScheduleItemAdmin(CompareVersionAdmin):
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
         # Find issues in the schedule
-        all_items = prefetch_schedule_items()
         errors = defaultdict(list)
-        for validator, err_type, _msg in SCHEDULE_ITEM_VALIDATORS:
-            failed_items = validator(all_items)
+        item_errors = get_schedule_validation().get_item_errors()
+        for err_type, failed_items in item_errors.items():
             if failed_items:
                 errors[err_type].extend(failed_items)
         extra_context['errors'] = errors
@@ -420,7 +790,7 @@ class SlotAdminAddForm(SlotAdminForm):
                                                 "this one"))
 
 
-class SlotAdmin(CompareVersionAdmin):
+class SlotAdmin(BatchScheduleUpdatesMixin, CompareVersionAdmin):
     form = SlotAdminForm
 
     list_display = ('__str__', 'get_block', 'get_formatted_start_date_time',
@@ -440,9 +810,8 @@ class SlotAdmin(CompareVersionAdmin):
         extra_context = extra_context or {}
         # Find issues with the slots
         errors = defaultdict(list)
-        all_slots = prefetch_slots()
-        for validator, err_type, _msg in SLOT_VALIDATORS:
-            failed_slots = validator(all_slots)
+        slot_errors = get_schedule_validation().get_slot_errors()
+        for err_type, failed_slots in slot_errors.items():
             if failed_slots:
                 errors[err_type].extend(failed_slots)
         extra_context['errors'] = errors
@@ -467,29 +836,33 @@ class SlotAdmin(CompareVersionAdmin):
             end = prev.end_time
             start = prev.get_start_time()
             slot_len = end - start
+            new_slots = []
             for loop in range(form.cleaned_data['additional']):
                 end = end + slot_len
                 new_slot = Slot(previous_slot=prev,
                                 end_time=end)
-                # Make sure we're valid before adding to the database
-                try:
-                    new_slot.full_clean()
+                new_slots.append(new_slot)
+                prev = new_slot
+            # Make sure we're valid before adding to the database
+            try:
+                validate_slots(new_slots)
+            except ValidationError as err:
+                msg = _("Failed to create new slots - %s" % err)
+                if hasattr(request, '_messages'):
+                    self.message_user(request, msg, messages.ERROR)
+                    return
+                # Useful in testing
+                raise
+            with transaction.atomic():
+                for new_slot in new_slots:
                     new_slot.save()
-                    msgdict = {'obj': force_str(new_slot)}
-                    msg = _("Additional slot %(obj)s added sucessfully") % msgdict
-                    if hasattr(request, '_messages'):
-                        # Don't add messages unless we have a suitable request
-                        # Needed during testing, and possibly in other cases
-                        self.message_user(request, msg, messages.SUCCESS)
-                    prev = new_slot
-                except ValidationError as err:
-                    msg = _("Failed to create new slot - %s" % err)
-                    if hasattr(request, '_messages'):
-                        self.message_user(request, msg, messages.ERROR)
-                    else:
-                        # Useful in testing
-                        raise
-                    break
+            for new_slot in new_slots:
+                msgdict = {'obj': force_str(new_slot)}
+                msg = _("Additional slot %(obj)s added sucessfully") % msgdict
+                if hasattr(request, '_messages'):
+                    # Don't add messages unless we have a suitable request
+                    # Needed during testing, and possibly in other cases
+                    self.message_user(request, msg, messages.SUCCESS)
 
 
 # Register and setup reversion support for Blocks and Venues
@@ -503,11 +876,11 @@ class ScheduleBlockAdminForm(forms.ModelForm):
         js = ('js/scheduledatetime.js',)
 
 
-class ScheduleBlockAdmin(VersionAdmin):
+class ScheduleBlockAdmin(BatchScheduleUpdatesMixin, VersionAdmin):
     form = ScheduleBlockAdminForm
 
 
-class VenueAdmin(VersionAdmin):
+class VenueAdmin(BatchScheduleUpdatesMixin, VersionAdmin):
     pass
 
 
@@ -0,0 +1,123 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wafer.schedule.models import ScheduleBlock, Venue, Slot, ScheduleItem
+
+
+def _format_time(value):
+    if value is None:
+        return None
+    return value.isoformat()
+
+
+def _slot_order(slots):
+    """Order the slots so previous slots always come first"""
+    children = {}
+    roots = []
+    for slot in slots:
+        if slot['previous_slot_id']:
+            children.setdefault(slot['previous_slot_id'], []).append(slot)
+        else:
+            roots.append(slot)
+    ordered = []
+    level = roots
+    while level:
+        ordered.extend(level)
+        level = [child for slot in level
+                 for child in children.get(slot['id'], [])]
+    return ordered
+
+
+def export_schedule():
+    """Return the schedule as a dictionary, suitable for
+       wafer_schedule_import"""
+    blocks = [
+        {'id': block['id'],
+         'start_time': _format_time(block['start_time']),
+         'end_time': _format_time(block['end_time'])}
+        for block in ScheduleBlock.objects.order_by('start_time').values(
+            'id', 'start_time', 'end_time')]
+
+    venue_blocks = {}
+    for venue_id, block_id in Venue.blocks.through.objects.values_list(
+            'venue_id', 'scheduleblock_id').order_by('scheduleblock_id'):
+        venue_blocks.setdefault(venue_id, []).append(block_id)
+    venues = [
+        {'id': venue['id'],
+         'name': venue['name'],
+         'order': venue['order'],
+         'notes': venue['notes'],
+         'video': venue['video'],
+         'blocks': venue_blocks.get(venue['id'], [])}
+        for venue in Venue.objects.values(
+            'id', 'name', 'order', 'notes', 'video')]
+
+    slots = [
+        {'id': slot['id'],
+         'name': slot['name'],
+         'previous_slot': slot['previous_slot_id'],
+         'start_time': _format_time(slot['start_time']),
+         'end_time': _format_time(slot['end_time'])}
+        for slot in _slot_order(Slot.objects.order_by('pk').values(
+            'id', 'name', 'previous_slot_id', 'start_time', 'end_time'))]
+
+    item_slots = {}
+    for item_id, slot_id in ScheduleItem.slots.through.objects.values_list(
+            'scheduleitem_id', 'slot_id').order_by('slot_id'):
+        item_slots.setdefault(item_id, []).append(slot_id)
+    items = [
+        {'venue': item['venue_id'],
+         'slots': item_slots.get(item['id'], []),
+         'talk': item['talk_id'],
+         'page': item['page_id'],
+         'details': item['details'],
+         'notes': item['notes'],
+         'css_class': item['css_class'],
+         'expand': item['expand']}
+        for item in ScheduleItem.objects.order_by('pk').values(
+            'id', 'venue_id', 'talk_id', 'page_id', 'details', 'notes',
+            'css_class', 'expand')]
+
+    return {
+        'blocks': blocks,
+        'venues': venues,
+        'slots': slots,
+        'items': items,
+    }
+
+
+class Command(BaseCommand):
+    help = ("Export the schedule (blocks, venues, slots and schedule items)"
+            " as a YAML or JSON document, for wafer_schedule_import.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('schedule_file', nargs='?',
+                            help='File to write to (default: stdout)')
+        parser.add_argument('--format', choices=('yaml', 'json'),
+                            help='Output format. The default is yaml for'
+                                 ' .yaml and .yml files, and json otherwise')
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        filename = options['schedule_file']
+        if not fmt:
+            if filename and filename.endswith(('.yaml', '.yml')):
+                fmt = 'yaml'
+            else:
+                fmt = 'json'
+        schedule = export_schedule()
+        if fmt == 'json':
+            data = json.dumps(schedule, indent=2)
+        else:
+            try:
+                import yaml
+            except ImportError:
+                raise CommandError('PyYAML is required for the yaml format')
+            data = yaml.safe_dump(schedule, default_flow_style=False,
+                                  allow_unicode=True, sort_keys=False)
+        if filename:
+            with open(filename, 'w') as f:
+                f.write(data)
+        else:
+            self.stdout.write(data)
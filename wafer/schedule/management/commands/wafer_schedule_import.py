@@ -0,0 +1,210 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from wafer.pages.models import Page
+from wafer.schedule.admin import check_schedule, validate_schedule
+from wafer.schedule.models import (
+    ScheduleBlock, Venue, Slot, ScheduleChange, ScheduleItem,
+    invalidate_check_schedule, record_schedule_changes,
+    suppress_schedule_signals, update_schedule_version, validate_slots)
+from wafer.talks.models import Talk
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        # YAML will parse timestamps for us
+        result = value
+    else:
+        result = parse_datetime(value)
+        if result is None:
+            raise CommandError('Invalid date & time: %s' % value)
+    if timezone.is_naive(result):
+        result = timezone.make_aware(result)
+    return result
+
+
+def _lookup(mapping, key, kind):
+    try:
+        return mapping[key]
+    except KeyError:
+        raise CommandError('Unknown %s: %s' % (kind, key))
+
+
+def _bulk_create(model, objects):
+    """Create the objects, which we need the ids of afterwards.
+
+       bulk_create only sets the ids on backends that can return them
+       from a bulk insert, so we save the objects one at a time on the
+       others (such as MySQL)."""
+    if connection.features.can_return_rows_from_bulk_insert:
+        model.objects.bulk_create(objects)
+    else:
+        for obj in objects:
+            obj.save(force_insert=True)
+
+
+class Command(BaseCommand):
+    help = ("Import the schedule (blocks, venues, slots and schedule items)"
+            " from a YAML or JSON document, as written by"
+            " wafer_schedule_export. Talks and pages are referenced by id,"
+            " and must already exist.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('schedule_file',
+                            help='YAML or JSON file to import')
+        parser.add_argument('--format', choices=('yaml', 'json'),
+                            help='Input format. The default is yaml for'
+                                 ' .yaml and .yml files, and json otherwise')
+        parser.add_argument('--replace', action='store_true',
+                            help='Delete the existing schedule first')
+
+    def _read(self, filename, fmt):
+        if not fmt:
+            if filename.endswith(('.yaml', '.yml')):
+                fmt = 'yaml'
+            else:
+                fmt = 'json'
+        with open(filename) as f:
+            if fmt == 'json':
+                return json.load(f)
+            try:
+                import yaml
+            except ImportError:
+                raise CommandError('PyYAML is required for the yaml format')
+            return yaml.safe_load(f)
+
+    def _import_blocks(self, data):
+        blocks = {}
+        for block in data:
+            blocks[block['id']] = ScheduleBlock(
+                start_time=_parse_time(block['start_time']),
+                end_time=_parse_time(block['end_time']))
+            try:
+                blocks[block['id']].full_clean()
+            except ValidationError as err:
+                raise CommandError('Invalid block %s: %s' % (
+                    block['id'], '; '.join(err.messages)))
+        # full_clean only checks the blocks against the ones already in
+        # the database, so we check the new blocks against each other
+        ordered = sorted(blocks.items(), key=lambda x: x[1].start_time)
+        for (prev_id, prev), (block_id, block) in zip(ordered, ordered[1:]):
+            if prev.end_time > block.start_time:
+                raise CommandError('Invalid block %s: Overlaps with block %s'
+                                   % (block_id, prev_id))
+        _bulk_create(ScheduleBlock, blocks.values())
+        return blocks
+
+    def _import_venues(self, data, blocks):
+        venues = {}
+        for venue in data:
+            venues[venue['id']] = Venue(
+                name=venue['name'],
+                order=venue.get('order', 1),
+                notes=venue.get('notes', ''),
+                video=venue.get('video', False))
+        _bulk_create(Venue, venues.values())
+        Venue.blocks.through.objects.bulk_create(
+            Venue.blocks.through(
+                venue_id=venues[venue['id']].pk,
+                scheduleblock_id=_lookup(blocks, block_id, 'block').pk)
+            for venue in data
+            for block_id in venue.get('blocks', []))
+        return venues
+
+    def _import_slots(self, data):
+        slots = {}
+        levels = {}
+        for slot in data:
+            if slot.get('previous_slot') is not None:
+                previous_slot = _lookup(slots, slot['previous_slot'],
+                                        'previous slot')
+                level = levels[id(previous_slot)] + 1
+            else:
+                previous_slot = None
+                level = 0
+            new_slot = Slot(
+                name=slot.get('name', ''),
+                previous_slot=previous_slot,
+                start_time=_parse_time(slot.get('start_time')),
+                end_time=_parse_time(slot['end_time']))
+            slots[slot['id']] = new_slot
+            levels[id(new_slot)] = level
+        try:
+            slot_blocks = validate_slots(list(slots.values()))
+        except ValidationError as err:
+            raise CommandError('Invalid slots: %s' % '; '.join(err.messages))
+        # We set the denormalised fields that Slot.save would, and
+        # create the slots a level of the chains at a time, so the previous
+        # slots have ids
+        by_level = {}
+        for slot, block in zip(slots.values(), slot_blocks):
+            slot.effective_start_time = slot.get_start_time()
+            slot.block = block
+            by_level.setdefault(levels[id(slot)], []).append(slot)
+        for level in sorted(by_level):
+            _bulk_create(Slot, by_level[level])
+        return slots
+
+    def _import_items(self, data, venues, slots):
+        talks = Talk.objects.in_bulk(
+            [item['talk'] for item in data if item.get('talk')])
+        pages = Page.objects.in_bulk(
+            [item['page'] for item in data if item.get('page')])
+        items = []
+        for item in data:
+            talk = page = None
+            if item.get('talk'):
+                talk = _lookup(talks, item['talk'], 'talk')
+            if item.get('page'):
+                page = _lookup(pages, item['page'], 'page')
+            items.append(ScheduleItem(
+                venue=_lookup(venues, item['venue'], 'venue'),
+                talk=talk,
+                page=page,
+                details=item.get('details', ''),
+                notes=item.get('notes', ''),
+                css_class=item.get('css_class', ''),
+                expand=item.get('expand', False)))
+        _bulk_create(ScheduleItem, items)
+        ScheduleItem.slots.through.objects.bulk_create(
+            ScheduleItem.slots.through(
+                scheduleitem_id=new_item.pk,
+                slot_id=_lookup(slots, slot_id, 'slot').pk)
+            for item, new_item in zip(data, items)
+            for slot_id in item.get('slots', []))
+        return items
+
+    def handle(self, *args, **options):
+        schedule = self._read(options['schedule_file'], options['format'])
+        with transaction.atomic(), suppress_schedule_signals():
+            if options['replace']:
+                ScheduleItem.objects.all().delete()
+                Slot.objects.all().delete()
+                Venue.objects.all().delete()
+                ScheduleBlock.objects.all().delete()
+            blocks = self._import_blocks(schedule.get('blocks', []))
+            venues = self._import_venues(schedule.get('venues', []), blocks)
+            slots = self._import_slots(schedule.get('slots', []))
+            items = self._import_items(schedule.get('items', []), venues,
+                                       slots)
+            # We don't log the individual changes, so polling clients
+            # need to fetch the whole schedule again
+            record_schedule_changes('', ScheduleChange.RESET, [None])
+        # We only update the schedule once everything is loaded
+        update_schedule_version()
+        invalidate_check_schedule()
+        self.stdout.write('Imported %d blocks, %d venues, %d slots and'
+                          ' %d schedule items' % (
+                              len(blocks), len(venues), len(slots),
+                              len(items)))
+        if not check_schedule():
+            self.stdout.write('The schedule has errors:')
+            for error in validate_schedule():
+                self.stdout.write('  %s' % error)
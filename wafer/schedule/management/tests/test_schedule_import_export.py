@@ -0,0 +1,224 @@
+# Test the wafer_schedule_import and wafer_schedule_export commands
+
+import datetime as D
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+import mock
+
+from wafer.pages.models import Page
+from wafer.schedule.admin import check_schedule
+from wafer.schedule.models import (
+    ScheduleBlock, ScheduleChange, Slot, ScheduleItem, Venue,
+    get_schedule_version)
+from wafer.schedule.tests.test_validation import make_synthetic_conference
+from wafer.talks.models import ACCEPTED
+from wafer.talks.tests.fixtures import create_talk
+from wafer.utils import QueryTracker
+
+
+def normalise(schedule):
+    """Replace the ids in an exported schedule with positions, so
+       we can compare exports from different databases"""
+    blocks = dict((block['id'], pos)
+                  for pos, block in enumerate(schedule['blocks']))
+    venues = dict((venue['id'], pos)
+                  for pos, venue in enumerate(schedule['venues']))
+    slots = dict((slot['id'], pos)
+                 for pos, slot in enumerate(schedule['slots']))
+    for block in schedule['blocks']:
+        block['id'] = blocks[block['id']]
+    for venue in schedule['venues']:
+        venue['id'] = venues[venue['id']]
+        venue['blocks'] = [blocks[x] for x in venue['blocks']]
+    for slot in schedule['slots']:
+        slot['id'] = slots[slot['id']]
+        if slot['previous_slot'] is not None:
+            slot['previous_slot'] = slots[slot['previous_slot']]
+    for item in schedule['items']:
+        item['venue'] = venues[item['venue']]
+        item['slots'] = sorted(slots[x] for x in item['slots'])
+    return schedule
+
+
+class ScheduleImportExportTests(TestCase):
+
+    def setUp(self):
+        timezone.activate('UTC')
+        self._dir = tempfile.mkdtemp()
+        block = ScheduleBlock.objects.create(
+            start_time=D.datetime(2013, 9, 22, 9, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 19, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.venue1 = Venue.objects.create(order=1, name='Venue 1')
+        self.venue2 = Venue.objects.create(order=2, name='Venue 2',
+                                           video=True)
+        self.venue1.blocks.add(block)
+        self.venue2.blocks.add(block)
+        slot1 = Slot.objects.create(
+            start_time=D.datetime(2013, 9, 22, 10, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 11, 0, 0,
+                                tzinfo=D.timezone.utc))
+        slot2 = Slot.objects.create(
+            previous_slot=slot1, name='Second',
+            end_time=D.datetime(2013, 9, 22, 12, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.talk = create_talk('Talk 1', ACCEPTED, 'author1')
+        item1 = ScheduleItem.objects.create(venue=self.venue1,
+                                            talk=self.talk)
+        item1.slots.add(slot1, slot2)
+        self.page = Page.objects.create(name='Lunch', slug='lunch')
+        item2 = ScheduleItem.objects.create(venue=self.venue2,
+                                            page=self.page,
+                                            details='Lunch',
+                                            css_class='lunch')
+        item2.slots.add(slot2)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+        timezone.deactivate()
+
+    def _export(self, filename):
+        filename = os.path.join(self._dir, filename)
+        call_command('wafer_schedule_export', filename)
+        return filename
+
+    def _read_json(self, filename):
+        with open(filename) as f:
+            return json.load(f)
+
+    def test_export(self):
+        """Test the exported document"""
+        schedule = normalise(self._read_json(self._export('schedule.json')))
+        self.assertEqual(len(schedule['blocks']), 1)
+        self.assertEqual(schedule['blocks'][0]['start_time'],
+                         '2013-09-22T09:00:00+00:00')
+        self.assertEqual([x['name'] for x in schedule['venues']],
+                         ['Venue 1', 'Venue 2'])
+        self.assertEqual(schedule['venues'][1]['blocks'], [0])
+        self.assertEqual(schedule['slots'][1]['previous_slot'], 0)
+        self.assertIsNone(schedule['slots'][1]['start_time'])
+        self.assertEqual(schedule['items'][0]['talk'], self.talk.pk)
+        self.assertEqual(schedule['items'][0]['slots'], [0, 1])
+        self.assertEqual(schedule['items'][1]['page'], self.page.pk)
+        self.assertEqual(schedule['items'][1]['css_class'], 'lunch')
+
+    def test_round_trip(self):
+        """Test that importing an export reproduces the schedule"""
+        for filename in ('schedule.json', 'schedule.yaml'):
+            exported = self._export(filename)
+            original = normalise(self._read_json(
+                self._export('original.json')))
+            version = get_schedule_version()
+            out = StringIO()
+            call_command('wafer_schedule_import', exported, replace=True,
+                         stdout=out)
+            self.assertIn('Imported 1 blocks, 2 venues, 2 slots and 2'
+                          ' schedule items', out.getvalue())
+            self.assertEqual(ScheduleItem.objects.count(), 2)
+            self.assertNotEqual(get_schedule_version(), version)
+            self.assertEqual(ScheduleChange.objects.last().action,
+                             ScheduleChange.RESET)
+            self.assertTrue(check_schedule())
+            reimported = normalise(self._read_json(
+                self._export('reimported.json')))
+            self.assertEqual(original, reimported)
+            # The denormalised slot fields are set
+            slot = Slot.objects.get(name='Second')
+            self.assertEqual(slot.effective_start_time,
+                             D.datetime(2013, 9, 22, 11, 0, 0,
+                                        tzinfo=D.timezone.utc))
+            self.assertEqual(slot.block, ScheduleBlock.objects.get())
+
+    def test_invalid_import(self):
+        """Test that a broken document doesn't change the schedule"""
+        schedule = self._read_json(self._export('schedule.json'))
+        # Overlaps with the existing slots
+        schedule['slots'][0]['start_time'] = '2013-09-22T10:30:00+00:00'
+        schedule['blocks'] = []
+        schedule['venues'] = []
+        schedule['items'] = []
+        filename = os.path.join(self._dir, 'broken.json')
+        with open(filename, 'w') as f:
+            json.dump(schedule, f)
+        with self.assertRaises(CommandError):
+            call_command('wafer_schedule_import', filename, stdout=StringIO())
+        self.assertEqual(Slot.objects.count(), 2)
+
+    def test_overlapping_blocks(self):
+        """Test that blocks that overlap each other aren't imported"""
+        schedule = self._read_json(self._export('schedule.json'))
+        schedule['blocks'] = [
+            {'id': 1, 'start_time': '2014-09-22T09:00:00+00:00',
+             'end_time': '2014-09-22T19:00:00+00:00'},
+            {'id': 2, 'start_time': '2014-09-22T18:00:00+00:00',
+             'end_time': '2014-09-23T19:00:00+00:00'},
+        ]
+        schedule['venues'] = []
+        schedule['slots'] = []
+        schedule['items'] = []
+        filename = os.path.join(self._dir, 'blocks.json')
+        with open(filename, 'w') as f:
+            json.dump(schedule, f)
+        with self.assertRaisesRegex(CommandError, 'Overlaps with block 1'):
+            call_command('wafer_schedule_import', filename, stdout=StringIO())
+        self.assertEqual(ScheduleBlock.objects.count(), 1)
+
+    def test_default_format(self):
+        """Test that files without a YAML extension are read as JSON"""
+        exported = self._export('schedule.json')
+        filename = os.path.join(self._dir, 'schedule.txt')
+        shutil.copy(exported, filename)
+        out = StringIO()
+        call_command('wafer_schedule_import', filename, replace=True,
+                     stdout=out)
+        self.assertIn('Imported 1 blocks', out.getvalue())
+
+    def test_no_bulk_insert_ids(self):
+        """Test importing on databases where bulk inserts don't return
+           the new ids"""
+        exported = self._export('schedule.json')
+        original = normalise(self._read_json(exported))
+        with mock.patch.object(type(connection.features),
+                               'can_return_rows_from_bulk_insert', False):
+            call_command('wafer_schedule_import', exported, replace=True,
+                         stdout=StringIO())
+        self.assertTrue(check_schedule())
+        reimported = normalise(self._read_json(
+            self._export('reimported.json')))
+        self.assertEqual(original, reimported)
+
+
+class LargeScheduleImportTests(TestCase):
+
+    def setUp(self):
+        timezone.activate('UTC')
+        self._dir = tempfile.mkdtemp()
+        make_synthetic_conference(10, 20, 10)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+        timezone.deactivate()
+
+    def test_large_import(self):
+        """Test that importing a large schedule uses bulk inserts"""
+        exported = os.path.join(self._dir, 'schedule.json')
+        call_command('wafer_schedule_export', exported)
+        with QueryTracker() as tracker:
+            call_command('wafer_schedule_import', exported, replace=True,
+                         stdout=StringIO())
+        self.assertEqual(ScheduleItem.objects.count(), 2000)
+        self.assertTrue(check_schedule())
+        # Mostly the deletes, which still go through the collector
+        self.assertLess(len(tracker.queries), 200)
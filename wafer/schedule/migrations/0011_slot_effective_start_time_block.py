@@ -0,0 +1,56 @@
+# Denormalise the effective start time and the block of the slots,
+# so they can be queried without walking the previous_slot chain.
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_slot_start_time_and_block(apps, schema_editor):
+    """Fill in the denormalised fields for the existing slots"""
+    Slot = apps.get_model('schedule', 'Slot')
+    ScheduleBlock = apps.get_model('schedule', 'ScheduleBlock')
+    blocks = list(ScheduleBlock.objects.order_by('start_time'))
+    slots = {slot.pk: slot for slot in Slot.objects.all()}
+
+    def get_root(slot):
+        seen = set()
+        while slot.previous_slot_id and slot.pk not in seen:
+            seen.add(slot.pk)
+            slot = slots[slot.previous_slot_id]
+        return slot
+
+    for slot in slots.values():
+        if slot.previous_slot_id:
+            slot.effective_start_time = slots[slot.previous_slot_id].end_time
+        else:
+            slot.effective_start_time = slot.start_time
+        root = get_root(slot)
+        slot.block = None
+        for block in blocks:
+            if (root.start_time and block.start_time <= root.start_time and
+                    block.end_time >= root.end_time):
+                slot.block = block
+                break
+        slot.save(update_fields=['effective_start_time', 'block'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0010_cleanup_old_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slot',
+            name='effective_start_time',
+            field=models.DateTimeField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='slot',
+            name='block',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='schedule.scheduleblock'),
+        ),
+        migrations.RunPython(populate_slot_start_time_and_block,
+                             migrations.RunPython.noop),
+    ]
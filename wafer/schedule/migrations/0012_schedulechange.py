@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0011_slot_effective_start_time_block'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(blank=True, choices=[('block', 'Schedule block'), ('venue', 'Venue'), ('slot', 'Slot'), ('item', 'Schedule item')], max_length=16)),
+                ('object_id', models.IntegerField(blank=True, null=True)),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted'), ('reset', 'Reset')], max_length=16)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
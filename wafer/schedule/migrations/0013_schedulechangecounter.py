@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0012_schedulechange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleChangeCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pruned', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
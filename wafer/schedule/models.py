@@ -1,12 +1,19 @@
+import functools
+import heapq
+import threading
+from collections import Counter
+from contextlib import contextmanager
 from uuid import UUID
 
-from django.core.cache import cache
+from django.conf import settings
+from django.core.cache import caches
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models.signals import post_save, post_delete
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
 from django.urls import reverse
 from django.utils.crypto import salted_hmac
 from django.utils.translation import gettext_lazy as _
+from django.utils import timezone
 from django.utils.timezone import localtime
 
 from wafer.pages.models import Page
@@ -33,6 +40,33 @@ def overlap(obj1, obj2):
     return True
 
 
+def find_overlaps(entries):
+    """Find the overlapping entries in a list of (obj, value) pairs,
+       where the objs are slots or blocks.
+
+       This sweeps over the entries in order of start time, keeping the
+       entries which haven't ended yet in a heap, so it takes
+       O(n log n) time, plus the number of overlaps found.
+
+       Returns a list of (earlier entry, later entry) pairs."""
+    # We use the position to break ties, so the results are stable and
+    # we never need to compare the values
+    entries = sorted(
+        ((obj.get_start_time(), obj.end_time, pos, obj, value)
+         for pos, (obj, value) in enumerate(entries)),
+        key=lambda x: x[:3])
+    active = []
+    overlaps = []
+    for start_time, end_time, pos, obj, value in entries:
+        while active and active[0][0] <= start_time:
+            heapq.heappop(active)
+        for _end_time, _pos, other, other_value in active:
+            if overlap(other, obj):
+                overlaps.append(((other, other_value), (obj, value)))
+        heapq.heappush(active, (end_time, pos, obj, value))
+    return overlaps
+
+
 class ScheduleBlock(models.Model):
     """Blocks into which we'll break the schedule.
 
@@ -60,11 +94,11 @@ class ScheduleBlock(models.Model):
         if self.start_time >= self.end_time:
             raise ValidationError("Start time must be before end time")
         # Validate that we don't overlap any existing blocks
-        for other_block in ScheduleBlock.objects.all():
-            if other_block.pk == self.pk:
-                continue
-            if overlap(self, other_block):
-                raise ValidationError("Overlaps with %s" % other_block)
+        other_block = ScheduleBlock.objects.filter(
+            start_time__lt=self.end_time, end_time__gt=self.start_time
+        ).exclude(pk=self.pk).first()
+        if other_block:
+            raise ValidationError("Overlaps with %s" % other_block)
 
 
 class Venue(models.Model):
@@ -117,6 +151,14 @@ class Slot(models.Model):
                             help_text=_("Identifier for use in the admin"
                                         " panel"))
 
+    # These are denormalised from the previous_slot chain, so we can
+    # filter on them in the database. They are maintained by save, and
+    # cascaded down the chain when a slot or block changes.
+    effective_start_time = models.DateTimeField(
+        null=True, editable=False, db_index=True)
+    block = models.ForeignKey(ScheduleBlock, null=True, editable=False,
+                              on_delete=models.SET_NULL)
+
     class Meta:
         ordering = ['end_time', 'start_time']
 
@@ -140,8 +182,15 @@ class Slot(models.Model):
         return self.end_time.date() == self.get_start_time().date()
 
     def get_start_time(self):
-        if self.previous_slot:
-            return self.previous_slot.end_time
+        # Prefer the previous slot if we already have it, since it
+        # may have been changed in memory, or not saved yet
+        if Slot.previous_slot.is_cached(self):
+            if self.previous_slot is not None:
+                return self.previous_slot.end_time
+        elif self.previous_slot_id:
+            if self.effective_start_time is None:
+                return self.previous_slot.end_time
+            return self.effective_start_time
         return self.start_time
 
     def get_formatted_start_time(self):
@@ -166,21 +215,85 @@ class Slot(models.Model):
         result['hours'], result['minutes'] = divmod(duration // 60, 60)
         return result
 
-    def get_block(self):
-        if self.previous_slot:
-            return self.previous_slot.get_block()
-        blocks = ScheduleBlock.objects.filter(
-            start_time__lte=self.get_start_time(),
-            end_time__gte=self.end_time)
-        if blocks:
-            # We assume blocks don't overlap, so this is unique
-            return blocks.first()
+    def _get_previous_slot(self):
+        """Return the previous slot, which may not be saved yet"""
+        if self.previous_slot_id or Slot.previous_slot.is_cached(self):
+            return self.previous_slot
         return None
 
+    def _calculate_block(self):
+        """Find the block from the previous slot or our times, ignoring
+           the stored block."""
+        previous_slot = self._get_previous_slot()
+        if previous_slot:
+            return previous_slot.get_block()
+        # We assume blocks don't overlap, so this is unique
+        return ScheduleBlock.objects.filter(
+            start_time__lte=self.start_time,
+            end_time__gte=self.end_time).first()
+
+    def get_block(self):
+        if self.block_id and not self._state.adding:
+            return self.block
+        return self._calculate_block()
+
     get_block.short_description = _('Schedule Block')
 
-    def clean(self):
-        """Ensure we have start_time < end_time"""
+    # The fields that determine the times of the slot and the slots
+    # following it
+    TIME_FIELDS = ('start_time', 'end_time', 'previous_slot_id')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_times = instance._get_times()
+        return instance
+
+    def _get_times(self):
+        # We don't load deferred fields, we just don't know if they
+        # changed
+        if any(field not in self.__dict__ for field in self.TIME_FIELDS):
+            return None
+        return tuple(self.__dict__[field] for field in self.TIME_FIELDS)
+
+    def save(self, *args, **kwargs):
+        times = self._get_times()
+        loaded_times = getattr(self, '_loaded_times', None)
+        self.times_changed = times is None or times != loaded_times
+        previous_slot = self._get_previous_slot()
+        if previous_slot:
+            self.effective_start_time = previous_slot.end_time
+        else:
+            self.effective_start_time = self.start_time
+        self.block = self._calculate_block()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {
+                'effective_start_time', 'block'}
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._update_following_slots()
+        self._loaded_times = times
+
+    def _update_following_slots(self):
+        """Cascade changes down the previous_slot chain.
+
+           Only the slots directly following this one start at our end
+           time, but the whole chain shares our block."""
+        following = Slot.objects.filter(previous_slot=self)
+        changed = list(following.exclude(block_id=self.block_id)
+                       .values_list('pk', flat=True))
+        following.update(effective_start_time=self.end_time,
+                         block_id=self.block_id)
+        while changed:
+            following = Slot.objects.filter(previous_slot_id__in=changed)
+            changed = list(following.exclude(block_id=self.block_id)
+                           .values_list('pk', flat=True))
+            Slot.objects.filter(pk__in=changed).update(
+                block_id=self.block_id)
+
+    def _clean_times(self):
+        """Check the slot's own times"""
         if not self.previous_slot and not self.start_time:
             raise ValidationError("Slots must have a start time"
                                   " or previous slot set")
@@ -191,37 +304,105 @@ class Slot(models.Model):
         if self.start_time and self.previous_slot:
             raise ValidationError("Slots with a previous slot should not "
                                   "have a start_time set")
+
+    def clean(self):
+        """Ensure we have start_time < end_time"""
+        self._clean_times()
         # Validate that we are within the bounds of the block
-        block = self.get_block()
+        block = self._calculate_block()
         if not block:
             raise ValidationError("Slot does not fall within any defined block")
-        # Validate that we don't overlap any existing slots
-        # This isn't very efficient, but OK because it's a once off
-        # validation cost.
-        for other_slot in Slot.objects.all():
-            if other_slot.pk == self.pk:
-                continue
-            if other_slot.get_block() != self.get_block():
-                # Different Schedule Blocks don't overlap
-                continue
-            if other_slot.previous_slot == self:
-                # Only need to check against other_slot end_time
-                # since our end_time is the other_slot's start_time
-                if self.end_time >= other_slot.end_time:
-                    raise ValidationError("Overlaps with %s" % other_slot)
-                if self.get_start_time() >= other_slot.end_time:
-                    raise ValidationError("Overlaps with %s" % other_slot)
-            elif self.previous_slot == other_slot:
-                # We only need to test against our end time, since
-                # our start time is the end time of the other_slot
-                if other_slot.end_time >= self.end_time:
-                    raise ValidationError("Overlaps with %s" % other_slot)
-                if other_slot.get_start_time() >= self.end_time:
-                    raise ValidationError("Overlaps with %s" % other_slot)
-            elif overlap(self, other_slot):
+        # Validate that we don't overlap any existing slots.
+        # The slots before and after us in the chain share a boundary
+        # with us, so we check them separately
+        start_time = self.get_start_time()
+        following = []
+        if self.pk:
+            following = list(Slot.objects.filter(previous_slot=self))
+        for other_slot in following:
+            # Only need to check against other_slot end_time
+            # since our end_time is the other_slot's start_time
+            if self.end_time >= other_slot.end_time:
+                raise ValidationError("Overlaps with %s" % other_slot)
+        if self.previous_slot:
+            other_slot = self.previous_slot
+            # We only need to test against our end time, since
+            # our start time is the end time of the other_slot
+            if other_slot.end_time >= self.end_time:
+                raise ValidationError("Overlaps with %s" % other_slot)
+        others = Slot.objects.filter(
+            block_id=block.pk, effective_start_time__lt=self.end_time,
+            end_time__gt=start_time).exclude(
+                pk__in=[x.pk for x in following])
+        if self.pk:
+            others = others.exclude(pk=self.pk)
+        if self.previous_slot_id:
+            others = others.exclude(pk=self.previous_slot_id)
+        for other_slot in others:
+            if overlap(self, other_slot):
                 raise ValidationError("Overlaps with %s" % other_slot)
 
 
+def validate_slots(slots):
+    """Validate a batch of new slots together.
+
+       This makes the same checks as calling full_clean on each slot, but
+       loads the existing slots in the affected blocks once, and checks
+       for overlaps with a single sweep over each block, rather than
+       querying for every slot.
+
+       Slots may use earlier slots in the batch as their previous slot.
+       Raises a ValidationError listing all the problems found, and
+       otherwise returns the block for each slot."""
+    errors = []
+    all_blocks = list(ScheduleBlock.objects.all())
+    # We can't hash unsaved slots, so we key these by id
+    blocks = {}
+    for slot in slots:
+        try:
+            # We check the previous slot below, since it may not be
+            # saved yet
+            slot.clean_fields(exclude=['previous_slot'])
+            slot._clean_times()
+        except ValidationError as err:
+            errors.extend(err.messages)
+            continue
+        previous_slot = slot._get_previous_slot()
+        if previous_slot is None:
+            block = None
+            for candidate in all_blocks:
+                if (candidate.start_time <= slot.start_time and
+                        candidate.end_time >= slot.end_time):
+                    block = candidate
+                    break
+        elif id(previous_slot) in blocks:
+            block = blocks[id(previous_slot)]
+        else:
+            block = previous_slot.get_block()
+        if not block:
+            errors.append("%s does not fall within any defined block" % slot)
+            continue
+        blocks[id(slot)] = block
+    if errors:
+        raise ValidationError(errors)
+    entries = {}
+    batch_pks = [slot.pk for slot in slots if slot.pk]
+    for other_slot in Slot.objects.filter(
+            block_id__in=set(block.pk for block in blocks.values())).exclude(
+                pk__in=batch_pks):
+        entries.setdefault(other_slot.block_id, []).append((other_slot, False))
+    for slot in slots:
+        entries.setdefault(blocks[id(slot)].pk, []).append((slot, True))
+    for block_entries in entries.values():
+        for (slot, new), (other_slot, other_new) in find_overlaps(
+                block_entries):
+            if new or other_new:
+                errors.append("%s overlaps with %s" % (slot, other_slot))
+    if errors:
+        raise ValidationError(errors)
+    return [blocks[id(slot)] for slot in slots]
+
+
 class ScheduleItem(models.Model):
 
     venue = models.ForeignKey(Venue,
@@ -360,24 +541,236 @@ class ScheduleItem(models.Model):
 
         We return static GUIDs across re-scheduling, when possible.
         """
-        if self.talk:
-            id_ = 'talk:' + str(self.talk.pk)
-        elif self.page and self.page.scheduleitem_set.count() == 1:
-            id_ = 'page:' + str(self.page.pk)
+        page_items = None
+        if not self.talk_id and self.page_id:
+            page_items = self.page.scheduleitem_set.count()
+        return self._make_guid(page_items)
+
+    def _make_guid(self, page_items):
+        """Return the GUID, given the number of schedule items for
+           our page."""
+        if self.talk_id:
+            id_ = 'talk:' + str(self.talk_id)
+        elif self.page_id and page_items == 1:
+            id_ = 'page:' + str(self.page_id)
         else:
             id_ = 'schedule_item:' + str(self.pk)
         hmac = salted_hmac('wafer-event-uuid', id_)
         return UUID(bytes=hmac.digest()[:16])
 
 
+def get_schedule_item_guids(items):
+    """Return the GUIDs for all the schedule items, by pk, without
+       querying the number of schedule items for each page.
+
+       items must include all the schedule items for the pages."""
+    page_items = Counter(item.page_id for item in items if item.page_id)
+    return dict((item.pk, item._make_guid(page_items[item.page_id]))
+                for item in items)
+
+
+class ScheduleChange(models.Model):
+    """A change to the schedule, so clients can poll for the changes
+       since the last time they checked.
+
+       The id is used as the sequence number of the change."""
+
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    # The whole schedule may have changed (e.g. after an import)
+    RESET = 'reset'
+
+    ACTION_CHOICES = (
+        (CREATED, _('Created')),
+        (UPDATED, _('Updated')),
+        (DELETED, _('Deleted')),
+        (RESET, _('Reset')),
+    )
+
+    KIND_CHOICES = (
+        ('block', _('Schedule block')),
+        ('venue', _('Venue')),
+        ('slot', _('Slot')),
+        ('item', _('Schedule item')),
+    )
+
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES, blank=True)
+    object_id = models.IntegerField(null=True, blank=True)
+    action = models.CharField(max_length=16, choices=ACTION_CHOICES)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return u'%s: %s %s %s' % (self.pk, self.action, self.kind,
+                                  self.object_id)
+
+
+class ScheduleChangeCounter(models.Model):
+    """A single row, which is locked while changes are added to the
+       change log.
+
+       The lock is held until the transaction commits, so the changes
+       are numbered in the order that they commit, and clients never
+       miss a change that commits after one they've already seen. It
+       also records how much of the log has been pruned."""
+
+    # The changes up to this sequence number have been deleted
+    pruned = models.IntegerField(default=0)
+
+
+# The number of changes we keep in the change log. Clients that ask for
+# older changes are told to fetch the whole schedule again.
+SCHEDULE_CHANGES_KEPT = 10000
+
+
+SCHEDULE_VERSION_KEY = 'wafer_schedule_version'
+
+
 def get_schedule_version():
     """Return the current schedule version as a string"""
-    version = cache.get('wafer_schedule_version')
+    version = caches[settings.WAFER_CACHE].get(SCHEDULE_VERSION_KEY)
     if not version:
         version = update_schedule_version()
     return version
 
 
+_suppressed = threading.local()
+
+
+@contextmanager
+def suppress_schedule_signals():
+    """Disable the schedule signal handlers in this thread.
+
+       This is used for bulk changes to the schedule. The caller is
+       responsible for updating the schedule version and checking the
+       schedule afterwards."""
+    previous = getattr(_suppressed, 'active', False)
+    _suppressed.active = True
+    try:
+        yield
+    finally:
+        _suppressed.active = previous
+
+
+def schedule_receiver(func):
+    """Decorator for the schedule signal handlers, so they can be
+       suppressed by suppress_schedule_signals."""
+    @functools.wraps(func)
+    def wrapper(*args, **kw):
+        if getattr(_suppressed, 'active', False):
+            return None
+        return func(*args, **kw)
+    return wrapper
+
+
+_batches = threading.local()
+
+
+def _following_slot_ids(slot_ids):
+    """Return the given slots, and all the slots following them"""
+    # We only follow the chains from these slots, a level at a time,
+    # and only look up the ids
+    all_ids = set(slot_ids)
+    parents = set(slot_ids)
+    while parents:
+        parents = set(Slot.objects.filter(
+            previous_slot_id__in=parents).values_list(
+            'pk', flat=True)) - all_ids
+        all_ids.update(parents)
+    return all_ids
+
+
+class ScheduleUpdateBatch(object):
+    """The updates to the cached schedule state needed after changes
+       to the schedule.
+
+       The signal handlers record what has changed, and the updates are
+       applied once for all the changes."""
+
+    def __init__(self):
+        self.version = False
+        self.invalidate = False
+        self.item_ids = set()
+        # Slots whose times may have changed
+        self.slot_ids = set()
+        # Slots whose schedule items need their last_updated time changed
+        self.updated_slot_ids = set()
+        # Slots whose times changed, so the items in the following slots
+        # need their last_updated time changed as well
+        self.moved_slot_ids = set()
+
+    def add(self, version=False, invalidate=False, item_ids=(), slot_ids=(),
+            updated_slot_ids=(), moved_slot_ids=()):
+        self.version = self.version or version
+        self.invalidate = self.invalidate or invalidate
+        self.item_ids.update(item_ids)
+        self.slot_ids.update(slot_ids)
+        self.updated_slot_ids.update(updated_slot_ids)
+        self.moved_slot_ids.update(moved_slot_ids)
+
+    def apply(self):
+        from wafer.schedule.admin import (
+            invalidate_validation, update_validation)
+        updated_slot_ids = set(self.updated_slot_ids)
+        if self.moved_slot_ids:
+            updated_slot_ids.update(_following_slot_ids(self.moved_slot_ids))
+        if updated_slot_ids:
+            touch_schedule_items(updated_slot_ids)
+        if self.invalidate:
+            invalidate_validation()
+        elif self.item_ids or self.slot_ids:
+            item_ids = set(self.item_ids)
+            if self.slot_ids:
+                slot_ids = _following_slot_ids(self.slot_ids)
+                item_ids.update(ScheduleItem.slots.through.objects.filter(
+                    slot_id__in=slot_ids).values_list('scheduleitem_id',
+                                                      flat=True))
+            update_validation(item_ids=item_ids,
+                              slots_changed=bool(self.slot_ids))
+        if self.version:
+            update_schedule_version()
+
+
+def record_schedule_update(**kw):
+    """Record a change to the schedule.
+
+       This is applied once the transaction commits, so other processes
+       don't see the new schedule version before the changes. Within a
+       batch_schedule_updates block, it's applied with the rest of the
+       batch."""
+    batch = getattr(_batches, 'current', None)
+    if batch is None:
+        batch = ScheduleUpdateBatch()
+        batch.add(**kw)
+        transaction.on_commit(batch.apply)
+    else:
+        batch.add(**kw)
+
+
+@contextmanager
+def batch_schedule_updates():
+    """Collect the schedule updates from the signal handlers in this block,
+       and apply them once, after the transaction commits.
+
+       This avoids updating the schedule version and validation for
+       every object saved in bulk edits."""
+    if getattr(_batches, 'current', None) is not None:
+        # Nested, so the outer block will apply the updates
+        yield _batches.current
+        return
+    batch = ScheduleUpdateBatch()
+    _batches.current = batch
+    try:
+        yield batch
+    finally:
+        _batches.current = None
+        transaction.on_commit(batch.apply)
+
+
+@schedule_receiver
 def invalidate_check_schedule(*args, **kw):
     sender = kw.pop('sender', None)
     if sender is Talk or sender is Page:
@@ -386,31 +779,238 @@ def invalidate_check_schedule(*args, **kw):
         instance = kw.pop('instance')
         if not instance.get_in_schedule():
             return
-    from wafer.schedule.admin import check_schedule
-    check_schedule.invalidate()
+    record_schedule_update(invalidate=True)
+
+
+@schedule_receiver
+def update_item_validation(*args, **kw):
+    """Recheck the parts of the schedule affected by a change to a
+       schedule item."""
+    record_schedule_update(item_ids=[kw['instance'].pk])
+
+
+@schedule_receiver
+def update_slot_validation(*args, **kw):
+    """Recheck the schedule items in this slot and the following slots,
+       since their times may have changed."""
+    record_schedule_update(slot_ids=[kw['instance'].pk])
+
+
+@schedule_receiver
+def update_talk_page_validation(*args, **kw):
+    """Recheck the schedule items for a talk or page in the schedule"""
+    instance = kw['instance']
+    if not instance.get_in_schedule():
+        return
+    record_schedule_update(item_ids=set(
+        instance.scheduleitem_set.values_list('pk', flat=True)))
 
 
+@schedule_receiver
+def update_schedule_version_if_scheduled(*args, **kw):
+    """Talks and pages only change the schedule version if they are
+       in the schedule"""
+    instance = kw.pop('instance')
+    if instance.get_in_schedule():
+        record_schedule_update(version=True)
+
+
+@schedule_receiver
+def schedule_changed(*args, **kw):
+    record_schedule_update(version=True)
+
+
+@schedule_receiver
+def schedule_relations_changed(*args, **kw):
+    """Update the schedule when the many-to-many relations used
+       by the schedule (slots, venue blocks, authors, page people) change.
+
+       These don't trigger post_save on the model, and may be updated
+       after the model has been saved (e.g. by the admin forms)."""
+    if not kw.get('action', '').startswith('post_'):
+        return
+    instance = kw.get('instance')
+    if isinstance(instance, (Talk, Page)) and not instance.get_in_schedule():
+        return
+    if isinstance(instance, ScheduleItem):
+        record_schedule_update(version=True, item_ids=[instance.pk])
+    elif isinstance(instance, Slot) and kw.get('pk_set'):
+        record_schedule_update(version=True, item_ids=kw['pk_set'])
+    elif isinstance(instance, (Talk, Page)):
+        record_schedule_update(version=True, item_ids=set(
+            instance.scheduleitem_set.values_list('pk', flat=True)))
+    else:
+        # Venue blocks, or changes from the other side of the relation
+        # which we can't track cheaply
+        record_schedule_update(version=True, invalidate=True)
+
+
+def touch_schedule_items(slot_ids):
+    """Update the last_updated time of all the schedule items in these
+       slots.
+
+       This is a single UPDATE, so it doesn't send any signals for the
+       schedule items."""
+    item_ids = ScheduleItem.slots.through.objects.filter(
+        slot_id__in=slot_ids).values('scheduleitem_id')
+    ScheduleItem.objects.filter(pk__in=item_ids).update(
+        last_updated=timezone.now())
+
+
+@schedule_receiver
 def update_schedule_items(*args, **kw):
-    """We save all the schedule items associated with this slot, so
-       the last_update time is updated to reflect any changes to the
-       timing of the slots"""
+    """Update the last_updated time of the schedule items affected
+       by changes to this slot.
+
+       If the slot's times changed, the times of the following slots may
+       have changed as well, so their items are updated too."""
     slot = kw.pop('instance', None)
     if not slot:
         return
-    for item in slot.scheduleitem_set.all():
-        item.save(update_fields=['last_updated'])
-    # We also need to update the next slot, in case we changed its
-    # times as well
-    next_slot = slot.slot_set.all()
-    if next_slot.count():
-        # From the way we structure the slot tree, we know that
-        # there's only 1 next slot that could have changed.
-        for item in next_slot[0].scheduleitem_set.all():
-            item.save(update_fields=['last_updated'])
+    if getattr(slot, 'times_changed', True):
+        record_schedule_update(moved_slot_ids=[slot.pk])
+    else:
+        record_schedule_update(updated_slot_ids=[slot.pk])
+
+
+@schedule_receiver
+def update_slot_blocks(*args, **kw):
+    """Update the stored block of the slots after a block changes"""
+    blocks = list(ScheduleBlock.objects.all())
+    with transaction.atomic():
+        for slot in Slot.objects.filter(previous_slot__isnull=True):
+            block_id = None
+            for block in blocks:
+                if (block.start_time <= slot.start_time and
+                        block.end_time >= slot.end_time):
+                    block_id = block.pk
+                    break
+            if slot.block_id != block_id:
+                slot.block_id = block_id
+                Slot.objects.filter(pk=slot.pk).update(block_id=block_id)
+                slot._update_following_slots()
+
+
+CHANGE_KINDS = {
+    ScheduleBlock: 'block',
+    Venue: 'venue',
+    Slot: 'slot',
+    ScheduleItem: 'item',
+}
+
+
+def record_schedule_changes(kind, action, object_ids):
+    """Add entries to the schedule change log.
+
+       The ScheduleChangeCounter row is locked first, so the sequence
+       numbers follow the order the transactions commit in, and the
+       oldest changes are pruned once there are more than
+       SCHEDULE_CHANGES_KEPT."""
+    object_ids = sorted(object_ids, key=lambda x: (x is not None, x))
+    if not object_ids:
+        return
+    with transaction.atomic():
+        counter, _created = (ScheduleChangeCounter.objects
+                             .select_for_update().get_or_create(pk=1))
+        changes = ScheduleChange.objects.bulk_create(
+            ScheduleChange(kind=kind, action=action, object_id=object_id)
+            for object_id in object_ids)
+        latest = changes[-1].pk
+        if latest is None:
+            # The database doesn't return the ids from bulk inserts
+            latest = ScheduleChange.objects.order_by('-pk').values_list(
+                'pk', flat=True)[0]
+        # We prune in batches, rather than on every change
+        if latest - counter.pruned > SCHEDULE_CHANGES_KEPT * 1.1:
+            counter.pruned = latest - SCHEDULE_CHANGES_KEPT
+            ScheduleChange.objects.filter(pk__lte=counter.pruned).delete()
+            counter.save(update_fields=['pruned'])
+
+
+@schedule_receiver
+def log_schedule_saved(*args, **kw):
+    instance = kw['instance']
+    action = ScheduleChange.CREATED if kw['created'] else (
+        ScheduleChange.UPDATED)
+    record_schedule_changes(CHANGE_KINDS[kw['sender']], action,
+                            [instance.pk])
+    if (isinstance(instance, Slot) and not kw['created'] and
+            getattr(instance, 'times_changed', True)):
+        # The times of the following slots may have changed as well
+        following = _following_slot_ids([instance.pk])
+        following.discard(instance.pk)
+        record_schedule_changes('slot', ScheduleChange.UPDATED, following)
+
+
+@schedule_receiver
+def log_schedule_deleted(*args, **kw):
+    record_schedule_changes(CHANGE_KINDS[kw['sender']],
+                            ScheduleChange.DELETED, [kw['instance'].pk])
+
+
+@schedule_receiver
+def log_schedule_relations_changed(*args, **kw):
+    """Log changes to the slots of an item, or the blocks of a venue"""
+    if not kw.get('action', '').startswith('post_'):
+        return
+    instance = kw['instance']
+    if isinstance(instance, (ScheduleItem, Venue)):
+        record_schedule_changes(CHANGE_KINDS[type(instance)],
+                                ScheduleChange.UPDATED, [instance.pk])
+    elif kw.get('pk_set'):
+        # Changed from the slot or block side of the relation
+        kind = 'item' if isinstance(instance, Slot) else 'venue'
+        record_schedule_changes(kind, ScheduleChange.UPDATED, kw['pk_set'])
+
+
+@schedule_receiver
+def log_talk_page_changed(*args, **kw):
+    """Log the schedule items for a talk or page in the schedule as
+       updated, since the title, authors and so forth may have changed"""
+    instance = kw['instance']
+    if not instance.get_in_schedule():
+        return
+    record_schedule_changes(
+        'item', ScheduleChange.UPDATED,
+        instance.scheduleitem_set.values_list('pk', flat=True))
+
+
+@schedule_receiver
+def log_people_changed(*args, **kw):
+    """Log the schedule items for talks or pages whose people changed"""
+    if not kw.get('action', '').startswith('post_'):
+        return
+    instance = kw['instance']
+    if isinstance(instance, (Talk, Page)):
+        log_talk_page_changed(instance=instance)
+    elif kw.get('pk_set'):
+        field = 'talk_id__in' if kw['model'] is Talk else 'page_id__in'
+        record_schedule_changes(
+            'item', ScheduleChange.UPDATED,
+            ScheduleItem.objects.filter(**{field: kw['pk_set']})
+            .values_list('pk', flat=True))
+
+
+def get_schedule_changes(since=0, limit=None):
+    """Return the schedule changes after the given sequence number.
+
+       If the changes after it have been pruned, a single reset change
+       is returned instead, numbered as the latest change."""
+    pruned = ScheduleChangeCounter.objects.filter(pk=1).values_list(
+        'pruned', flat=True).first() or 0
+    if since < pruned:
+        latest = ScheduleChange.objects.order_by('-pk').first()
+        return [ScheduleChange(pk=latest.pk, action=ScheduleChange.RESET,
+                               timestamp=latest.timestamp)]
+    changes = ScheduleChange.objects.filter(pk__gt=since).order_by('pk')
+    if limit is not None:
+        changes = changes[:limit]
+    return list(changes)
 
 
 def update_schedule_version(*args, **kwargs):
-    """Store the schedule version in the Django cache.
+    """Store the schedule version in the wafer cache, so it's shared
+    between processes.
 
     The version is used to allow clients to perform conditional HTTP requests
     on the schedule.
@@ -419,22 +1019,57 @@ def update_schedule_version(*args, **kwargs):
     deletions.
     """
     version = localtime().isoformat()
-    cache.set('wafer_schedule_version', version, timeout=None)
+    caches[settings.WAFER_CACHE].set(SCHEDULE_VERSION_KEY, version,
+                                     timeout=None)
     return version
 
 
+# This needs to happen before the other signals, so the slots are
+# correct when the schedule is checked
+post_save.connect(update_slot_blocks, sender=ScheduleBlock)
+
+# Changes to blocks and venues can affect the validity of large parts
+# of the schedule, so we check everything again
+for sender in (ScheduleBlock, Venue):
+    post_save.connect(invalidate_check_schedule, sender=sender)
+    post_delete.connect(invalidate_check_schedule, sender=sender)
+
+# Deleting a slot removes it from the schedule items without any
+# signal, so we can't tell which items to recheck
+post_delete.connect(invalidate_check_schedule, sender=Slot)
+post_save.connect(update_slot_validation, sender=Slot)
+
+post_save.connect(update_item_validation, sender=ScheduleItem)
+post_delete.connect(update_item_validation, sender=ScheduleItem)
+
 for sender in (ScheduleBlock, Venue, Slot, ScheduleItem):
-    for receiver in (invalidate_check_schedule, update_schedule_version):
-        post_save.connect(receiver, sender=sender)
-        post_delete.connect(receiver, sender=sender)
+    post_save.connect(schedule_changed, sender=sender)
+    post_delete.connect(schedule_changed, sender=sender)
 
 # We also hook up calls from Page and Talk, so
 # changes to those reflect in the schedule immediately
 # We don't hook up the delete signals, because the deletion
 # of the related ScheduleItem will do the right thing
 # if they are in the schedule
-post_save.connect(invalidate_check_schedule, sender=Talk)
-post_save.connect(invalidate_check_schedule, sender=Page)
+post_save.connect(update_talk_page_validation, sender=Talk)
+post_save.connect(update_talk_page_validation, sender=Page)
+post_save.connect(update_schedule_version_if_scheduled, sender=Talk)
+post_save.connect(update_schedule_version_if_scheduled, sender=Page)
+
+for sender in (ScheduleItem.slots.through, Venue.blocks.through,
+               Talk.authors.through, Page.people.through):
+    m2m_changed.connect(schedule_relations_changed, sender=sender)
 
 # Hook up post save connection between slots and schedule items
 post_save.connect(update_schedule_items, sender=Slot)
+
+# Record the changes for the clients polling the schedule
+for sender in (ScheduleBlock, Venue, Slot, ScheduleItem):
+    post_save.connect(log_schedule_saved, sender=sender)
+    post_delete.connect(log_schedule_deleted, sender=sender)
+for sender in (ScheduleItem.slots.through, Venue.blocks.through):
+    m2m_changed.connect(log_schedule_relations_changed, sender=sender)
+for sender in (Talk, Page):
+    post_save.connect(log_talk_page_changed, sender=sender)
+for sender in (Talk.authors.through, Page.people.through):
+    m2m_changed.connect(log_people_changed, sender=sender)
@@ -0,0 +1,192 @@
+"""Writer for the pentabarf / frab XML version of the schedule"""
+
+from io import BytesIO
+from xml.sax.saxutils import XMLGenerator
+
+from django.conf import settings
+from django.utils.timezone import localtime
+
+from wafer import __version__
+from wafer.schedule.models import get_schedule_item_guids
+
+
+class PentabarfWriter(object):
+    """Write the schedule as pentabarf XML.
+
+       The events for each room are collected in a single pass over the
+       layout of each schedule page, rather than searching the rows for
+       each room."""
+
+    def __init__(self, out, site, contacts=None,
+                 render_description=False):
+        self.xml = XMLGenerator(out, encoding='utf-8',
+                                short_empty_elements=True)
+        self.site = site
+        # The email addresses of the people, by id, if we show them
+        self.contacts = contacts
+        self.render_description = render_description
+        self._depth = 0
+
+    def _newline(self):
+        self.xml.ignorableWhitespace('\n' + '  ' * self._depth)
+
+    def start(self, name, attrs=None):
+        self._newline()
+        self.xml.startElement(name, attrs or {})
+        self._depth += 1
+
+    def end(self, name, newline=True):
+        self._depth -= 1
+        if newline:
+            self._newline()
+        self.xml.endElement(name)
+
+    def element(self, name, text='', attrs=None):
+        self._newline()
+        self.xml.startElement(name, attrs or {})
+        if text:
+            self.xml.characters(str(text))
+        self.xml.endElement(name)
+
+    def write(self, schedule_pages, schedule_version, all_items):
+        """Write the document for the given schedule pages.
+
+           all_items is used to work out the GUIDs of the schedule
+           items."""
+        guids = get_schedule_item_guids(all_items)
+        self.xml.startDocument()
+        self.xml.startElement('schedule', {})
+        self._depth += 1
+        self.element('generator', attrs={'name': 'wafer',
+                                         'version': __version__})
+        self.element('version', schedule_version)
+        self.write_conference(schedule_pages)
+        for index, page in enumerate(schedule_pages, 1):
+            self.write_day(page, index, guids)
+        self.end('schedule')
+        self.xml.ignorableWhitespace('\n')
+        self.xml.endDocument()
+
+    def write_conference(self, schedule_pages):
+        self.start('conference')
+        self.element('title', self.site.name)
+        if schedule_pages:
+            self.element('start', localtime(
+                schedule_pages[0].block.start_time).strftime('%Y-%m-%d'))
+            self.element('end', localtime(
+                schedule_pages[-1].block.end_time).strftime('%Y-%m-%d'))
+            self.element('days', len(schedule_pages))
+        self.element('timeslot_duration', '00:15')
+        self.element('base_url', 'https://%s' % self.site.domain)
+        self.element('time_zone_name', settings.TIME_ZONE)
+        self.element('acronym', settings.WAFER_CONFERENCE_ACRONYM)
+        self.end('conference')
+
+    def write_day(self, page, index, guids):
+        # Collect the events for each room from the page's layout
+        rooms = dict((venue, []) for venue in page.venues)
+        for slot, cells in zip(page.slots, page.grid.rows):
+            for cell in cells:
+                if cell.item is not None:
+                    rooms[page.venues[cell.venue]].append(
+                        (slot, page.items[cell.item]))
+        self.start('day', {
+            'date': localtime(page.block.start_time).strftime('%Y-%m-%d'),
+            'start': localtime(page.block.start_time).isoformat(),
+            'end': localtime(page.block.end_time).isoformat(),
+            'index': str(index),
+        })
+        for venue in page.venues:
+            self.start('room', {'name': venue.name})
+            for slot, item in rooms[venue]:
+                self.write_event(venue, slot, item, guids[item.pk])
+            self.end('room', newline=bool(rooms[venue]))
+        self.end('day')
+
+    def write_person(self, person):
+        attrs = {'id': str(person.pk)}
+        if self.contacts is not None:
+            attrs['contact'] = self.contacts.get(person.pk, '')
+        self.element('person', person.userprofile.display_name(), attrs)
+
+    def write_description(self, markup):
+        if self.render_description:
+            self.element('description', markup.rendered)
+        else:
+            self.element('description', markup.raw)
+
+    def write_event(self, venue, slot, item, guid):
+        # The event id is the ScheduleItem pk, which should be unique
+        # enough, but changes if the event is rescheduled.
+        # Talks' guid will be stable across re-scheduling.
+        self.start('event', {'id': str(item.pk), 'guid': str(guid)})
+        start_time = localtime(slot.get_start_time())
+        self.element('date', start_time.isoformat())
+        self.element('start', start_time.strftime('%H:%M'))
+        duration = item.get_duration()
+        self.element('duration', '%02d:%02d' % (duration['hours'],
+                                                duration['minutes']))
+        self.element('room', venue.name)
+        if item.talk and item.talk.track:
+            self.element('track', item.talk.track.name)
+        else:
+            self.element('track', 'No Track')
+        # Abstract is defined to be a 1-paragraph summary, displayed
+        # before description. That doesn't match our data model, so we
+        # leave it blank.
+        self.element('abstract')
+        self.element('subtitle')
+        self.element('slug', '%s-%s-%s' % (
+            settings.WAFER_CONFERENCE_ACRONYM.lower(), item.pk,
+            item.get_slug()))
+        if item.talk:
+            talk = item.talk
+            self.element('title', item.get_title())
+            # description is allowed to be HTML or Markdown. We let the
+            # requester select their desired format
+            if talk.abstract:
+                self.write_description(talk.abstract)
+            else:
+                self.element('description')
+            self.element('type', str(talk.talk_type))
+            self.start('persons')
+            authors = talk.authors.all()
+            for author in authors:
+                self.write_person(author)
+            self.end('persons', newline=bool(authors))
+            self.start('recording')
+            if talk.video:
+                self.element('optout', 'false')
+                self.element('license', settings.WAFER_VIDEO_LICENSE)
+            else:
+                self.element('optout', 'true')
+            self.end('recording')
+        else:
+            self.element('title', item.get_details())
+            self.element('type')
+            people = item.page.people.all() if item.page else []
+            if people:
+                # If there are people, we care about the description
+                self.write_description(item.page.content)
+                self.start('persons')
+                for person in people:
+                    self.write_person(person)
+                self.end('persons')
+            else:
+                self.element('description')
+            self.start('recording')
+            self.element('optout', 'false')
+            self.element('license', settings.WAFER_VIDEO_LICENSE)
+            self.end('recording')
+        self.element('url', 'https://%s%s' % (self.site.domain,
+                                              item.get_url()))
+        self.end('event')
+
+
+def render_pentabarf(schedule_pages, schedule_version, all_items, site,
+                     **kwargs):
+    """Return the pentabarf XML for the schedule pages, as bytes"""
+    out = BytesIO()
+    PentabarfWriter(out, site, **kwargs).write(
+        schedule_pages, schedule_version, all_items)
+    return out.getvalue()
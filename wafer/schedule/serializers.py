@@ -23,29 +23,136 @@ class ScheduleItemSerializer(serializers.HyperlinkedModelSerializer):
     @revisions.create_revision()
     def create(self, validated_data):
         request = self.context['request']
-        venue_id = validated_data['venue']
-        slots = validated_data['slots']
-        talk = validated_data.get('talk')
-        page = validated_data.get('page')
-
-        try:
-            existing_schedule_item = ScheduleItem.objects.get(
-                venue_id=venue_id, slots__in=slots)
-        except ScheduleItem.DoesNotExist:
-            revisions.set_user(request.user)
-            revisions.set_comment("Created using Schedule Editor")
-        else:
-            existing_schedule_item.talk = talk
-            existing_schedule_item.page = page
-            existing_schedule_item.slots.set(slots)
-            # Clear any existing details that aren't editable by the
-            # schedule edit view
-            existing_schedule_item.details = ''
-            existing_schedule_item.notes = ''
-            existing_schedule_item.css_class = ''
-            existing_schedule_item.expand = False
-            existing_schedule_item.save()
-            revisions.set_user(request.user)
+        existing_schedule_item = update_placed_item(
+            validated_data['venue'], validated_data['slots'],
+            validated_data.get('talk'), validated_data.get('page'))
+        revisions.set_user(request.user)
+        if existing_schedule_item is not None:
             revisions.set_comment("Updated using Schedule Editor")
             return existing_schedule_item
+        revisions.set_comment("Created using Schedule Editor")
         return super().create(validated_data)
+
+
+def update_placed_item(venue, slots, talk, page):
+    """Put the talk or page in the schedule item already in the given
+       venue and slots, if there is one.
+
+       Returns the updated item, or None if there isn't one."""
+    try:
+        existing_schedule_item = ScheduleItem.objects.get(
+            venue_id=venue, slots__in=slots)
+    except ScheduleItem.DoesNotExist:
+        return None
+    existing_schedule_item.talk = talk
+    existing_schedule_item.page = page
+    existing_schedule_item.slots.set(slots)
+    # Clear any existing details that aren't editable by the
+    # schedule edit view
+    existing_schedule_item.details = ''
+    existing_schedule_item.notes = ''
+    existing_schedule_item.css_class = ''
+    existing_schedule_item.expand = False
+    existing_schedule_item.save()
+    return existing_schedule_item
+
+
+class ScheduleBatchOperationSerializer(serializers.Serializer):
+    """A single change in a batch of changes from the schedule editor.
+
+       place puts a talk or page in the given venue and slots, replacing
+       the item already there (like creating an item via the API), move
+       moves an item to the given venue and slots, swap exchanges the
+       venues and slots of two items, and delete deletes an item."""
+    REQUIRED_FIELDS = {
+        'place': ('venue', 'slots'),
+        'move': ('item', 'venue', 'slots'),
+        'swap': ('item', 'other'),
+        'delete': ('item',),
+    }
+
+    action = serializers.ChoiceField(choices=sorted(REQUIRED_FIELDS))
+    item = serializers.PrimaryKeyRelatedField(
+        required=False, queryset=ScheduleItem.objects.all())
+    other = serializers.PrimaryKeyRelatedField(
+        required=False, queryset=ScheduleItem.objects.all())
+    venue = serializers.PrimaryKeyRelatedField(
+        required=False, queryset=Venue.objects.all())
+    slots = serializers.PrimaryKeyRelatedField(
+        required=False, many=True, queryset=Slot.objects.all())
+    page = serializers.PrimaryKeyRelatedField(
+        required=False, allow_null=True, queryset=Page.objects.all())
+    talk = serializers.PrimaryKeyRelatedField(
+        required=False, allow_null=True, queryset=Talk.objects.all())
+
+    def validate(self, attrs):
+        missing = [field for field in self.REQUIRED_FIELDS[attrs['action']]
+                   if not attrs.get(field)]
+        if missing:
+            raise serializers.ValidationError(
+                dict((field, 'This field is required.') for field in missing))
+        return attrs
+
+
+class ScheduleBatchSerializer(serializers.Serializer):
+    """A list of changes from the schedule editor, which are applied in
+       order.
+
+       Saving returns the changed schedule items and the ids of the
+       deleted items. The caller is responsible for the transaction."""
+    operations = ScheduleBatchOperationSerializer(many=True,
+                                                  allow_empty=False)
+
+    def create(self, validated_data):
+        # Operations can refer to the same item, so we keep one instance
+        # per item, so later operations see the earlier changes
+        items = {}
+        changed = {}
+        deleted = []
+
+        def lookup(item):
+            if item.pk in deleted:
+                raise serializers.ValidationError(
+                    'Schedule item %s has already been deleted' % item.pk)
+            return items.setdefault(item.pk, item)
+
+        for operation in validated_data['operations']:
+            action = operation['action']
+            if action == 'place':
+                item = update_placed_item(
+                    operation['venue'], operation['slots'],
+                    operation.get('talk'), operation.get('page'))
+                if item is None:
+                    item = ScheduleItem.objects.create(
+                        venue=operation['venue'],
+                        talk=operation.get('talk'),
+                        page=operation.get('page'))
+                    item.slots.set(operation['slots'])
+                items[item.pk] = changed[item.pk] = item
+            elif action == 'move':
+                item = lookup(operation['item'])
+                item.venue = operation['venue']
+                item.save()
+                item.slots.set(operation['slots'])
+                changed[item.pk] = item
+            elif action == 'swap':
+                item = lookup(operation['item'])
+                other = lookup(operation['other'])
+                item_slots = list(item.slots.all())
+                other_slots = list(other.slots.all())
+                item.venue, other.venue = other.venue, item.venue
+                item.save()
+                other.save()
+                item.slots.set(other_slots)
+                other.slots.set(item_slots)
+                changed[item.pk] = item
+                changed[other.pk] = other
+            elif action == 'delete':
+                item = lookup(operation['item'])
+                changed.pop(item.pk, None)
+                deleted.append(item.pk)
+                item.delete()
+        return {
+            'items': sorted(changed.values(), key=lambda x: x.pk),
+            'deleted': deleted,
+        }
@@ -4,8 +4,13 @@ from django.core.exceptions import ValidationError
 
 from django.test import TestCase
 
-from wafer.schedule.models import ScheduleBlock, Slot, ScheduleItem, Venue
+from wafer.schedule.models import (
+    ScheduleBlock, Slot, ScheduleItem, Venue, get_schedule_item_guids,
+    validate_slots)
 from wafer.schedule.tests.test_views import make_pages, make_items
+from wafer.talks.models import ACCEPTED
+from wafer.talks.tests.fixtures import create_talk
+from wafer.utils import QueryTracker
 
 
 class BlockTests(TestCase):
@@ -377,6 +382,165 @@ class SlotTests(TestCase):
         self.assertRaises(ValidationError, slot4.clean)
 
 
+class SlotBatchValidationTests(TestCase):
+
+    def setUp(self):
+        timezone.activate('UTC')
+        self.block = ScheduleBlock.objects.create(
+                start_time=D.datetime(2013, 9, 22, 7, 0, 0,
+                                      tzinfo=D.timezone.utc),
+                end_time=D.datetime(2013, 9, 22, 23, 0, 0,
+                                    tzinfo=D.timezone.utc))
+        self.slot = Slot.objects.create(
+            start_time=D.datetime(2013, 9, 22, 7, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 7, 30, 0,
+                                tzinfo=D.timezone.utc))
+
+    def tearDown(self):
+        timezone.deactivate()
+
+    def _make_chain(self, prev, count):
+        slots = []
+        for loop in range(count):
+            slot = Slot(previous_slot=prev,
+                        end_time=prev.end_time + D.timedelta(minutes=30))
+            slots.append(slot)
+            prev = slot
+        return slots
+
+    def test_valid_chain(self):
+        """Test that a chain of new slots is checked in a fixed number
+           of queries."""
+        slots = self._make_chain(self.slot, 30)
+        with QueryTracker() as tracker:
+            validate_slots(slots)
+        self.assertLessEqual(len(tracker.queries), 2)
+        self.assertEqual(slots[-1].get_start_time(),
+                         D.datetime(2013, 9, 22, 22, 0, 0,
+                                    tzinfo=D.timezone.utc))
+
+    def test_overlaps(self):
+        """Test that overlaps with existing slots and within the batch
+           are found"""
+        Slot.objects.create(
+            start_time=D.datetime(2013, 9, 22, 9, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 9, 30, 0,
+                                tzinfo=D.timezone.utc))
+        slots = self._make_chain(self.slot, 4)
+        with self.assertRaises(ValidationError) as cm:
+            validate_slots(slots)
+        self.assertEqual(len(cm.exception.messages), 1)
+        self.assertIn('overlaps with', cm.exception.messages[0])
+
+        other = Slot(
+            start_time=D.datetime(2013, 9, 22, 8, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 8, 15, 0,
+                                tzinfo=D.timezone.utc))
+        with self.assertRaises(ValidationError) as cm:
+            validate_slots(self._make_chain(self.slot, 2) + [other])
+        self.assertEqual(len(cm.exception.messages), 1)
+
+    def test_invalid_slots(self):
+        """Test that the checks on individual slots are made"""
+        slot = Slot(start_time=D.datetime(2013, 9, 23, 9, 0, 0,
+                                          tzinfo=D.timezone.utc),
+                    end_time=D.datetime(2013, 9, 23, 10, 0, 0,
+                                        tzinfo=D.timezone.utc))
+        backwards = Slot(previous_slot=self.slot,
+                         end_time=D.datetime(2013, 9, 22, 7, 0, 0,
+                                             tzinfo=D.timezone.utc))
+        with self.assertRaises(ValidationError) as cm:
+            validate_slots([slot, backwards])
+        self.assertEqual(len(cm.exception.messages), 2)
+
+
+class SlotDenormalisationTests(TestCase):
+
+    def setUp(self):
+        timezone.activate('UTC')
+        self.block1 = ScheduleBlock.objects.create(
+                start_time=D.datetime(2013, 9, 22, 9, 0, 0,
+                                      tzinfo=D.timezone.utc),
+                end_time=D.datetime(2013, 9, 22, 19, 0, 0,
+                                    tzinfo=D.timezone.utc))
+        self.block2 = ScheduleBlock.objects.create(
+                start_time=D.datetime(2013, 9, 23, 9, 0, 0,
+                                      tzinfo=D.timezone.utc),
+                end_time=D.datetime(2013, 9, 23, 19, 0, 0,
+                                    tzinfo=D.timezone.utc))
+        self.slot1 = Slot.objects.create(
+            start_time=D.datetime(2013, 9, 22, 10, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 11, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.slot2 = Slot.objects.create(
+            previous_slot=self.slot1,
+            end_time=D.datetime(2013, 9, 22, 12, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.slot3 = Slot.objects.create(
+            previous_slot=self.slot2,
+            end_time=D.datetime(2013, 9, 22, 13, 0, 0,
+                                tzinfo=D.timezone.utc))
+
+    def test_new_slots(self):
+        """Test that new slots get the effective start time and block"""
+        for slot in (self.slot1, self.slot2, self.slot3):
+            slot.refresh_from_db()
+            self.assertEqual(slot.block, self.block1)
+        self.assertEqual(self.slot2.effective_start_time,
+                         self.slot1.end_time)
+        self.assertEqual(self.slot3.effective_start_time,
+                         self.slot2.end_time)
+        self.assertEqual(
+            list(Slot.objects.filter(block=self.block1)),
+            [self.slot1, self.slot2, self.slot3])
+
+    def test_cascade_start_time(self):
+        """Test that changing a slot updates the following slot"""
+        self.slot2.end_time = D.datetime(2013, 9, 22, 11, 30, 0,
+                                         tzinfo=D.timezone.utc)
+        self.slot2.save()
+        slot3 = Slot.objects.get(pk=self.slot3.pk)
+        self.assertEqual(slot3.effective_start_time, self.slot2.end_time)
+        self.assertEqual(slot3.get_start_time(), self.slot2.end_time)
+
+    def test_cascade_block(self):
+        """Test that moving the start of a chain moves the whole chain
+           to the new block"""
+        self.slot1.start_time = D.datetime(2013, 9, 23, 10, 0, 0,
+                                           tzinfo=D.timezone.utc)
+        self.slot1.end_time = D.datetime(2013, 9, 23, 11, 0, 0,
+                                         tzinfo=D.timezone.utc)
+        self.slot1.save()
+        for slot in (self.slot1, self.slot2, self.slot3):
+            slot.refresh_from_db()
+            self.assertEqual(slot.block, self.block2)
+            self.assertEqual(slot.get_block(), self.block2)
+
+    def test_block_changes(self):
+        """Test that changing the blocks updates the slots"""
+        self.block1.start_time = D.datetime(2013, 9, 22, 12, 0, 0,
+                                            tzinfo=D.timezone.utc)
+        self.block1.save()
+        for slot in (self.slot1, self.slot2, self.slot3):
+            slot.refresh_from_db()
+            self.assertIsNone(slot.block)
+        block3 = ScheduleBlock.objects.create(
+                start_time=D.datetime(2013, 9, 22, 8, 0, 0,
+                                      tzinfo=D.timezone.utc),
+                end_time=D.datetime(2013, 9, 22, 11, 0, 0,
+                                    tzinfo=D.timezone.utc))
+        for slot in (self.slot1, self.slot2, self.slot3):
+            slot.refresh_from_db()
+            self.assertEqual(slot.block, block3)
+        block3.delete()
+        self.slot3.refresh_from_db()
+        self.assertIsNone(self.slot3.block)
+
+
 class LastUpdateTests(TestCase):
 
     def setUp(self):
@@ -435,7 +599,8 @@ class LastUpdateTests(TestCase):
             update_times[item.pk] = item.last_updated
 
         self.slots[0].name = 'New name'
-        self.slots[0].save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.slots[0].save()
         # Check that we've changed all items associated with this slot, but
         # not any of the other (no next/previous slot relationships exist)
         for item in ScheduleItem.objects.all():
@@ -457,21 +622,61 @@ class LastUpdateTests(TestCase):
         for item in ScheduleItem.objects.all():
             update_times[item.pk] = item.last_updated
 
-        self.slots[0].name = 'New name'
-        self.slots[0].save()
-        # Check that we've changed all items associated with this slot, but
-        # not any of the other (no next/previous slot relationships exist)
+        self.slots[0].end_time = D.datetime(2013, 9, 22, 10, 30, 0,
+                                            tzinfo=D.timezone.utc)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.slots[0].save()
+        # Check that we've changed all items associated with this slot,
+        # and the slots following it
         for item in ScheduleItem.objects.all():
             if self.slots[0] == item.slots.all()[0]:
                 self.assertNotEqual(item.last_updated, update_times[item.pk])
-            elif self.slots[1] == item.slots.all()[0]:
-                # Next slot, so items should have changed
+            elif item.slots.all()[0] in self.slots[1:3]:
+                # Following slots, so items should have changed, as
+                # time changes cascade down the chain
+                self.assertNotEqual(item.last_updated, update_times[item.pk])
+            else:
+                # Not part of the chain
+                self.assertEqual(item.last_updated, update_times[item.pk])
+
+    def test_slot_rename_prev_next(self):
+        """Check that renaming a slot only updates its own items."""
+        self.slots[1].start_time = None
+        self.slots[1].previous_slot = self.slots[0]
+        self.slots[1].save()
+
+        update_times = dict(ScheduleItem.objects.values_list(
+            'pk', 'last_updated'))
+        self.slots[0].name = 'New name'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.slots[0].save()
+        for item in ScheduleItem.objects.all():
+            if self.slots[0] == item.slots.all()[0]:
                 self.assertNotEqual(item.last_updated, update_times[item.pk])
             else:
-                # No other items should have changed, as time changes don't
-                # cascade that way
+                # The following slot's times haven't changed
                 self.assertEqual(item.last_updated, update_times[item.pk])
 
+    def test_slot_save_queries(self):
+        """Check that the schedule items are updated in a single query,
+           without sending signals for each item."""
+        for slot, previous in zip(self.slots[1:], self.slots):
+            slot.start_time = None
+            slot.previous_slot = previous
+            slot.save()
+        update_times = dict(ScheduleItem.objects.values_list(
+            'pk', 'last_updated'))
+        with QueryTracker() as tracker:
+            self.slots[0].end_time = D.datetime(2013, 9, 22, 10, 30, 0,
+                                                tzinfo=D.timezone.utc)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.slots[0].save()
+        updates = [q for q in tracker.queries
+                   if q['sql'].startswith('UPDATE "schedule_scheduleitem"')]
+        self.assertEqual(len(updates), 1)
+        for item in ScheduleItem.objects.all():
+            self.assertNotEqual(item.last_updated, update_times[item.pk])
+
 
 class ScheduleItemGUIDTests(TestCase):
     def setUp(self):
@@ -502,3 +707,16 @@ class ScheduleItemGUIDTests(TestCase):
         pages = make_pages(1)
         items = make_items(self.venues * 2, pages * 2)
         self.assertNotEqual(items[0].guid, items[1].guid)
+
+    def test_bulk_guids(self):
+        """Test that the GUIDs worked out in bulk match the GUIDs of
+           the items"""
+        pages = make_pages(3)
+        items = make_items(self.venues * 4, pages + pages[:1])
+        talk = create_talk('Talk', ACCEPTED, 'author')
+        items.append(ScheduleItem.objects.create(venue=self.venues[0],
+                                                 talk=talk))
+        with QueryTracker() as tracker:
+            guids = get_schedule_item_guids(items)
+            self.assertEqual(len(tracker.queries), 0)
+        self.assertEqual(guids, dict((item.pk, item.guid) for item in items))
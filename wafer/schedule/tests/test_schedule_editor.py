@@ -532,9 +532,10 @@ class EditorTestsMixin:
         item2.slots.add(self.block1_slots[0])
         item2.save()
         self._start()
-        # Verify that there are validation errors
+        # Verify that there are validation errors, which may be loaded
+        # after the page
         validation = WebDriverWait(self.driver, SELENIUM_WAIT_TIME).until(
-            expected_conditions.presence_of_element_located((By.CLASS_NAME, "alert-danger"))
+            expected_conditions.visibility_of_element_located((By.CLASS_NAME, "alert-danger"))
         )
         self.assertTrue(validation.is_displayed())
         error_item = validation.find_element(By.TAG_NAME, "li")
@@ -1,16 +1,33 @@
 import datetime as D
+import pickle
+
+import mock
 from django.utils import timezone
 
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from wafer.tests.utils import create_user
 from wafer.talks.tests.fixtures import create_talk
 from wafer.talks.models import ACCEPTED, CANCELLED, REJECTED
 
-from wafer.schedule.models import ScheduleBlock, Slot, ScheduleItem, Venue
+from wafer.schedule.models import (ScheduleBlock, Slot, ScheduleItem, Venue,
+                                   batch_schedule_updates,
+                                   get_schedule_version)
+from wafer.pages.models import Page
 from wafer.schedule.admin import (find_clashes, find_invalid_venues, validate_items,
                                   find_duplicate_schedule_items, find_speaker_clashes,
-                                  prefetch_schedule_items)
+                                  find_non_contiguous, prefetch_schedule_items,
+                                  check_schedule, validate_schedule,
+                                  get_cached_schedule_validation,
+                                  get_schedule_validation,
+                                  ScheduleValidation,
+                                  SCHEDULE_ITEM_VALIDATORS,
+                                  VALIDATION_CACHE_KEY, _get_cache,
+                                  _new_edit)
+from wafer.utils import QueryTracker
 from wafer.schedule.tests.test_views import make_pages, make_items, create_client
 
 
@@ -292,6 +309,51 @@ class ScheduleValidationTests(TestCase):
         self.assertIn(self.items[7], new_result[0][1])
 
 
+    def test_overlapping_slot_clashes(self):
+        """Test that clashes are found across overlapping slots, which
+           aren't the same slot"""
+        overlapping = Slot.objects.create(
+            start_time=D.datetime(2013, 9, 22, 10, 30, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 11, 30, 0,
+                                tzinfo=D.timezone.utc))
+        # A venue double booked across different slots
+        item = ScheduleItem.objects.create(venue=self.venue1,
+                                           details="Overlapping item",
+                                           page_id=self.pages[0].pk)
+        item.slots.add(overlapping)
+        all_items = prefetch_schedule_items()
+        result = list(find_clashes(all_items))
+        # Overlaps both the 10:00 and 11:00 slots in venue 1
+        self.assertEqual(len(result), 2)
+        self.assertEqual(set(x[0] for x in result),
+                         set([(self.venue1, self.slots[0]),
+                              (self.venue1, overlapping)]))
+        self.assertEqual(set(result[0][1] + result[1][1]),
+                         set([self.items[0], self.items[2], item]))
+        self.assertEqual(list(find_speaker_clashes(all_items)), [])
+
+        # A speaker in two venues at overlapping times
+        item.venue = self.venue3
+        item.page_id = None
+        item.talk_id = self.talk6.pk
+        item.save()
+        self.items[1].page_id = None
+        self.items[1].talk_id = self.talk1.pk
+        self.items[1].save()
+        all_items = prefetch_schedule_items()
+        self.assertEqual(list(find_clashes(all_items)), [])
+        result = list(find_speaker_clashes(all_items))
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0][0], (self.slots[0], self.author1))
+        self.assertEqual(result[0][1], [self.items[1], item])
+
+        # Adjacent slots don't clash
+        item.slots.set([self.slots[1]])
+        all_items = prefetch_schedule_items()
+        self.assertEqual(list(find_speaker_clashes(all_items)), [])
+
+
 class ScheduleValidationApiTests(TestCase):
     """Test that validation status can be checked via the api"""
 
@@ -383,3 +445,346 @@ class ScheduleValidationApiTests(TestCase):
         self.assertEqual(len(response.data['Validation Status']), 1)
         self.assertIn('Common speaker in simultaneous schedule items',
                       response.data['Validation Status'][0])
+
+
+def make_synthetic_conference(days, venues, slots_per_day):
+    """Bulk create a conference with a page scheduled in every venue
+       in every slot, and a different person for each page."""
+    start = D.datetime(2013, 9, 22, 9, 0, 0, tzinfo=D.timezone.utc)
+    all_venues = Venue.objects.bulk_create(
+        Venue(order=x, name='Venue %d' % x) for x in range(venues))
+    blocks = []
+    slots = []
+    for day in range(days):
+        day_start = start + D.timedelta(days=day)
+        block = ScheduleBlock.objects.create(
+            start_time=day_start,
+            end_time=day_start + D.timedelta(hours=slots_per_day))
+        blocks.append(block)
+        for venue in all_venues:
+            venue.blocks.add(block)
+        for hour in range(slots_per_day):
+            slot_start = day_start + D.timedelta(hours=hour)
+            slots.append(Slot(
+                start_time=slot_start,
+                end_time=slot_start + D.timedelta(hours=1),
+                effective_start_time=slot_start,
+                block=block))
+    slots = Slot.objects.bulk_create(slots)
+    pages = Page.objects.bulk_create(
+        Page(name='Page %d' % x, slug='page%d' % x)
+        for x in range(len(slots) * venues))
+    people = get_user_model().objects.bulk_create(
+        get_user_model()(username='person_%d' % x) for x in range(venues))
+    items = ScheduleItem.objects.bulk_create(
+        ScheduleItem(venue=venue, page=pages[x * venues + y])
+        for x, slot in enumerate(slots)
+        for y, venue in enumerate(all_venues))
+    ScheduleItem.slots.through.objects.bulk_create(
+        ScheduleItem.slots.through(scheduleitem_id=item.pk, slot_id=slot.pk)
+        for item, slot in zip(items, (slot for slot in slots
+                                      for venue in all_venues)))
+    Page.people.through.objects.bulk_create(
+        Page.people.through(page_id=page.pk,
+                            user_id=people[x % venues].pk)
+        for x, page in enumerate(pages))
+    return all_venues, slots, items
+
+
+class ScheduleValidationBenchmarkTests(TestCase):
+    """Test that validating a large schedule doesn't cost queries per item
+       or per slot."""
+
+    def setUp(self):
+        timezone.activate('UTC')
+        # 10 days with 20 rooms
+        self.venues, self.slots, self.items = make_synthetic_conference(
+            10, 20, 8)
+
+    def tearDown(self):
+        timezone.deactivate()
+
+    def _run_validators(self):
+        with QueryTracker() as tracker:
+            all_items = prefetch_schedule_items()
+            errors = {}
+            for validator, err_type, _msg in SCHEDULE_ITEM_VALIDATORS:
+                failed = list(validator(all_items))
+                if failed:
+                    errors[err_type] = failed
+        return errors, len(tracker.queries)
+
+    def test_valid_schedule(self):
+        """Test that the synthetic conference validates in a bounded
+           number of queries."""
+        self.assertEqual(len(self.items), 1600)
+        errors, queries = self._run_validators()
+        self.assertEqual(errors, {})
+        self.assertLessEqual(queries, 6)
+
+    def test_errors_found(self):
+        """Test that errors are still found in a large schedule"""
+        # Double book a cell, and give the new item a clashing speaker
+        page = Page.objects.create(name='Extra', slug='extra')
+        page.people.add(self.items[0].page.people.first())
+        extra = ScheduleItem.objects.create(venue=self.venues[0], page=page)
+        extra.slots.add(self.slots[0])
+        # Non-contiguous slots for the last item. Since every cell is
+        # occupied, this is also a clash
+        self.items[-1].slots.add(self.slots[0])
+        errors, queries = self._run_validators()
+        self.assertEqual(set(errors), set(['clashes', 'speaker_clashes',
+                                           'non_contiguous']))
+        self.assertEqual(len(errors['clashes']), 2)
+        self.assertEqual(len(errors['non_contiguous']), 1)
+        self.assertLessEqual(queries, 6)
+        # Check the index agrees with the individual validators
+        all_items = prefetch_schedule_items()
+        self.assertEqual(len(find_clashes(all_items)), 2)
+        self.assertEqual(find_non_contiguous(all_items), [self.items[-1]])
+        self.assertEqual(len(find_invalid_venues(all_items)), 0)
+
+    def test_edit_queries(self):
+        """Test that an edit doesn't revalidate the whole schedule"""
+        talk = create_talk('Talk', ACCEPTED, 'author')
+        self.assertTrue(check_schedule())
+        with QueryTracker() as tracker:
+            extra = ScheduleItem.objects.create(venue=self.venues[0],
+                                                talk=talk)
+            extra.slots.add(self.slots[0])
+            validate_schedule()
+        # No query loads all the schedule items
+        self.assertFalse([query for query in tracker.queries
+                          if 'FROM "schedule_scheduleitem"' in query['sql']
+                          and 'WHERE' not in query['sql']])
+        check_schedule.invalidate()
+        self.assertEqual(len(validate_schedule()), 1)
+
+    def test_state_size(self):
+        """Test that the cached state doesn't grow with the schedule"""
+        self.assertTrue(check_schedule())
+        self.assertLess(len(pickle.dumps(get_schedule_validation())), 1000)
+
+
+class IncrementalValidationTests(TestCase):
+    """Test that the validation state updated after edits matches
+       validating the whole schedule."""
+
+    def setUp(self):
+        timezone.activate('UTC')
+        self.venues, self.slots, self.items = make_synthetic_conference(
+            2, 3, 4)
+        self.talk = create_talk('Talk', ACCEPTED, 'author')
+        # Prime the validation state
+        self.assertTrue(check_schedule())
+
+    def tearDown(self):
+        timezone.deactivate()
+
+    def edit(self):
+        """The validation state is updated when the edits commit"""
+        return self.captureOnCommitCallbacks(execute=True)
+
+    def assertMatchesFullValidation(self):
+        errors = validate_schedule()
+        valid = check_schedule()
+        check_schedule.invalidate()
+        self.assertEqual(sorted(errors), sorted(validate_schedule()))
+        self.assertEqual(valid, check_schedule())
+        return errors
+
+    def test_clash(self):
+        """Test adding and fixing a clash"""
+        with self.edit():
+            extra = ScheduleItem.objects.create(venue=self.venues[0],
+                                                talk=self.talk)
+            extra.slots.add(self.slots[1])
+        errors = self.assertMatchesFullValidation()
+        # clash and speaker clash
+        self.assertEqual(len(errors), 1)
+        with self.edit():
+            extra.slots.remove(self.slots[1])
+            extra.slots.add(self.slots[3])
+        self.assertEqual(len(self.assertMatchesFullValidation()), 1)
+        with self.edit():
+            extra.delete()
+        self.assertEqual(self.assertMatchesFullValidation(), [])
+
+    def test_speaker_clash(self):
+        """Test speaker clashes across venues"""
+        person = self.items[0].page.people.get()
+        with self.edit():
+            self.talk.authors.add(person)
+            extra = ScheduleItem.objects.create(venue=self.venues[0],
+                                                talk=self.talk)
+            self.items[0].slots.remove(self.slots[0])
+            extra.slots.add(self.slots[0])
+        # The moved item is now in an invalid venue, and the new item
+        # has a speaker clash with the other item of the same speaker
+        self.assertMatchesFullValidation()
+        with self.edit():
+            self.talk.authors.remove(person)
+        self.assertMatchesFullValidation()
+
+    def test_talk_status(self):
+        """Test changing the status of a scheduled talk"""
+        item = self.items[0]
+        item.page = None
+        item.talk = self.talk
+        with self.edit():
+            item.save()
+        self.assertEqual(self.assertMatchesFullValidation(), [])
+        self.talk.status = REJECTED
+        with self.edit():
+            self.talk.save()
+        self.assertEqual(len(self.assertMatchesFullValidation()), 1)
+        self.talk.status = ACCEPTED
+        with self.edit():
+            self.talk.save()
+        self.assertEqual(self.assertMatchesFullValidation(), [])
+
+    def test_duplicates(self):
+        """Test duplicate talks across the schedule"""
+        for item in self.items[0], self.items[-1]:
+            item.page = None
+            item.talk = self.talk
+            with self.edit():
+                item.save()
+        self.assertEqual(len(self.assertMatchesFullValidation()), 2)
+        with self.edit():
+            self.items[-1].delete()
+        self.assertEqual(self.assertMatchesFullValidation(), [])
+
+    def test_slot_change(self):
+        """Test changing slot times rechecks the items in the slot"""
+        item = self.items[0]
+        with self.edit():
+            self.items[len(self.venues)].delete()
+            item.slots.add(self.slots[1])
+        self.assertEqual(self.assertMatchesFullValidation(), [])
+        slot = self.slots[1]
+        slot.start_time = slot.start_time + D.timedelta(minutes=30)
+        with self.edit():
+            slot.save()
+        self.assertEqual(len(self.assertMatchesFullValidation()), 1)
+
+    def test_rollback(self):
+        """Test that the state isn't updated for edits that roll back"""
+        state = get_schedule_validation()
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    extra = ScheduleItem.objects.create(
+                        venue=self.venues[0], talk=self.talk)
+                    extra.slots.add(self.slots[1])
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(get_cached_schedule_validation().edit, state.edit)
+        self.assertEqual(self.assertMatchesFullValidation(), [])
+
+    def test_lost_update(self):
+        """Test that a state written by an edit that missed another edit
+           isn't used"""
+        old_state = get_schedule_validation()
+        with self.edit():
+            extra = ScheduleItem.objects.create(venue=self.venues[0],
+                                                talk=self.talk)
+            extra.slots.add(self.slots[1])
+        # As if another process wrote its state after our edit
+        _get_cache().set(VALIDATION_CACHE_KEY, old_state)
+        self.assertIsNone(get_cached_schedule_validation())
+        self.assertEqual(len(self.assertMatchesFullValidation()), 1)
+
+    def test_concurrent_edit(self):
+        """Test that the state isn't stored if another edit is made while
+           we update it"""
+        update_items = ScheduleValidation.update_items
+
+        def other_edit(state, item_ids):
+            _new_edit()
+            update_items(state, item_ids)
+
+        with mock.patch.object(ScheduleValidation, 'update_items',
+                               other_edit):
+            with self.edit():
+                extra = ScheduleItem.objects.create(venue=self.venues[0],
+                                                    talk=self.talk)
+                extra.slots.add(self.slots[1])
+        self.assertIsNone(get_cached_schedule_validation())
+        self.assertEqual(len(self.assertMatchesFullValidation()), 1)
+
+
+class BatchScheduleUpdatesTests(TestCase):
+    """Test that the updates from several edits are applied once, after
+       the transaction commits."""
+
+    def setUp(self):
+        timezone.activate('UTC')
+        self.venues, self.slots, self.items = make_synthetic_conference(
+            2, 3, 4)
+        self.talk = create_talk('Talk', ACCEPTED, 'author')
+        self.assertTrue(check_schedule())
+
+    def tearDown(self):
+        timezone.deactivate()
+
+    def test_batched_edits(self):
+        """Test that the version and validation are updated after commit"""
+        version = get_schedule_version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            with batch_schedule_updates():
+                extra = ScheduleItem.objects.create(venue=self.venues[0],
+                                                    talk=self.talk)
+                extra.slots.add(self.slots[1])
+                slot = self.slots[2]
+                slot.end_time = slot.end_time + D.timedelta(minutes=10)
+                slot.save()
+                # Nothing is updated until the transaction commits
+                self.assertEqual(get_schedule_version(), version)
+                self.assertTrue(check_schedule())
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertNotEqual(get_schedule_version(), version)
+        errors = validate_schedule()
+        self.assertTrue(errors)
+        check_schedule.invalidate()
+        self.assertEqual(sorted(errors), sorted(validate_schedule()))
+
+    def test_fewer_queries(self):
+        """Test that batching many edits saves queries"""
+        with CaptureQueriesContext(connection) as unbatched:
+            for item in self.items[:10]:
+                with self.captureOnCommitCallbacks(execute=True):
+                    item.save()
+        with CaptureQueriesContext(connection) as batched:
+            with self.captureOnCommitCallbacks(execute=True):
+                with batch_schedule_updates():
+                    for item in self.items[:10]:
+                        item.save()
+        self.assertLess(len(batched), len(unbatched) // 2)
+        self.assertEqual(validate_schedule(), [])
+
+    def test_unbatched_edits(self):
+        """Test that the version is only updated once an edit outside a
+           batch commits"""
+        version = get_schedule_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                slot = self.slots[2]
+                slot.end_time = slot.end_time + D.timedelta(minutes=10)
+                slot.save()
+                self.assertEqual(get_schedule_version(), version)
+            # Still inside the test's transaction
+            self.assertEqual(get_schedule_version(), version)
+        self.assertNotEqual(get_schedule_version(), version)
+
+    def test_nested_batches(self):
+        """Test that nested batches are applied by the outer batch"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            with batch_schedule_updates() as outer:
+                with batch_schedule_updates() as inner:
+                    self.items[0].save()
+                self.assertIs(outer, inner)
+        self.assertEqual(len(callbacks), 1)
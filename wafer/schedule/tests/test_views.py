@@ -1,18 +1,36 @@
 import datetime as D
 import json
 import os.path
+import pickle
+import shutil
+import tempfile
 from io import BytesIO
 from xml.etree import ElementTree
 
-from django.test import Client, TestCase
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.utils import http, timezone
 
 import icalendar
 import lxml.etree
+import mock
+from reversion.models import Revision
 
 from wafer.pages.models import Page
-from wafer.schedule.models import ScheduleBlock, Venue, Slot, ScheduleItem
-from wafer.talks.models import ACCEPTED
+from wafer.schedule.admin import invalidate_validation, validate_schedule
+from wafer.schedule.models import (
+    ScheduleBlock, ScheduleChange, ScheduleChangeCounter, Venue, Slot,
+    ScheduleItem, _following_slot_ids, get_schedule_version)
+from wafer.schedule.views import (
+    NOW_PLAYING_POLL_INTERVAL, GridCell, JsonDataView, NowPlayingStream,
+    ScheduleTimeline, SpeakerICalView, VenueICalView, get_schedule_snapshot)
+from wafer.talks.models import ACCEPTED, Talk, Track
 from wafer.talks.tests.fixtures import create_talk
 from wafer.tests.utils import create_user
 from wafer.utils import QueryTracker
@@ -1100,6 +1118,63 @@ class ScheduleViewTests(TestCase):
             assert 'draft_warning' in response.context
 
 
+    def _add_schedule_day(self, day, venues, num_slots):
+        """Add a day with a chain of slots filled with talks and pages."""
+        block = ScheduleBlock.objects.create(
+            start_time=D.datetime(2013, 9, day, 7, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, day, 19, 0, 0,
+                                tzinfo=D.timezone.utc))
+        for venue in venues:
+            venue.blocks.add(block)
+        start = D.datetime(2013, 9, day, 8, 0, 0, tzinfo=D.timezone.utc)
+        slot = Slot.objects.create(start_time=start,
+                                   end_time=start + D.timedelta(hours=1))
+        slots = [slot]
+        for x in range(1, num_slots):
+            slot = Slot.objects.create(
+                previous_slot=slot,
+                end_time=start + D.timedelta(hours=x + 1))
+            slots.append(slot)
+        parent = Page.objects.create(name="parent %d" % day,
+                                     slug="parent%d" % day)
+        for x, slot in enumerate(slots):
+            talk = create_talk('Talk %d %d' % (day, x), status=ACCEPTED,
+                               username='speaker_%d_%d' % (day, x))
+            item = ScheduleItem.objects.create(venue=venues[0],
+                                               talk_id=talk.pk)
+            item.slots.add(slot)
+            page = Page.objects.create(name="page %d %d" % (day, x),
+                                       slug="page%d" % x, parent=parent)
+            page.people.add(create_user('chair_%d_%d' % (day, x)))
+            item = ScheduleItem.objects.create(venue=venues[1],
+                                               page_id=page.pk)
+            item.slots.add(slot)
+
+    def _count_schedule_queries(self):
+        c = Client()
+        # Prime the validation cache
+        c.get('/schedule/')
+        with QueryTracker() as tracker:
+            response = c.get('/schedule/')
+        self.assertTrue(response.context['active'])
+        return len(tracker.queries)
+
+    def test_query_count_independent_of_size(self):
+        """Test that rendering the schedule doesn't cost queries per slot
+           or per item."""
+        venue1 = Venue.objects.create(order=1, name='Venue 1')
+        venue2 = Venue.objects.create(order=2, name='Venue 2')
+        self._add_schedule_day(22, [venue1, venue2], 2)
+        small = self._count_schedule_queries()
+
+        self._add_schedule_day(23, [venue1, venue2], 6)
+        self._add_schedule_day(24, [venue1, venue2], 4)
+        large = self._count_schedule_queries()
+
+        self.assertEqual(small, large)
+
+
 class CurrentViewTests(TestCase):
 
     def setUp(self):
@@ -1586,6 +1661,121 @@ class CurrentViewTests(TestCase):
         assert response.context['active'] is False
         assert 'validation_errors' in response.context
 
+    def test_current_json_view(self):
+        """Test the JSON version of the current view"""
+        day1 = ScheduleBlock.objects.create(
+            start_time=D.datetime(2013, 9, 22, 7, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 19, 0, 0,
+                                tzinfo=D.timezone.utc),
+            )
+        venue1 = Venue.objects.create(order=1, name='Venue 1')
+        venue2 = Venue.objects.create(order=2, name='Venue 2')
+        venue1.blocks.add(day1)
+        venue2.blocks.add(day1)
+
+        start1 = D.datetime(2013, 9, 22, 10, 0, 0, tzinfo=D.timezone.utc)
+        start2 = D.datetime(2013, 9, 22, 11, 0, 0, tzinfo=D.timezone.utc)
+        start3 = D.datetime(2013, 9, 22, 12, 0, 0, tzinfo=D.timezone.utc)
+        start4 = D.datetime(2013, 9, 22, 13, 0, 0, tzinfo=D.timezone.utc)
+        cur = D.datetime(2013, 9, 22, 11, 30, 0, tzinfo=D.timezone.utc)
+
+        slot1 = Slot.objects.create(start_time=start1, end_time=start2)
+        slot2 = Slot.objects.create(start_time=start2, end_time=start3)
+        slot3 = Slot.objects.create(start_time=start3, end_time=start4)
+
+        pages = make_pages(6)
+        venues = [venue1, venue2] * 3
+        items = make_items(venues, pages)
+        for index, item in enumerate(items):
+            item.slots.add([slot1, slot2, slot3][index // 2])
+
+        c = Client()
+        response = c.get('/schedule/current.json',
+                         {'timestamp': cur.isoformat()})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = response.json()
+        self.assertTrue(data['active'])
+        self.assertEqual(data['venues'], [
+            {'id': venue1.pk, 'name': 'Venue 1'},
+            {'id': venue2.pk, 'name': 'Venue 2'},
+        ])
+        self.assertEqual([x['id'] for x in data['slots']],
+                         [slot1.pk, slot2.pk, slot3.pk])
+        self.assertEqual([x['current'] for x in data['slots']],
+                         [False, True, False])
+        self.assertEqual(data['slots'][1]['start_time'],
+                         '2013-09-22T11:00:00+00:00')
+        current = data['slots'][1]['items']
+        self.assertEqual([x['id'] for x in current],
+                         [items[2].pk, items[3].pk])
+        self.assertEqual([x['note'] for x in current],
+                         ['current', 'current'])
+        self.assertEqual(current[0]['title'], items[2].get_title())
+        self.assertEqual(current[0]['url'], items[2].get_url())
+        self.assertEqual(data['slots'][0]['items'][0]['note'], 'complete')
+        self.assertEqual(data['slots'][2]['items'][0]['note'],
+                         'forthcoming')
+
+        # Outside the schedule, there are no slots
+        response = c.get('/schedule/current.json', {
+            'timestamp': (cur + D.timedelta(days=1)).isoformat()})
+        self.assertEqual(response.json(),
+                         {'active': True, 'venues': [], 'slots': []})
+
+    def test_schedule_timeline(self):
+        """Test looking up the slots around a time"""
+        day1 = ScheduleBlock.objects.create(
+            start_time=D.datetime(2013, 9, 22, 7, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 19, 0, 0,
+                                tzinfo=D.timezone.utc),
+            )
+        day2 = ScheduleBlock.objects.create(
+            start_time=D.datetime(2013, 9, 23, 7, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 23, 19, 0, 0,
+                                tzinfo=D.timezone.utc),
+            )
+        start1 = D.datetime(2013, 9, 22, 10, 0, 0, tzinfo=D.timezone.utc)
+        start2 = D.datetime(2013, 9, 22, 11, 0, 0, tzinfo=D.timezone.utc)
+        start3 = D.datetime(2013, 9, 22, 12, 0, 0, tzinfo=D.timezone.utc)
+        start4 = D.datetime(2013, 9, 22, 14, 0, 0, tzinfo=D.timezone.utc)
+        slot1 = Slot.objects.create(start_time=start1, end_time=start2)
+        slot2 = Slot.objects.create(previous_slot=slot1, end_time=start3)
+        # A gap between slot2 and slot3
+        slot3 = Slot.objects.create(
+            start_time=start3 + D.timedelta(hours=1), end_time=start4)
+        slot4 = Slot.objects.create(
+            start_time=start1 + D.timedelta(days=1),
+            end_time=start2 + D.timedelta(days=1))
+
+        timeline = ScheduleTimeline(ScheduleBlock.objects.all(),
+                                    Slot.objects.all())
+        self.assertEqual(timeline.get_block(start1), day1)
+        self.assertEqual(timeline.get_block(start1 + D.timedelta(days=1)),
+                         day2)
+        self.assertIsNone(timeline.get_block(start1 + D.timedelta(days=2)))
+        self.assertIsNone(timeline.get_block(day1.start_time))
+
+        def minutes_after(when, minutes):
+            return when + D.timedelta(minutes=minutes)
+
+        self.assertEqual(timeline.get_slots(day1, minutes_after(start1, -1)),
+                         (None, None, slot1))
+        self.assertEqual(timeline.get_slots(day1, start1),
+                         (None, slot1, slot2))
+        self.assertEqual(timeline.get_slots(day1, minutes_after(start2, 30)),
+                         (slot1, slot2, slot3))
+        # In the gap, there's no current slot
+        self.assertEqual(timeline.get_slots(day1, minutes_after(start3, 30)),
+                         (slot2, None, slot3))
+        self.assertEqual(timeline.get_slots(day1, minutes_after(start4, 30)),
+                         (slot3, None, None))
+        self.assertEqual(
+            timeline.get_slots(day2, minutes_after(slot4.start_time, 1)),
+            (None, slot4, None))
+
     def test_view_hidden(self):
         """Test that the schedule is hidden by the appropriate setting."""
         with self.settings(WAFER_HIDE_SCHEDULE=True):
@@ -1731,6 +1921,28 @@ class NonHTMLViewTests(TestCase):
         title = [z for z in talk if z.tag == 'title'][0]
         self.assertEqual(title.text, 'Item 0')
 
+    def test_pentabarf_view_cached(self):
+        """Test that the XML is cached for the schedule version"""
+        c = Client()
+        response = c.get('/schedule/pentabarf.xml')
+        with QueryTracker() as tracker:
+            self.assertEqual(c.get('/schedule/pentabarf.xml').content,
+                             response.content)
+            self.assertFalse([query for query in tracker.queries
+                              if 'FROM "schedule_' in query['sql']])
+        # The event GUIDs match the schedule items
+        parsed = ElementTree.XML(response.content)
+        guids = dict((event.get('id'), event.get('guid'))
+                     for event in parsed.iter('event'))
+        self.assertEqual(len(guids), ScheduleItem.objects.count())
+        for item in ScheduleItem.objects.all():
+            self.assertEqual(guids[str(item.pk)], str(item.guid))
+        # Contact details are only included for staff
+        self.assertNotIn(b'contact=', response.content)
+        c = create_client('super', True)
+        self.assertIn(b'contact="john@example.com"',
+                      c.get('/schedule/pentabarf.xml').content)
+
     def test_pentabarf_view_against_frab_xsd(self):
         # Frab has an XSD schema, validate against it
         doc = lxml.etree.parse(os.path.dirname(__file__) + '/frab.xml.xsd')
@@ -1748,7 +1960,9 @@ class NonHTMLViewTests(TestCase):
         c = Client()
         response = c.get('/schedule/schedule.ics')
         self.assertIn('Last-Modified', response)
-        calendar = icalendar.Calendar.from_ical(response.content)
+        self.assertIn('ETag', response)
+        calendar = icalendar.Calendar.from_ical(
+            b''.join(response.streaming_content))
         # No errors reported
         self.assertEqual(len(calendar.errors), 0)
         # Check number of events
@@ -1779,6 +1993,89 @@ class NonHTMLViewTests(TestCase):
         self.assertEqual(test0_events, 1)
         self.assertEqual(test1_events, 1)
 
+    def test_ics_view_cached_events(self):
+        """Test that the events are cached, and that the calendar is
+           regenerated when the schedule changes."""
+        c = Client()
+        content = b''.join(c.get('/schedule/schedule.ics').streaming_content)
+        with QueryTracker() as tracker:
+            response = c.get('/schedule/schedule.ics')
+            self.assertEqual(b''.join(response.streaming_content), content)
+        # The version, snapshot and a single batch of events from the cache
+        self.assertLessEqual(len(tracker.queries), 4)
+        etag = response['ETag']
+        not_modified = c.get('/schedule/schedule.ics',
+                             HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        # Renaming a talk doesn't change the schedule item, but changes
+        # the event
+        page = Page.objects.get(slug='test0')
+        page.name = 'Renamed page'
+        with self.captureOnCommitCallbacks(execute=True):
+            page.save()
+        response = c.get('/schedule/schedule.ics', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        calendar = icalendar.Calendar.from_ical(
+            b''.join(response.streaming_content))
+        summaries = [event['summary']
+                     for event in calendar.walk(name='VEVENT')]
+        self.assertIn('Renamed page', summaries)
+        self.assertEqual(len(summaries), 9)
+
+    def _get_events(self, url):
+        response = Client().get(url)
+        self.assertEqual(response.status_code, 200)
+        calendar = icalendar.Calendar.from_ical(
+            b''.join(response.streaming_content))
+        return calendar.walk(name='VEVENT')
+
+    def test_filtered_ics_views(self):
+        venue1 = Venue.objects.get(name='Venue 1')
+        venue2 = Venue.objects.get(name='Venue 2')
+        self.assertEqual(
+            len(self._get_events('/schedule/venue/%d/schedule.ics'
+                                 % venue1.pk)), 5)
+        self.assertEqual(
+            len(self._get_events('/schedule/venue/%d/schedule.ics'
+                                 % venue2.pk)), 4)
+        events = self._get_events('/schedule/speaker/john/schedule.ics')
+        self.assertEqual([str(event['summary']) for event in events],
+                         ['Test talk'])
+        track = Track.objects.create(name='Track 1')
+        self.assertEqual(
+            self._get_events('/schedule/track/%d/schedule.ics' % track.pk),
+            [])
+        talk = Talk.objects.get(title='Test talk')
+        talk.track = track
+        with self.captureOnCommitCallbacks(execute=True):
+            talk.save()
+        self.assertEqual(
+            len(self._get_events('/schedule/track/%d/schedule.ics'
+                                 % track.pk)), 1)
+        # Unknown objects
+        c = Client()
+        for url in ('/schedule/speaker/nobody/schedule.ics',
+                    '/schedule/track/%d/schedule.ics' % (track.pk + 1),
+                    '/schedule/talk_type/1/schedule.ics'):
+            self.assertEqual(c.get(url).status_code, 404)
+
+    def test_build_filtered_ics(self):
+        build_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, build_dir)
+        venue1 = Venue.objects.get(name='Venue 1')
+        with self.settings(BUILD_DIR=build_dir):
+            VenueICalView().build_method()
+            SpeakerICalView().build_method()
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(build_dir, 'schedule', 'venue'))),
+            sorted(str(venue.pk) for venue in Venue.objects.all()))
+        with open(os.path.join(build_dir, 'schedule', 'venue',
+                               str(venue1.pk), 'schedule.ics'), 'rb') as f:
+            calendar = icalendar.Calendar.from_ical(f.read())
+        self.assertEqual(len(calendar.walk(name='VEVENT')), 5)
+        self.assertTrue(os.path.exists(os.path.join(
+            build_dir, 'schedule', 'speaker', 'john', 'schedule.ics')))
+
     def test_xml_conditional_requests(self):
         # All the public schedule views implement these, but we'll just check
         # one of them
@@ -1802,7 +2099,49 @@ class NonHTMLViewTests(TestCase):
                 '/schedule/pentabarf.xml',
                 HTTP_IF_MODIFIED_SINCE=before_last_modified)
         self.assertEqual(modified_response.status_code, 200)
-        self.assertGreater(len(tracker.queries), 10)
+        self.assertEqual(modified_response.content, response.content)
+
+    def test_schedule_snapshot_shared(self):
+        """Test that the schedule views share a single snapshot per
+           schedule version."""
+        c = Client()
+        c.get('/schedule/')
+        # Later views are all rendered from the cached snapshot
+        for url in ('/schedule/pentabarf.xml', '/schedule/schedule.ics',
+                    '/schedule/current/?timestamp=2013-09-22T10:30:00+00:00'):
+            with QueryTracker() as tracker:
+                response = c.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse([query for query in tracker.queries
+                              if 'schedule_slot' in query['sql']])
+        # Changing the schedule rebuilds the snapshot
+        item = ScheduleItem.objects.get(page__slug='test0')
+        item.details = 'Renamed item'
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        response = c.get('/schedule/pentabarf.xml')
+        self.assertIn(b'Renamed item', response.content)
+
+    def test_schedule_snapshot_private(self):
+        """Test that the cached snapshot doesn't include the speakers'
+           passwords or email addresses."""
+        john = get_user_model().objects.get(username='john')
+        snapshot = pickle.dumps(get_schedule_snapshot())
+        self.assertIn(b'john', snapshot)
+        self.assertNotIn(john.password.encode(), snapshot)
+        self.assertNotIn(john.email.encode(), snapshot)
+        self.assertEqual(get_schedule_snapshot().get_emails(),
+                         {john.pk: john.email})
+
+    def test_schedule_version_shared(self):
+        """Test that the schedule version is kept in the wafer cache, so
+           it's shared between processes."""
+        version = get_schedule_version()
+        cache.clear()
+        self.assertEqual(get_schedule_version(), version)
+        self.assertEqual(
+            caches[settings.WAFER_CACHE].get('wafer_schedule_version'),
+            version)
 
 
 class JsonViewTests(TestCase):
@@ -1875,7 +2214,7 @@ class JsonViewTests(TestCase):
         c = create_client('super', True)
         response = c.get('/schedule/schedule.json')
         self.assertEqual(response.status_code, 200)
-        data = json.loads(response.content.decode('utf8'))
+        data = json.loads(b''.join(response.streaming_content))
         self.assertTrue('version' in data)
         self.assertEqual(len(data['events']), 8)
         self.assertEqual(len(data['venues']), 2)
@@ -1902,6 +2241,8 @@ class JsonViewTests(TestCase):
         for event in data['events']:
             if len(event['authors']) > 0:
                 talks += 1
+                for author in event['authors']:
+                    self.assertTrue(author['email'].endswith('@example.com'))
                 if 'Test talk' in event['title']:
                     talk1_start_time = event['start_time']
                 else:
@@ -1916,6 +2257,123 @@ class JsonViewTests(TestCase):
         self.assertEqual(talk1_start_time, page_start_time)
         self.assertNotEqual(talk2_start_time, page_start_time)
 
+    def _get_json(self, c, url, **kwargs):
+        response = c.get(url, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_json_view_track(self):
+        """Test that tracks are exported by name"""
+        track = Track.objects.create(name='Track 1')
+        Talk.objects.filter(title='Test talk').update(track=track)
+        c = create_client('super', True)
+        data = self._get_json(c, '/schedule/schedule.json')
+        tracks = dict((event['title'], event['track'])
+                      for event in data['events'])
+        self.assertEqual(tracks['Test talk'], 'Track 1')
+        self.assertEqual(tracks['Test 2 talk'], 'No Track')
+
+    def test_json_view_queries(self):
+        """Test that the number of queries doesn't depend on the number
+           of events"""
+        c = create_client('super', True)
+        self._get_json(c, '/schedule/schedule.json')
+        with QueryTracker() as tracker:
+            self._get_json(c, '/schedule/schedule.json')
+        queries = len(tracker.queries)
+        with self.captureOnCommitCallbacks(execute=True):
+            talk = create_talk('Test 3 talk', status=ACCEPTED,
+                               username='jim3')
+            item = ScheduleItem.objects.create(venue=Venue.objects.first(),
+                                               talk=talk)
+            item.slots.add(Slot.objects.last())
+        self._get_json(c, '/schedule/schedule.json')
+        with QueryTracker() as tracker:
+            data = self._get_json(c, '/schedule/schedule.json')
+        self.assertEqual(len(data['events']), 9)
+        self.assertEqual(len(tracker.queries), queries)
+
+    def test_json_view_cached(self):
+        """Test that the events are only encoded once for each version"""
+        c = create_client('super', True)
+        data = self._get_json(c, '/schedule/schedule.json')
+        with mock.patch('wafer.schedule.views._json_event') as json_event:
+            self.assertEqual(self._get_json(c, '/schedule/schedule.json'),
+                             data)
+            self.assertFalse(json_event.called)
+        talk = Talk.objects.get(title='Test talk')
+        talk.title = 'Renamed talk'
+        with self.captureOnCommitCallbacks(execute=True):
+            talk.save()
+        data = self._get_json(c, '/schedule/schedule.json')
+        self.assertIn('Renamed talk',
+                      [event['title'] for event in data['events']])
+
+    def test_json_view_versions(self):
+        """Test that the cached events for different schedule versions
+           don't replace each other"""
+        c = create_client('super', True)
+        old_snapshot = get_schedule_snapshot()
+        self._get_json(c, '/schedule/schedule.json')
+        talk = Talk.objects.get(title='Test talk')
+        talk.title = 'Renamed talk'
+        with self.captureOnCommitCallbacks(execute=True):
+            talk.save()
+        self._get_json(c, '/schedule/schedule.json')
+        # A process that still has the old snapshot gets the old events
+        # from the cache
+        with mock.patch('wafer.schedule.views._json_event') as json_event:
+            events, _digests = JsonDataView().get_events(old_snapshot)
+            self.assertFalse(json_event.called)
+        titles = [json.loads(encoded)['title'] for _pk, encoded in events]
+        self.assertIn('Test talk', titles)
+        self.assertNotIn('Renamed talk', titles)
+
+    def test_json_view_conditional(self):
+        """Test conditional requests, which shouldn't bypass the
+           permission checks"""
+        c = create_client('super', True)
+        response = c.get('/schedule/schedule.json')
+        etag = response['ETag']
+        response = c.get('/schedule/schedule.json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        c = create_client('john', False)
+        response = c.get('/schedule/schedule.json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 403)
+
+    def test_json_view_since(self):
+        """Test only returning the events changed since a version"""
+        c = create_client('super', True)
+        data = self._get_json(c, '/schedule/schedule.json')
+        self.assertNotIn('since', data)
+        version = data['schedule_version']
+        # Rename a talk, and delete a page's schedule item
+        talk = Talk.objects.get(title='Test talk')
+        talk.title = 'Renamed talk'
+        deleted = ScheduleItem.objects.get(page__slug='test0')
+        deleted_pk = deleted.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            talk.save()
+            deleted.delete()
+        data = self._get_json(c, '/schedule/schedule.json',
+                              data={'since': version})
+        self.assertEqual(data['since'], version)
+        self.assertNotEqual(data['schedule_version'], version)
+        self.assertEqual([event['title'] for event in data['events']],
+                         ['Renamed talk'])
+        self.assertEqual(data['deleted'], [deleted_pk])
+        # Nothing changed since the current version
+        data = self._get_json(c, '/schedule/schedule.json',
+                              data={'since': data['schedule_version']})
+        self.assertEqual(data['events'], [])
+        self.assertEqual(data['deleted'], [])
+        # Unknown versions return everything
+        data = self._get_json(c, '/schedule/schedule.json',
+                              data={'since': 'unknown'})
+        self.assertNotIn('since', data)
+        self.assertEqual(len(data['events']), 7)
+
+
 class ScheduleItemViewSetTests(TestCase):
 
     def setUp(self):
@@ -2030,3 +2488,671 @@ class ScheduleItemViewSetTests(TestCase):
         self.assertEqual(response.status_code, 204)
         self.assertEqual(response.data, None)
         self.assertEqual(ScheduleItem.objects.count(), 0)
+
+
+class ScheduleItemBatchMixin:
+    """Create two talks in different venues and slots, for the batch API
+       tests"""
+
+    def setUp(self):
+        super().setUp()
+        timezone.activate('UTC')
+        block = ScheduleBlock.objects.create(
+            start_time=D.datetime(2013, 9, 22, 7, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 19, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.venue1 = Venue.objects.create(order=1, name='Venue 1')
+        self.venue2 = Venue.objects.create(order=2, name='Venue 2')
+        self.venue1.blocks.add(block)
+        self.venue2.blocks.add(block)
+        self.slot1 = Slot.objects.create(
+            start_time=D.datetime(2013, 9, 22, 10, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 11, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.slot2 = Slot.objects.create(
+            previous_slot=self.slot1,
+            end_time=D.datetime(2013, 9, 22, 12, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.talk1 = create_talk('Talk 1', ACCEPTED, 'author1')
+        self.talk2 = create_talk('Talk 2', ACCEPTED, 'author2')
+        self.item1 = ScheduleItem.objects.create(venue=self.venue1,
+                                                 talk=self.talk1)
+        self.item1.slots.add(self.slot1)
+        self.item2 = ScheduleItem.objects.create(venue=self.venue2,
+                                                 talk=self.talk2)
+        self.item2.slots.add(self.slot2)
+        self.client = create_client('super', superuser=True)
+
+    def tearDown(self):
+        timezone.deactivate()
+        super().tearDown()
+
+
+class ScheduleItemBatchTests(ScheduleItemBatchMixin, TestCase):
+
+    def _batch(self, operations, client=None):
+        client = client or self.client
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = client.post(
+                '/schedule/api/scheduleitems/batch/',
+                data=json.dumps({'operations': operations}),
+                content_type='application/json')
+        self.callbacks = callbacks
+        return response
+
+    def test_swap(self):
+        """Test that a swap is one revision and one schedule update"""
+        version = get_schedule_version()
+        revisions = Revision.objects.count()
+        response = self._batch([{
+            'action': 'swap', 'item': self.item1.pk, 'other': self.item2.pk,
+        }])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['items'], [
+            {'id': self.item1.pk, 'venue': self.venue2.pk,
+             'slots': [self.slot2.pk], 'talk': self.talk1.pk, 'page': None},
+            {'id': self.item2.pk, 'venue': self.venue1.pk,
+             'slots': [self.slot1.pk], 'talk': self.talk2.pk, 'page': None},
+        ])
+        self.assertEqual(response.data['deleted'], [])
+        self.assertEqual(response.data['Validation Status'], [])
+        self.assertEqual(len(self.callbacks), 1)
+        self.assertNotEqual(get_schedule_version(), version)
+        self.assertEqual(Revision.objects.count(), revisions + 1)
+        self.item1.refresh_from_db()
+        self.assertEqual(self.item1.venue, self.venue2)
+        self.assertEqual(list(self.item1.slots.all()), [self.slot2])
+
+    def test_place_move_delete(self):
+        """Test a batch of changes, which are applied in order"""
+        page = Page.objects.create(name='Lunch', slug='lunch')
+        response = self._batch([
+            # Replaces talk 1
+            {'action': 'place', 'venue': self.venue1.pk,
+             'slots': [self.slot1.pk], 'talk': '', 'page': page.pk},
+            {'action': 'place', 'venue': self.venue1.pk,
+             'slots': [self.slot2.pk], 'talk': self.talk1.pk},
+            {'action': 'move', 'item': self.item2.pk,
+             'venue': self.venue2.pk, 'slots': [self.slot1.pk]},
+            {'action': 'delete', 'item': self.item2.pk},
+        ])
+        self.assertEqual(response.status_code, 200)
+        new_item = ScheduleItem.objects.get(talk=self.talk1)
+        self.assertEqual(response.data['items'], [
+            {'id': self.item1.pk, 'venue': self.venue1.pk,
+             'slots': [self.slot1.pk], 'talk': None, 'page': page.pk},
+            {'id': new_item.pk, 'venue': self.venue1.pk,
+             'slots': [self.slot2.pk], 'talk': self.talk1.pk,
+             'page': None},
+        ])
+        self.assertEqual(response.data['deleted'], [self.item2.pk])
+        self.assertEqual(ScheduleItem.objects.count(), 2)
+
+    def test_invalid_batch(self):
+        """Test that invalid batches don't change anything"""
+        response = self._batch([
+            {'action': 'delete', 'item': self.item1.pk},
+            {'action': 'move', 'item': self.item2.pk},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['operations'][1], {
+            'venue': ['This field is required.'],
+            'slots': ['This field is required.'],
+        })
+        # Errors when applying the changes roll back the transaction
+        response = self._batch([
+            {'action': 'delete', 'item': self.item1.pk},
+            {'action': 'swap', 'item': self.item2.pk,
+             'other': self.item1.pk},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(ScheduleItem.objects.count(), 2)
+        response = self._batch([], client=create_client('ordinary'))
+        self.assertEqual(response.status_code, 403)
+
+
+class ScheduleItemBatchValidationTests(ScheduleItemBatchMixin,
+                                       TransactionTestCase):
+    """The batch API returns the validation state after the changes are
+       committed, so this needs real transactions."""
+
+    def test_validation_state(self):
+        """Test that the response includes the new validation errors"""
+        self.assertEqual(validate_schedule(), [])
+        response = self.client.post(
+            '/schedule/api/scheduleitems/batch/',
+            data=json.dumps({'operations': [
+                {'action': 'place', 'venue': self.venue2.pk,
+                 'slots': [self.slot1.pk], 'talk': self.talk1.pk},
+            ]}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        errors = response.data['Validation Status']
+        self.assertTrue(errors)
+        self.assertTrue(any('Common speaker' in error for error in errors))
+        self.assertEqual(errors, validate_schedule())
+
+    def test_atomic_requests(self):
+        """Test that the validation state is computed after the changes
+           are committed with ATOMIC_REQUESTS"""
+        self.assertEqual(validate_schedule(), [])
+        with mock.patch.dict(connection.settings_dict,
+                             {'ATOMIC_REQUESTS': True}):
+            response = self.client.post(
+                '/schedule/api/scheduleitems/batch/',
+                data=json.dumps({'operations': [
+                    {'action': 'move', 'item': self.item2.pk,
+                     'venue': self.venue2.pk, 'slots': [self.slot1.pk]},
+                    {'action': 'swap', 'item': self.item1.pk,
+                     'other': self.item2.pk},
+                    {'action': 'place', 'venue': self.venue2.pk,
+                     'slots': [self.slot2.pk], 'talk': self.talk1.pk},
+                ]}),
+                content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        errors = response.data['Validation Status']
+        # Talk 1 is now in both slots
+        self.assertTrue(any('Duplicate' in error for error in errors))
+        self.assertEqual(errors, validate_schedule())
+
+
+class ScheduleChangesTests(TestCase):
+
+    def setUp(self):
+        timezone.activate('UTC')
+        self.venue = make_venue()
+        self.slot1 = make_slot()
+        self.slot2 = Slot.objects.create(
+            previous_slot=self.slot1,
+            end_time=D.datetime(2013, 9, 22, 16, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.slot3 = Slot.objects.create(
+            previous_slot=self.slot2,
+            end_time=D.datetime(2013, 9, 22, 17, 0, 0,
+                                tzinfo=D.timezone.utc))
+        [self.page] = make_pages(1)
+        [self.item] = make_items([self.venue], [self.page])
+        self.item.slots.add(self.slot3)
+        self.seq = ScheduleChange.objects.last().pk
+
+    def tearDown(self):
+        timezone.deactivate()
+
+    def _get_changes(self, since, client=None):
+        client = client or Client()
+        response = client.get('/schedule/api/changes/',
+                              data={'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def _changed(self, since):
+        return [(change['kind'], change['id'], change['action'])
+                for change in self._get_changes(since)['changes']]
+
+    def test_item_changes(self):
+        talk = create_talk('Talk', ACCEPTED, username='john')
+        item = ScheduleItem.objects.create(venue=self.venue, talk=talk)
+        item.slots.add(self.slot1)
+        deleted_pk = self.item.pk
+        self.item.delete()
+        changes = self._changed(self.seq)
+        self.assertIn(('item', item.pk, 'created'), changes)
+        self.assertIn(('item', item.pk, 'updated'), changes)
+        self.assertEqual(changes[-1], ('item', deleted_pk, 'deleted'))
+        # Editing the talk changes the schedule item
+        seq = ScheduleChange.objects.last().pk
+        talk.title = 'New title'
+        talk.save()
+        self.assertEqual(self._changed(seq), [('item', item.pk, 'updated')])
+
+    def test_slot_changes(self):
+        """Test that changing a slot logs the following slots as well"""
+        self.slot1.end_time = D.datetime(2013, 9, 22, 14, 0, 0,
+                                         tzinfo=D.timezone.utc)
+        self.slot1.save()
+        self.assertEqual(self._changed(self.seq), [
+            ('slot', self.slot1.pk, 'updated'),
+            ('slot', self.slot2.pk, 'updated'),
+            ('slot', self.slot3.pk, 'updated'),
+        ])
+
+    def test_slot_name_changes(self):
+        """Test that renaming a slot doesn't log the following slots"""
+        slot = Slot.objects.get(pk=self.slot1.pk)
+        slot.name = 'New name'
+        with mock.patch('wafer.schedule.models._following_slot_ids',
+                        wraps=_following_slot_ids) as following:
+            slot.save()
+        # The change log doesn't look for the following slots
+        self.assertNotIn(mock.call([slot.pk]), following.call_args_list)
+        self.assertEqual(self._changed(self.seq), [
+            ('slot', self.slot1.pk, 'updated'),
+        ])
+
+    def test_pruned_changes(self):
+        """Test that clients behind the pruned changes are told to
+           reset"""
+        with mock.patch('wafer.schedule.models.SCHEDULE_CHANGES_KEPT', 2):
+            self.page.name = 'New name'
+            self.page.save()
+            for slot in (self.slot1, self.slot2):
+                slot.name = 'New name'
+                slot.save()
+        seq = ScheduleChange.objects.last().pk
+        self.assertEqual(ScheduleChange.objects.count(), 2)
+        self.assertEqual(
+            ScheduleChangeCounter.objects.get().pruned, seq - 2)
+        data = self._get_changes(self.seq)
+        self.assertEqual(data['latest'], seq)
+        self.assertFalse(data['more'])
+        self.assertEqual([(change['seq'], change['action'])
+                          for change in data['changes']],
+                         [(seq, 'reset')])
+        # Clients that have the kept changes get those
+        self.assertEqual(self._changed(seq - 1), [
+            ('slot', self.slot2.pk, 'updated'),
+        ])
+
+    def test_changes_api(self):
+        data = self._get_changes(0)
+        self.assertEqual(data['latest'], self.seq)
+        self.assertFalse(data['more'])
+        self.assertEqual(data['changes'][-1]['seq'], self.seq)
+        data = self._get_changes(self.seq)
+        self.assertEqual(data, {'since': self.seq, 'latest': self.seq,
+                                'more': False, 'changes': []})
+        response = Client().get('/schedule/api/changes/',
+                                data={'since': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_changes_api_hidden_schedule(self):
+        with self.settings(WAFER_HIDE_SCHEDULE=True):
+            response = Client().get('/schedule/api/changes/')
+            self.assertEqual(response.status_code, 403)
+            self._get_changes(0, create_client('super', superuser=True))
+
+
+class NowPlayingTests(TestCase):
+
+    def setUp(self):
+        timezone.activate('UTC')
+        block = ScheduleBlock.objects.create(
+            start_time=D.datetime(2013, 9, 22, 7, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 19, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.venue1 = Venue.objects.create(order=1, name='Venue 1')
+        self.venue2 = Venue.objects.create(order=2, name='Venue 2')
+        self.venue1.blocks.add(block)
+        self.venue2.blocks.add(block)
+        self.slot1 = Slot.objects.create(
+            start_time=D.datetime(2013, 9, 22, 10, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 11, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.slot2 = Slot.objects.create(
+            previous_slot=self.slot1,
+            end_time=D.datetime(2013, 9, 22, 12, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.slot3 = Slot.objects.create(
+            start_time=D.datetime(2013, 9, 22, 13, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 14, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.pages = make_pages(4)
+        self.items = make_items(
+            [self.venue1, self.venue2, self.venue1, self.venue2],
+            self.pages)
+        # The venue 2 item spans slot 1 and 2
+        self.items[0].slots.add(self.slot1)
+        self.items[1].slots.add(self.slot1, self.slot2)
+        self.items[2].slots.add(self.slot3)
+        self.items[3].slots.add(self.slot3)
+        self.during_slot1 = D.datetime(2013, 9, 22, 10, 30, 0,
+                                       tzinfo=D.timezone.utc)
+
+    def tearDown(self):
+        timezone.deactivate()
+
+    def _stream(self, **kwargs):
+        return NowPlayingStream(AnonymousUser(), **kwargs)
+
+    def test_now_playing(self):
+        """Test the current and next items in each venue"""
+        stream = self._stream()
+        _event_id, data = stream.get_state(self.during_slot1)
+        self.assertTrue(data['active'])
+        venue1, venue2 = data['venues']
+        self.assertEqual(venue1['id'], self.venue1.pk)
+        self.assertEqual(venue1['current']['id'], self.items[0].pk)
+        self.assertEqual(venue1['current']['title'],
+                         self.items[0].get_title())
+        self.assertEqual(venue1['current']['url'], self.items[0].get_url())
+        # Venue 1 has nothing scheduled in slot 2
+        self.assertEqual(venue1['next']['id'], self.items[2].pk)
+        self.assertEqual(venue2['current']['id'], self.items[1].pk)
+        self.assertEqual(venue2['current']['start_time'],
+                         '2013-09-22T10:00:00+00:00')
+        self.assertEqual(venue2['current']['end_time'],
+                         '2013-09-22T12:00:00+00:00')
+        self.assertEqual(venue2['next']['id'], self.items[3].pk)
+
+        # In the gap between slots
+        _event_id, data = stream.get_state(
+            D.datetime(2013, 9, 22, 12, 30, 0, tzinfo=D.timezone.utc))
+        self.assertIsNone(data['venues'][0]['current'])
+        self.assertEqual(data['venues'][0]['next']['id'], self.items[2].pk)
+
+        # Outside the block
+        _event_id, data = stream.get_state(
+            D.datetime(2013, 9, 22, 20, 0, 0, tzinfo=D.timezone.utc))
+        self.assertEqual(data, {'active': True, 'venues': []})
+
+    def test_wakeup(self):
+        """Test that the stream wakes up at the next slot boundary"""
+        stream = self._stream()
+        stream.get_state(self.during_slot1)
+        self.assertEqual(stream.get_wait(
+            D.datetime(2013, 9, 22, 10, 59, 57, tzinfo=D.timezone.utc)), 3)
+        # Otherwise we check the schedule version periodically
+        self.assertEqual(stream.get_wait(self.during_slot1),
+                         NOW_PLAYING_POLL_INTERVAL)
+
+    def test_schedule_changes(self):
+        """Test that the stream only sends changes"""
+        stream = self._stream(timestamp=self.during_slot1, max_age=0)
+        message, done = stream.next_message()
+        self.assertTrue(message.startswith('id: %s\n' %
+                                           stream.last_event_id))
+        self.assertFalse(done)
+        self.assertEqual(stream.next_message(),
+                         (': keepalive\n\n', False))
+        self.items[0].page = self.pages[2]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.items[0].save()
+        message, done = stream.next_message()
+        data = json.loads(message.splitlines()[1][len('data: '):])
+        self.assertEqual(data['venues'][0]['current']['title'],
+                         self.pages[2].name)
+
+        # A client that has seen the latest state gets keepalives
+        last_event_id = stream.last_event_id
+        stream = self._stream(timestamp=self.during_slot1, max_age=0,
+                              last_event_id=last_event_id)
+        self.assertEqual(list(stream), [
+            'retry: %d\n\n' % (NOW_PLAYING_POLL_INTERVAL * 1000),
+            ': keepalive\n\n'])
+
+    def test_event_stream_view(self):
+        """Test that the stream returns the current state at once under
+           WSGI, and tells the client when to reconnect"""
+        response = Client().get('/schedule/current/events/', {
+            'timestamp': self.during_slot1.isoformat()})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        [message] = [chunk.decode('utf-8')
+                     for chunk in response.streaming_content]
+        event_id, data, _blank, retry = message.splitlines()[:4]
+        data = json.loads(data[len('data: '):])
+        self.assertEqual(event_id, 'id: %s' % self._stream().get_state(
+            self.during_slot1)[0])
+        self.assertEqual(data['venues'][1]['current']['id'],
+                         self.items[1].pk)
+        self.assertEqual(retry, 'retry: %d' % (
+            NOW_PLAYING_POLL_INTERVAL * 1000))
+
+    def test_retry(self):
+        """Test that clients that don't wait reconnect at the next slot
+           boundary"""
+        stream = self._stream(
+            timestamp=D.datetime(2013, 9, 22, 10, 59, 57,
+                                 tzinfo=D.timezone.utc),
+            wait=False)
+        message, done = stream.next_message(final=True)
+        self.assertTrue(done)
+        self.assertTrue(message.endswith('retry: 3000\n\n'))
+        stream = self._stream(timestamp=self.during_slot1, long_poll=True,
+                              last_event_id=stream.last_event_id,
+                              wait=False)
+        self.assertEqual(json.loads(''.join(stream))['retry'],
+                         NOW_PLAYING_POLL_INTERVAL)
+
+    async def test_event_stream_asgi(self):
+        """Test that the stream is asynchronous when served over ASGI"""
+        response = await self.async_client.get('/schedule/current/events/', {
+            'timestamp': self.during_slot1.isoformat()})
+        self.assertTrue(response.is_async)
+        content = aiter(response.streaming_content)
+        self.assertTrue((await anext(content)).startswith(b'retry: '))
+        self.assertTrue((await anext(content)).startswith(b'id: '))
+        await content.aclose()
+
+    def test_long_poll_view(self):
+        response = Client().get('/schedule/current/events/', {
+            'poll': '', 'timestamp': self.during_slot1.isoformat()})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = json.loads(b''.join(response.streaming_content))
+        event_id, state = self._stream().get_state(self.during_slot1)
+        self.assertEqual(data.pop('id'), event_id)
+        self.assertEqual(data.pop('retry'), NOW_PLAYING_POLL_INTERVAL)
+        self.assertEqual(data, state)
+
+        # If nothing changes, we return the same state at the end of the
+        # timeout
+        stream = self._stream(timestamp=self.during_slot1, long_poll=True,
+                              last_event_id=event_id, max_age=0)
+        self.assertEqual(json.loads(''.join(stream))['id'], event_id)
+
+    def test_hidden_schedule(self):
+        with self.settings(WAFER_HIDE_SCHEDULE=True):
+            _event_id, data = self._stream().get_state(self.during_slot1)
+            self.assertEqual(data, {'active': False})
+            superuser = create_user('super', superuser=True)
+            stream = NowPlayingStream(superuser)
+            _event_id, data = stream.get_state(self.during_slot1)
+            self.assertTrue(data['active'])
+            self.assertEqual(len(data['venues']), 2)
+
+
+class ScheduleEditViewTests(TestCase):
+
+    def setUp(self):
+        self.block1 = ScheduleBlock.objects.create(
+            start_time=D.datetime(2013, 9, 22, 7, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 19, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.block2 = ScheduleBlock.objects.create(
+            start_time=D.datetime(2013, 9, 23, 7, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 23, 19, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.venue1 = Venue.objects.create(order=1, name='Venue 1')
+        self.venue2 = Venue.objects.create(order=2, name='Venue 2')
+        self.venue1.blocks.add(self.block1, self.block2)
+        self.venue2.blocks.add(self.block1)
+        self.slot1 = Slot.objects.create(
+            start_time=D.datetime(2013, 9, 22, 10, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 11, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.slot2 = Slot.objects.create(
+            previous_slot=self.slot1,
+            end_time=D.datetime(2013, 9, 22, 12, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.slot3 = Slot.objects.create(
+            start_time=D.datetime(2013, 9, 23, 10, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 23, 11, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.talk1 = create_talk('Talk 1', ACCEPTED, 'author1')
+        self.talk2 = create_talk('Talk 2', ACCEPTED, 'author2')
+        self.page = Page.objects.create(name='Lunch', slug='lunch')
+        self.item1 = ScheduleItem.objects.create(venue=self.venue1,
+                                                 talk=self.talk1)
+        self.item1.slots.add(self.slot1)
+        self.item2 = ScheduleItem.objects.create(venue=self.venue2,
+                                                 page=self.page)
+        self.item2.slots.add(self.slot1, self.slot2)
+        self.client = create_client('super', superuser=True)
+
+    def _get_context(self, block):
+        response = self.client.get(
+            reverse('admin:schedule_editor', args=[block.pk]))
+        self.assertEqual(response.status_code, 200)
+        return response.context
+
+    def test_editor_context(self):
+        context = self._get_context(self.block1)
+        self.assertEqual(context['venues'], [self.venue1, self.venue2])
+        self.assertEqual([slot['id'] for slot in context['slots']],
+                         [self.slot1.pk, self.slot2.pk])
+        slot1, slot2 = context['slots']
+        self.assertEqual(slot2['start_time'], self.slot1.end_time)
+        self.assertEqual(slot1['venues'][0], {
+            'name': 'Venue 1', 'id': self.venue1.pk,
+            'scheduleitem_id': self.item1.pk, 'title': 'Talk 1',
+            'talk': self.talk1})
+        self.assertEqual(slot1['venues'][1]['scheduleitem_id'],
+                         self.item2.pk)
+        self.assertEqual(slot1['venues'][1]['page'], self.page)
+        self.assertEqual(slot2['venues'][0],
+                         {'name': 'Venue 1', 'id': self.venue1.pk})
+        self.assertEqual(slot2['venues'][1]['title'], 'Lunch')
+        self.assertEqual(context['talks_unassigned'], {self.talk2})
+
+        context = self._get_context(self.block2)
+        self.assertEqual(context['venues'], [self.venue1])
+        self.assertEqual(context['slots'], [{
+            'name': None, 'start_time': self.slot3.start_time,
+            'end_time': self.slot3.end_time, 'id': self.slot3.pk,
+            'venues': [{'name': 'Venue 1', 'id': self.venue1.pk}]}])
+
+    def test_editor_queries(self):
+        """Test that the editor doesn't query per slot or item"""
+        # Load the validation state, so we only count the editor
+        validate_schedule()
+        with QueryTracker() as tracker:
+            self._get_context(self.block1)
+        num_queries = len(tracker.queries)
+        for hour in range(12, 18):
+            slot = Slot.objects.create(
+                start_time=D.datetime(2013, 9, 22, hour, 0, 0,
+                                      tzinfo=D.timezone.utc),
+                end_time=D.datetime(2013, 9, 22, hour + 1, 0, 0,
+                                    tzinfo=D.timezone.utc))
+            for venue in (self.venue1, self.venue2):
+                talk = create_talk('Talk %s %s' % (hour, venue.pk),
+                                   ACCEPTED, 'author%s%s' % (hour, venue.pk))
+                item = ScheduleItem.objects.create(venue=venue, talk=talk)
+                item.slots.add(slot)
+        validate_schedule()
+        with CaptureQueriesContext(connection) as queries:
+            context = self._get_context(self.block1)
+        self.assertEqual(len(context['slots']), 8)
+        self.assertEqual(len(queries), num_queries)
+
+    def test_validation_pending(self):
+        """Test that the validation state is only included if we already
+           have it"""
+        invalidate_validation()
+        context = self._get_context(self.block1)
+        self.assertTrue(context['validation_pending'])
+        self.assertEqual(context['validation_errors'], [])
+        self.assertContains(
+            self.client.get(reverse('admin:schedule_editor')),
+            'data-pending="true"')
+
+        # Make a speaker clash
+        item = ScheduleItem.objects.create(venue=self.venue2,
+                                           talk=self.talk1)
+        item.slots.add(self.slot1)
+        errors = validate_schedule()
+        self.assertTrue(errors)
+        context = self._get_context(self.block1)
+        self.assertNotIn('validation_pending', context)
+        self.assertEqual(context['validation_errors'], errors)
+
+
+class ScheduleGridTests(TestCase):
+
+    def setUp(self):
+        timezone.activate('UTC')
+        self.block = ScheduleBlock.objects.create(
+            start_time=D.datetime(2013, 9, 22, 7, 0, 0,
+                                  tzinfo=D.timezone.utc),
+            end_time=D.datetime(2013, 9, 22, 19, 0, 0,
+                                tzinfo=D.timezone.utc))
+        self.venues = [Venue.objects.create(order=x, name='Venue %d' % x)
+                       for x in range(1, 4)]
+        for venue in self.venues:
+            venue.blocks.add(self.block)
+        self.slots = []
+        for hour in (10, 11, 12):
+            self.slots.append(Slot.objects.create(
+                start_time=D.datetime(2013, 9, 22, hour, 0, 0,
+                                      tzinfo=D.timezone.utc),
+                end_time=D.datetime(2013, 9, 22, hour + 1, 0, 0,
+                                    tzinfo=D.timezone.utc)))
+        # Schedule is
+        #         Venue 1   Venue 2   Venue 3
+        # 10:00   Item 0    Item 2    Item 1
+        # 11:00   Item 3 (expanded)   Item 1
+        # 12:00   Item 4    (empty)   (empty)
+        pages = make_pages(5)
+        self.items = make_items(
+            [self.venues[0], self.venues[2], self.venues[1],
+             self.venues[1], self.venues[0]], pages, expand=(3,))
+        self.items[0].slots.add(self.slots[0])
+        self.items[1].slots.add(self.slots[0])
+        self.items[1].slots.add(self.slots[1])
+        self.items[2].slots.add(self.slots[0])
+        self.items[3].slots.add(self.slots[1])
+        self.items[4].slots.add(self.slots[2])
+
+    def tearDown(self):
+        timezone.deactivate()
+
+    def test_grid(self):
+        """Test the layout of the schedule page"""
+        snapshot = get_schedule_snapshot()
+        grid = snapshot.get_schedule_page(self.block).grid
+        self.assertEqual(grid.venue_ids,
+                         tuple(venue.pk for venue in self.venues))
+        self.assertEqual(grid.slot_ids, tuple(slot.pk for slot in self.slots))
+        self.assertEqual(grid.rows, (
+            (GridCell(0, self.items[0].pk, 1, 1),
+             GridCell(1, self.items[2].pk, 1, 1),
+             GridCell(2, self.items[1].pk, 2, 1)),
+            # Item 3 is expanded over the empty venue 1
+            (GridCell(1, self.items[3].pk, 1, 2),),
+            (GridCell(0, self.items[4].pk, 1, 1),
+             GridCell(1, None, 1, 1),
+             GridCell(2, None, 1, 1)),
+        ))
+        # The grid only holds ids, and survives the cache
+        self.assertEqual(pickle.loads(pickle.dumps(grid)).rows, grid.rows)
+
+    def test_rows_are_not_shared(self):
+        """Test that changing the rows doesn't change the cached layout"""
+        page = get_schedule_snapshot().get_schedule_page(self.block)
+        row = page.rows[1]
+        self.assertEqual(row.get_sorted_items(), [
+            {'item': self.items[3], 'rowspan': 1, 'colspan': 2}])
+        row.items[self.venues[1]]['note'] = 'current'
+        self.assertNotIn('note', page.rows[1].items[self.venues[1]])
+
+    def test_current_rows(self):
+        """Test that the current view only extends items over the rows
+           it shows"""
+        snapshot = get_schedule_snapshot()
+        page = snapshot.make_schedule_page(self.block, self.slots[1:])
+        self.assertEqual(page.grid.rows, (
+            (GridCell(1, self.items[3].pk, 1, 2),
+             GridCell(2, self.items[1].pk, 1, 1)),
+            (GridCell(0, self.items[4].pk, 1, 1),
+             GridCell(1, None, 1, 1),
+             GridCell(2, None, 1, 1)),
+        ))
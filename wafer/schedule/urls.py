@@ -3,8 +3,10 @@ from rest_framework import routers
 
 
 from wafer.schedule.views import (
-    CurrentView, ScheduleView, ScheduleItemViewSet, ScheduleXmlView,
-    VenueView, ICalView, JsonDataView, get_validation_info)
+    CurrentJsonView, CurrentView, NowPlayingView, ScheduleView,
+    ScheduleItemViewSet, ScheduleXmlView, VenueView, ICalView, JsonDataView,
+    SpeakerICalView, TalkTypeICalView, TrackICalView, VenueICalView,
+    get_changes_info, get_validation_info)
 
 router = routers.DefaultRouter()
 router.register(r'scheduleitems', ScheduleItemViewSet)
@@ -13,10 +15,23 @@ urlpatterns = [
     re_path(r'^$', ScheduleView.as_view(), name='wafer_full_schedule'),
     re_path(r'^venue/(?P<pk>\d+)/$', VenueView.as_view(), name='wafer_venue'),
     re_path(r'^current/$', CurrentView.as_view(), name='wafer_current'),
+    re_path(r'^current\.json$', CurrentJsonView.as_view(),
+        name='wafer_current_json'),
+    re_path(r'^current/events/$', NowPlayingView.as_view(),
+        name='wafer_current_events'),
     re_path(r'^pentabarf\.xml$', ScheduleXmlView.as_view(),
         name='wafer_pentabarf_xml'),
     re_path(r'^schedule\.ics$', ICalView.as_view(), name="schedule.ics"),
+    re_path(r'^venue/(?P<key>\d+)/schedule\.ics$', VenueICalView.as_view(),
+        name='wafer_venue_ics'),
+    re_path(r'^track/(?P<key>\d+)/schedule\.ics$', TrackICalView.as_view(),
+        name='wafer_track_ics'),
+    re_path(r'^talk_type/(?P<key>\d+)/schedule\.ics$',
+        TalkTypeICalView.as_view(), name='wafer_talk_type_ics'),
+    re_path(r'^speaker/(?P<key>[\w.@+-]+)/schedule\.ics$',
+        SpeakerICalView.as_view(), name='wafer_speaker_ics'),
     re_path(r'^schedule\.json$', JsonDataView.as_view(), name="schedule.json"),
     re_path(r'^api/validate', get_validation_info),
+    re_path(r'^api/changes/$', get_changes_info, name='wafer_schedule_changes'),
     re_path(r'^api/', include(router.urls)),
 ]
@@ -1,16 +1,29 @@
+import asyncio
+import bisect
 import datetime
+import hashlib
+import json
+import math
 import os
+import time
+from collections import namedtuple
 
 import logging
 
+from asgiref.sync import sync_to_async
 from icalendar import Calendar, Event
 
 from django.conf import settings
 from django.contrib import messages
+from django.contrib.auth import get_user_model
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
-from django.db.models import Q
-from django.http import HttpResponse, JsonResponse
+from django.core.cache import caches
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.http import (
+    Http404, HttpResponse, JsonResponse, StreamingHttpResponse)
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 from django.utils.decorators import method_decorator
@@ -18,31 +31,162 @@ from django.views.decorators.http import condition
 from django.views.generic import TemplateView, View
 
 from bakery.views import BuildableDetailView, BuildableTemplateView, BuildableMixin
-from rest_framework import viewsets
-from rest_framework.permissions import IsAdminUser
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework import status, viewsets
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
+from reversion import revisions
 
-from wafer import __version__
 from wafer.pages.models import Page
 from wafer.schedule.models import (
-    Venue, Slot, ScheduleBlock, ScheduleItem, get_schedule_version)
-from wafer.schedule.admin import check_schedule, validate_schedule
-from wafer.schedule.serializers import ScheduleItemSerializer
+    Venue, Slot, ScheduleBlock, ScheduleItem, batch_schedule_updates,
+    SCHEDULE_VERSION_KEY, get_schedule_changes, get_schedule_version)
+from wafer.schedule.admin import (
+    check_schedule, get_cached_schedule_validation, validate_schedule)
+from wafer.schedule.pentabarf import render_pentabarf
+from wafer.schedule.serializers import (
+    ScheduleBatchSerializer, ScheduleItemSerializer)
 from wafer.talks.models import ACCEPTED, CANCELLED
-from wafer.talks.models import Talk
+from wafer.talks.models import Talk, TalkType, Track
+from wafer.utils import PrecompressedBuildMixin
 
 
 logger = logging.getLogger(__name__)
 
+SCHEDULE_SNAPSHOT_KEY = 'wafer_schedule_snapshot'
+
+# The fields of the speakers stored in the schedule snapshot
+SNAPSHOT_USER_FIELDS = ('username', 'first_name', 'last_name',
+                        'userprofile__user')
+
+# Number of schedule items to look up in the cache at a time when
+# generating the iCal file
+ICAL_BATCH_SIZE = 100
+ICAL_EVENT_TIMEOUT = 60 * 60 * 24
+
+# Maximum number of changes returned by the schedule changes API
+SCHEDULE_CHANGES_LIMIT = 1000
+
+# How often the live now playing stream checks the schedule version, how
+# long a stream is kept open before the client has to reconnect, and
+# how long a long-poll request waits for a change (all in seconds)
+NOW_PLAYING_POLL_INTERVAL = 10
+NOW_PLAYING_MAX_AGE = 60 * 60
+NOW_PLAYING_LONG_POLL_TIMEOUT = 30
+
+
+# A cell in a ScheduleGrid: the index of the venue, the id of the schedule
+# item (None for empty cells), and the number of rows and columns covered
+GridCell = namedtuple('GridCell', ('venue', 'item', 'rowspan', 'colspan'))
+
+
+class ScheduleGrid(object):
+    """The layout of a schedule table, with the venues as columns and the
+       slots as rows.
+
+       rows holds a tuple of GridCells for each row, for the cells that
+       start in that row, ordered by venue. A cell for an item with
+       expand set is at the item's venue, but its colspan may also cover
+       the empty venues before it. Cells refer to the venues by
+       index and to the schedule items by id, so the grid is compact,
+       picklable and can be shared between requests without copying the
+       schedule items."""
+
+    def __init__(self, venue_ids, slot_ids, rows):
+        self.venue_ids = tuple(venue_ids)
+        self.slot_ids = tuple(slot_ids)
+        self.rows = tuple(tuple(row) for row in rows)
+
+    @classmethod
+    def build(cls, venues, slot_items):
+        """Lay out the table for the given venues.
+
+           slot_items is a list of (slot, schedule items) pairs, one
+           for each row. Items in several rows are extended down, and
+           items with expand set are extended across the empty cells
+           on either side."""
+        venue_index = dict((venue.pk, pos) for pos, venue in enumerate(venues))
+        # Cells are [venue, item, rowspan, colspan] while we're working on
+        # them, and frozen at the end
+        seen_items = {}
+        rows = []
+        for _slot, items in slot_items:
+            row = {}
+            skip = {}
+            expanding = set()
+            for item in items:
+                venue = venue_index.get(item.venue_id)
+                if venue is None:
+                    # Not a venue in this block, so not shown
+                    continue
+                if item.pk in seen_items:
+                    seen_items[item.pk][2] += 1
+                    # Note that we need to skip this during colspan checks
+                    skip[venue] = seen_items[item.pk]
+                    continue
+                cell = [venue, item.pk, 1, 1]
+                row[venue] = seen_items[item.pk] = cell
+                if item.expand:
+                    expanding.add(venue)
+
+            empty = []
+            expanding_right = None
+            skipping = 0
+            skip_cell = None
+            for venue in range(len(venues)):
+                if venue in skip:
+                    # We need to skip all the venues this item spans over
+                    skipping = 1
+                    skip_cell = skip[venue]
+                    continue
+                if venue in expanding:
+                    cell = row[venue]
+                    for empty_venue in empty:
+                        del row[empty_venue]
+                        cell[3] += 1
+                    empty = []
+                    expanding_right = cell
+                elif venue in row:
+                    empty = []
+                    expanding_right = None
+                elif expanding_right:
+                    expanding_right[3] += 1
+                elif skipping > 0 and skipping < skip_cell[3]:
+                    skipping += 1
+                else:
+                    skipping = 0
+                    empty.append(venue)
+                    row[venue] = [venue, None, 1, 1]
+            rows.append(row)
+        return cls(
+            [venue.pk for venue in venues],
+            [slot.pk for slot, _items in slot_items],
+            [[GridCell(*row[venue]) for venue in sorted(row)]
+             for row in rows])
+
+    def __repr__(self):
+        """Debugging aid"""
+        return 'ScheduleGrid(%r, %r, %r)' % (self.venue_ids, self.slot_ids,
+                                             self.rows)
+
 
 class ScheduleRow(object):
-    """This is a helpful containter for the schedule view to keep sanity"""
-    def __init__(self, schedule_page, slot):
+    """This is a helpful containter for the schedule view to keep sanity.
+
+       The rows are created from the schedule page's grid each time
+       they're used, so views can annotate the items."""
+    def __init__(self, schedule_page, slot, cells=()):
         self.schedule_page = schedule_page
         self.slot = slot
         self.start_time = slot.get_start_time()
         self.items = {}
+        for cell in cells:
+            venue = schedule_page.venues[cell.venue]
+            self.items[venue] = {
+                'item': schedule_page.items.get(cell.item),
+                'rowspan': cell.rowspan,
+                'colspan': cell.colspan,
+            }
 
     def get_sorted_items(self):
         sorted_items = []
@@ -57,11 +201,24 @@ class ScheduleRow(object):
 
 
 class SchedulePage(object):
-    """A helpful container for information about blocks in a schedule view."""
-    def __init__(self, block):
+    """A helpful container for information about blocks in a schedule view.
+
+       The layout of the page is given by the grid, for the slots given,
+       using the schedule items (keyed by id) in items."""
+    def __init__(self, block, venues=None, slot_items=()):
         self.block = block
-        self.venues = list(block.venue_set.all())
-        self.rows = []
+        if venues is None:
+            venues = block.venue_set.all()
+        self.venues = list(venues)
+        self.slots = [slot for slot, _items in slot_items]
+        self.items = dict((item.pk, item)
+                          for _slot, items in slot_items for item in items)
+        self.grid = ScheduleGrid.build(self.venues, slot_items)
+
+    @property
+    def rows(self):
+        return [ScheduleRow(self, slot, cells)
+                for slot, cells in zip(self.slots, self.grid.rows)]
 
 
 class VenueView(BuildableDetailView):
@@ -69,76 +226,230 @@ class VenueView(BuildableDetailView):
     model = Venue
 
 
-def make_schedule_row(schedule_page, slot, seen_items):
-    """Create a row for the schedule table."""
-    row = ScheduleRow(schedule_page, slot)
-    skip = {}
-    expanding = {}
-    all_items = list(slot.scheduleitem_set
-                     .select_related('talk', 'page', 'venue')
-                     .all())
-
-    for item in all_items:
-        if item in seen_items:
-            # Inc rowspan
-            seen_items[item]['rowspan'] += 1
-            # Note that we need to skip this during colspan checks
-            skip[item.venue] = seen_items[item]
-            continue
-        scheditem = {'item': item, 'rowspan': 1, 'colspan': 1}
-        row.items[item.venue] = scheditem
-        seen_items[item] = scheditem
-        if item.expand:
-            expanding[item.venue] = []
-
-    empty = []
-    expanding_right = None
-    skipping = 0
-    skip_item = None
-    for venue in schedule_page.venues:
-        if venue in skip:
-            # We need to skip all the venues this item spans over
-            skipping = 1
-            skip_item = skip[venue]
-            continue
-        if venue in expanding:
-            item = row.items[venue]
-            for empty_venue in empty:
-                row.items.pop(empty_venue)
-                item['colspan'] += 1
-            empty = []
-            expanding_right = item
-        elif venue in row.items:
-            empty = []
-            expanding_right = None
-        elif expanding_right:
-            expanding_right['colspan'] += 1
-        elif skipping > 0 and skipping < skip_item['colspan']:
-            skipping += 1
-        else:
-            skipping = 0
-            empty.append(venue)
-            row.items[venue] = {'item': None, 'rowspan': 1, 'colspan': 1}
+class ScheduleTimeline(object):
+    """The blocks and slots, sorted by time, so the block and slots
+       around a given time can be found by bisection."""
 
-    return row
+    def __init__(self, blocks, slots):
+        slots = list(slots)
+        self.blocks = sorted(blocks, key=lambda x: x.start_time)
+        self.block_starts = [block.start_time for block in self.blocks]
+        # All the times at which a block or slot starts or ends
+        changes = set()
+        for block in self.blocks:
+            changes.update((block.start_time, block.end_time))
+        for slot in slots:
+            changes.update((slot.get_start_time(), slot.end_time))
+        self.changes = sorted(changes)
+        # The slots overlapping each block, ordered by end time, and
+        # the end times, for bisect
+        self.block_slots = {}
+        self.block_ends = {}
+        for block in self.blocks:
+            block_slots = sorted(
+                (slot for slot in slots
+                 if not (slot.get_start_time() > block.end_time or
+                         slot.end_time < block.start_time)),
+                key=lambda x: (x.end_time, x.get_start_time()))
+            self.block_slots[block.pk] = block_slots
+            self.block_ends[block.pk] = [slot.end_time
+                                         for slot in block_slots]
+
+    def get_block(self, timestamp):
+        """Return the block in progress at the given time"""
+        pos = bisect.bisect_left(self.block_starts, timestamp) - 1
+        if pos >= 0:
+            block = self.blocks[pos]
+            if block.start_time < timestamp < block.end_time:
+                return block
+        return None
 
+    def next_change(self, timestamp):
+        """Return the first time after the given time at which a block
+           or slot starts or ends, or None if there isn't one."""
+        pos = bisect.bisect_right(self.changes, timestamp)
+        if pos < len(self.changes):
+            return self.changes[pos]
+        return None
 
-def generate_schedule(this_block=None):
-    """Helper function which creates an ordered list of schedule days"""
-    # We create a list of slots and schedule items
-    schedule_pages = {}
-    seen_items = {}
-    for slot in Slot.objects.all().order_by('end_time', 'start_time'):
-        block = slot.get_block()
-        if this_block and block != this_block:
-            # Restrict ourselves to only given block
-            continue
-        schedule_page = schedule_pages.get(block)
+    def get_slots(self, block, timestamp):
+        """Return the previous, current and next slots in the block at
+           the given time.
+
+           The previous slot is the last slot to end before the time,
+           and the next slot is the first to end after the current slot
+           which hasn't started yet."""
+        slots = self.block_slots[block.pk]
+        ends = self.block_ends[block.pk]
+        prev_slot = cur_slot = next_slot = None
+        pos = bisect.bisect_right(ends, timestamp)
+        if pos > 0:
+            # The first of the slots ending at the latest time
+            prev_slot = slots[bisect.bisect_left(ends, ends[pos - 1])]
+        # The slots after pos end after the timestamp. Slots shouldn't
+        # overlap, so these loops are short.
+        for slot in reversed(slots[pos:]):
+            if slot.get_start_time() <= timestamp:
+                cur_slot = slot
+                break
+        for slot in slots[pos:]:
+            if slot.get_start_time() > timestamp:
+                next_slot = slot
+                break
+        return prev_slot, cur_slot, next_slot
+
+
+class ScheduleData(object):
+    """All the objects needed to render the schedule, loaded in a fixed
+       number of bulk queries.
+
+       Slot start times are resolved in memory, by wiring up the
+       previous_slot chains between the loaded slots, so rendering the
+       schedule doesn't cost any further queries per slot or per item.
+
+       This is picklable, so it can be stored in the cache as a snapshot
+       of the given schedule version (see get_schedule_snapshot). Only
+       the fields of the speakers that the schedule displays are loaded,
+       so the snapshot doesn't hold their passwords or email addresses
+       (see get_emails)."""
+
+    def __init__(self, version=None):
+        self.version = version
+        self.blocks = list(ScheduleBlock.objects.all())
+        self.blocks_by_id = {block.pk: block for block in self.blocks}
+        self.venues = venues = list(Venue.objects.all())
+        venue_blocks = {}
+        for venue_id, block_id in Venue.blocks.through.objects.values_list(
+                'venue_id', 'scheduleblock_id'):
+            venue_blocks.setdefault(block_id, set()).add(venue_id)
+        # Venues are already in the display order
+        self.venues_by_block = {
+            block.pk: [venue for venue in venues
+                       if venue.pk in venue_blocks.get(block.pk, ())]
+            for block in self.blocks}
+
+        self.slots = list(Slot.objects.all().order_by('end_time',
+                                                      'start_time'))
+        self.slots_by_id = {slot.pk: slot for slot in self.slots}
+        previous_slot = Slot._meta.get_field('previous_slot')
+        for slot in self.slots:
+            if slot.previous_slot_id:
+                previous_slot.set_cached_value(
+                    slot, self.slots_by_id[slot.previous_slot_id])
+        self.timeline = ScheduleTimeline(self.blocks, self.slots)
+
+        people = get_user_model().objects.select_related(
+            'userprofile').only(*SNAPSHOT_USER_FIELDS)
+        self.items = list(
+            ScheduleItem.objects
+            .select_related('venue', 'talk', 'talk__talk_type',
+                            'talk__track', 'page')
+            .prefetch_related(
+                Prefetch('slots',
+                         queryset=Slot.objects.select_related(
+                             'previous_slot')),
+                Prefetch('talk__authors', queryset=people),
+                Prefetch('page__people', queryset=people))
+            .order_by('id'))
+        self._wire_page_parents()
+
+        self.items_by_slot = {}
+        for item in self.items:
+            for slot in item.slots.all():
+                self.items_by_slot.setdefault(slot.pk, []).append(item)
+
+        self.schedule_pages = self._make_schedule_pages()
+        self.schedule_pages_by_block = dict(
+            (page.block.pk, page) for page in self.schedule_pages)
+
+    def _wire_page_parents(self):
+        """Resolve the page hierarchy for get_absolute_url in memory."""
+        if not any(item.page and item.page.parent_id for item in self.items):
+            return
+        pages = {page.pk: page
+                 for page in Page.objects.only('slug', 'parent')}
+        parent = Page._meta.get_field('parent')
+        for page in pages.values():
+            if page.parent_id:
+                parent.set_cached_value(page, pages[page.parent_id])
+        for item in self.items:
+            if item.page and item.page.parent_id:
+                parent.set_cached_value(item.page,
+                                        pages[item.page.parent_id])
+
+    def get_emails(self):
+        """Return the email addresses of the speakers, by user id.
+
+           These aren't part of the snapshot, so they're looked up
+           when they're needed."""
+        user_ids = set()
+        for item in self.items:
+            if item.talk:
+                user_ids.update(user.pk for user in item.talk.authors.all())
+            if item.page:
+                user_ids.update(user.pk for user in item.page.people.all())
+        return dict(get_user_model().objects.filter(
+            pk__in=user_ids).values_list('pk', 'email'))
+
+    def get_block(self, slot):
+        """Equivalent to Slot.get_block, without the queries."""
+        return self.blocks_by_id.get(slot.block_id)
+
+    def get_items(self, slot):
+        return self.items_by_slot.get(slot.pk, [])
+
+    def make_schedule_page(self, block, slots=None):
+        """Lay out the schedule page for the given slots in the block.
+
+           If slots isn't given, the page has no rows."""
+        return SchedulePage(block, self.venues_by_block.get(block.pk, []),
+                            [(slot, self.get_items(slot))
+                             for slot in slots or ()])
+
+    def get_schedule_page(self, block):
+        """Return the schedule page for the whole block"""
+        schedule_page = self.schedule_pages_by_block.get(block.pk)
         if schedule_page is None:
-            schedule_page = schedule_pages[block] = SchedulePage(block)
-        row = make_schedule_row(schedule_page, slot, seen_items)
-        schedule_page.rows.append(row)
-    return sorted(schedule_pages.values(), key=lambda x: x.block.start_time)
+            schedule_page = self.make_schedule_page(block)
+        return schedule_page
+
+    def _make_schedule_pages(self):
+        """Create the ordered list of schedule days, with the layout
+           of each day computed once for this version of the schedule."""
+        block_slots = {}
+        for slot in self.slots:
+            block_slots.setdefault(self.get_block(slot), []).append(slot)
+        schedule_pages = [self.make_schedule_page(block, slots)
+                          for block, slots in block_slots.items()]
+        return sorted(schedule_pages, key=lambda x: x.block.start_time)
+
+
+def get_schedule_snapshot():
+    """Return the ScheduleData for the current schedule version.
+
+       The snapshot is shared between processes via the wafer cache, and
+       only rebuilt when the schedule version changes."""
+    cache = caches[settings.WAFER_CACHE]
+    # Fetch the version and snapshot together, to save a cache query
+    cached = cache.get_many([SCHEDULE_VERSION_KEY, SCHEDULE_SNAPSHOT_KEY])
+    version = cached.get(SCHEDULE_VERSION_KEY) or get_schedule_version()
+    snapshot = cached.get(SCHEDULE_SNAPSHOT_KEY)
+    if snapshot is None or snapshot.version != version:
+        snapshot = ScheduleData(version)
+        cache.set(SCHEDULE_SNAPSHOT_KEY, snapshot, None)
+    return snapshot
+
+
+def generate_schedule(this_block=None, snapshot=None):
+    """Helper function which creates an ordered list of schedule days"""
+    if snapshot is None:
+        snapshot = get_schedule_snapshot()
+    schedule_pages = snapshot.schedule_pages
+    if this_block:
+        # Restrict ourselves to only given block
+        schedule_pages = [page for page in schedule_pages
+                          if page.block == this_block]
+    return schedule_pages
 
 
 def lookup_highlighted_venue(request):
@@ -165,6 +476,10 @@ class ScheduleView(BuildableTemplateView):
     template_name = 'wafer.schedule/full_schedule.html'
     build_path = 'schedule/index.html'
 
+    def get_build_inputs(self):
+        """The static schedule pages only change with the schedule"""
+        return [get_schedule_version()]
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Check if the schedule is valid
@@ -184,12 +499,13 @@ class ScheduleView(BuildableTemplateView):
             block_id = int(self.request.GET.get('block', -1))
         except ValueError:
             block_id = -1
-        blocks = ScheduleBlock.objects.all()
-        try:
-            this_block = blocks.get(id=block_id)
-        except ObjectDoesNotExist:
-            # We choose to return the full schedule if given an invalid block id
-            this_block = None
+        snapshot = get_schedule_snapshot()
+        blocks = snapshot.blocks
+        # We choose to return the full schedule if given an invalid block id
+        this_block = None
+        for block in blocks:
+            if block.id == block_id:
+                this_block = block
         highlight_venue = lookup_highlighted_venue(self.request)
         context['highlight_venue_pk'] = -1
         if highlight_venue is not None:
@@ -197,66 +513,100 @@ class ScheduleView(BuildableTemplateView):
         if this_block:
             # Add next / prev blocks links
             # blocks are sorted by time by default
-            blocks = list(blocks)
             pos = blocks.index(this_block)
             if pos > 0:
                 context['prev_block'] = blocks[pos - 1]
             if pos < len(blocks) - 1:
                 context['next_block'] = blocks[pos + 1]
-        context['schedule_pages'] = generate_schedule(this_block)
-        context['schedule_version'] = get_schedule_version()
+        context['schedule_pages'] = generate_schedule(this_block, snapshot)
+        context['schedule_version'] = snapshot.version
         return context
 
 
 class ScheduleXmlView(ScheduleView):
-    template_name = 'wafer.schedule/penta_schedule.xml'
     content_type = 'application/xml'
     build_path = 'schedule/pentabarf.xml'
 
+    # How long we keep the output for each schedule version
+    CACHE_TIMEOUT = 60 * 60 * 24
+
     def get_context_data(self, **kwargs):
         """Allow adding a 'render_description' parameter"""
         context = super().get_context_data(**kwargs)
-        context['wafer_version'] = __version__
-        context['TIME_ZONE'] = settings.TIME_ZONE
-        context['WAFER_CONFERENCE_ACRONYM'] = settings.WAFER_CONFERENCE_ACRONYM
-        if self.request.GET.get('render_description', None) == '1':
-            context['render_description'] = True
-        else:
-            context['render_description'] = False
+        context['render_description'] = (
+            self.request.GET.get('render_description', None) == '1')
+        user = getattr(self.request, 'user', None)
+        # We will want finer grained control of the contact details
+        # eventually, but staff will do for now
+        context['show_contacts'] = bool(user and user.is_staff)
         return context
 
+    def render_to_response(self, context, **response_kwargs):
+        if not context['active']:
+            content = render_pentabarf(
+                [], '', [], get_current_site(self.request))
+            return HttpResponse(content, content_type=self.content_type)
+        schedule_pages = context['schedule_pages']
+        # The output only depends on the schedule version, the blocks
+        # shown and the options
+        key = 'wafer_pentabarf:%s:%s:%d:%d' % (
+            context['schedule_version'],
+            ','.join(str(page.block.pk) for page in schedule_pages),
+            context['show_contacts'], context['render_description'])
+        cache = caches[settings.WAFER_CACHE]
+        content = cache.get(key)
+        if content is None:
+            snapshot = get_schedule_snapshot()
+            content = render_pentabarf(
+                schedule_pages, context['schedule_version'],
+                snapshot.items, get_current_site(self.request),
+                contacts=(snapshot.get_emails()
+                          if context['show_contacts'] else None),
+                render_description=context['render_description'])
+            cache.set(key, content, self.CACHE_TIMEOUT)
+        return HttpResponse(content, content_type=self.content_type)
+
+    def get_content(self):
+        """Return the XML for bakery"""
+        return self.get(self.request).content
+
+
+def parse_timestamp(timestamp, request=None):
+    """
+    Parse a user provided timestamp query string parameter.
+    Return a TZ aware datetime, or None.
+
+    If a request is given, parse errors are reported to the user with
+    messages.
+    """
+    if not timestamp:
+        return None
+    try:
+        timestamp = parse_datetime(timestamp)
+    except ValueError as e:
+        if request is not None:
+            messages.error(request, 'Failed to parse timestamp: %s' % e)
+        # Short circuit out here
+        return None
+    if timestamp is None:
+        # If parse_datetime completely fails to extract anything
+        # we end up here
+        if request is not None:
+            messages.error(request, 'Failed to parse timestamp')
+        return None
+    if not timezone.is_aware(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp
+
 
 class CurrentView(TemplateView):
     template_name = 'wafer.schedule/current.html'
 
-    def _parse_timestamp(self, timestamp):
-        """
-        Parse a user provided timestamp query string parameter.
-        Return a TZ aware datetime, or None.
-        """
-        if not timestamp:
-            return None
-        try:
-            timestamp = parse_datetime(timestamp)
-        except ValueError as e:
-            messages.error(self.request,
-                           'Failed to parse timestamp: %s' % e)
-            # Short circuit out here
+    def _get_schedule_page(self, snapshot, timestamp):
+        block = snapshot.timeline.get_block(timestamp)
+        if block is None:
             return None
-        if timestamp is None:
-            # If parse_datetime completely fails to extract anything
-            # we end up here
-            messages.error(self.request, 'Failed to parse timestamp')
-            return None
-        if not timezone.is_aware(timestamp):
-            timestamp = timezone.make_aware(timestamp)
-        return timestamp
-
-    def _get_schedule_page(self, timestamp):
-        for candidate in ScheduleBlock.objects.all():
-            if candidate.start_time < timestamp < candidate.end_time:
-                return SchedulePage(candidate)
-        return None
+        return snapshot.get_schedule_page(block)
 
     def _add_note(self, row, note, overlap_note):
         for item in row.items.values():
@@ -266,42 +616,31 @@ class CurrentView(TemplateView):
                 # Must overlap with current slot
                 item['note'] = overlap_note
 
-    def _current_slots(self, schedule_page, search_time):
-        cur_slot, prev_slot, next_slot = None, None, None
-        for slot in Slot.objects.all():
-            if (slot.get_start_time() > schedule_page.block.end_time or
-                    slot.end_time < schedule_page.block.start_time):
-                continue
-            if slot.get_start_time() <= search_time < slot.end_time:
-                cur_slot = slot
-            elif slot.end_time <= search_time:
-                if not prev_slot or prev_slot.end_time < slot.end_time:
-                    prev_slot = slot
-            elif slot.get_start_time() >= search_time:
-                if not next_slot or next_slot.end_time > slot.end_time:
-                    next_slot = slot
+    def _current_slots(self, snapshot, schedule_page, search_time):
+        prev_slot, cur_slot, next_slot = snapshot.timeline.get_slots(
+            schedule_page.block, search_time)
         cur_rows = self._current_rows(
-            schedule_page, cur_slot, prev_slot, next_slot)
+            snapshot, schedule_page, cur_slot, prev_slot, next_slot)
         return cur_slot, cur_rows
 
-    def _current_rows(self, schedule_page, cur_slot, prev_slot, next_slot):
-        seen_items = {}
-        rows = []
-        for slot in (prev_slot, cur_slot, next_slot):
-            if slot:
-                row = make_schedule_row(schedule_page, slot, seen_items)
-            else:
-                row = None
-            rows.append(row)
-        # Add styling hints. Needs to be after all the schedule rows are
-        # created so the spans are set correctly
+    def _current_rows(self, snapshot, schedule_page, cur_slot, prev_slot,
+                      next_slot):
+        # We lay out just these rows, so items are only extended over
+        # the rows we show
+        slots = [slot for slot in (prev_slot, cur_slot, next_slot) if slot]
+        rows = snapshot.make_schedule_page(schedule_page.block, slots).rows
+        # Add styling hints. The rows are created for this request, so
+        # we can change them
+        notes = {}
         if prev_slot:
-            self._add_note(rows[0], 'complete', 'current')
+            notes[prev_slot] = ('complete', 'current')
         if cur_slot:
-            self._add_note(rows[1], 'current', 'current')
+            notes[cur_slot] = ('current', 'current')
         if next_slot:
-            self._add_note(rows[2], 'forthcoming', 'current')
-        return [r for r in rows if r]
+            notes[next_slot] = ('forthcoming', 'current')
+        for row in rows:
+            self._add_note(row, *notes[row.slot])
+        return rows
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -327,10 +666,12 @@ class CurrentView(TemplateView):
         context['refresh'] = self.request.GET.get('refresh', None)
 
         # Allow the current time to be overridden, mostly for testing
-        timestamp = self._parse_timestamp(
-                self.request.GET.get('timestamp', None)) or timezone.now()
+        timestamp = parse_timestamp(
+                self.request.GET.get('timestamp', None),
+                self.request) or timezone.now()
 
-        schedule_page = self._get_schedule_page(timestamp)
+        snapshot = get_schedule_snapshot()
+        schedule_page = self._get_schedule_page(snapshot, timestamp)
         # If there are no items scheduled for today, return an empty slots list
         if schedule_page is None:
             return context
@@ -341,13 +682,273 @@ class CurrentView(TemplateView):
         if highlight_venue is not None:
             context['highlight_venue_pk'] = highlight_venue
 
-        cur_slot, current_rows = self._current_slots(schedule_page, timestamp)
+        cur_slot, current_rows = self._current_slots(
+            snapshot, schedule_page, timestamp)
         context['cur_slot'] = cur_slot
         context['slots'].extend(current_rows)
 
         return context
 
 
+class CurrentJsonView(CurrentView):
+    """The current view as JSON, for signage and other lightweight
+       clients."""
+
+    def _item_data(self, entry):
+        item = entry['item']
+        return {
+            'id': item.pk,
+            'venue': item.venue_id,
+            'title': item.get_title(),
+            'url': item.get_url(),
+            'rowspan': entry['rowspan'],
+            'colspan': entry['colspan'],
+            'note': entry.get('note'),
+        }
+
+    def render_to_response(self, context, **response_kwargs):
+        data = {'active': context['active']}
+        if not context['active']:
+            return JsonResponse(data)
+        schedule_page = context.get('schedule_page')
+        data['venues'] = []
+        if schedule_page:
+            data['venues'] = [{'id': venue.pk, 'name': venue.name}
+                              for venue in schedule_page.venues]
+        data['slots'] = []
+        for row in context['slots']:
+            data['slots'].append({
+                'id': row.slot.pk,
+                'start_time': row.slot.get_start_time().isoformat(),
+                'end_time': row.slot.end_time.isoformat(),
+                'current': row.slot == context['cur_slot'],
+                'items': [self._item_data(entry)
+                          for entry in row.get_sorted_items()
+                          if entry['item']],
+            })
+        return JsonResponse(data)
+
+
+def _now_playing_item(snapshot, item):
+    # Use the snapshot's slots, which have their previous slots wired up
+    slots = [snapshot.slots_by_id[slot.pk] for slot in item.slots.all()]
+    return {
+        'id': item.pk,
+        'title': item.get_title(),
+        'url': item.get_url(),
+        'start_time': min(slot.get_start_time() for slot in slots).isoformat(),
+        'end_time': max(slot.end_time for slot in slots).isoformat(),
+    }
+
+
+def now_playing(snapshot, timestamp):
+    """Return the current and next item in each venue at the given time,
+       for the live displays."""
+    timeline = snapshot.timeline
+    block = timeline.get_block(timestamp)
+    if block is None:
+        return []
+    _prev_slot, cur_slot, _next_slot = timeline.get_slots(block, timestamp)
+    later_slots = sorted(
+        (slot for slot in timeline.block_slots[block.pk]
+         if slot.get_start_time() > timestamp),
+        key=lambda x: x.get_start_time())
+    venues = []
+    for venue in snapshot.venues_by_block.get(block.pk, []):
+        current = upcoming = None
+        if cur_slot:
+            for item in snapshot.get_items(cur_slot):
+                if item.venue_id == venue.pk:
+                    current = item
+                    break
+        for slot in later_slots:
+            for item in snapshot.get_items(slot):
+                if item.venue_id == venue.pk and item != current:
+                    upcoming = item
+                    break
+            if upcoming:
+                break
+        venues.append({
+            'id': venue.pk,
+            'name': venue.name,
+            'current': current and _now_playing_item(snapshot, current),
+            'next': upcoming and _now_playing_item(snapshot, upcoming),
+        })
+    return venues
+
+
+class NowPlayingStream(object):
+    """The current and next items in each venue, as a stream of
+       server-sent events, or as a single JSON document for long-polling
+       clients.
+
+       Rather than re-rendering the state on a timer, the stream sleeps
+       until the next block or slot boundary in the schedule timeline.
+       It wakes every NOW_PLAYING_POLL_INTERVAL seconds to check the
+       schedule version, which is a cache lookup, and only loads the
+       schedule snapshot again if the version has changed.
+
+       The stream can be iterated synchronously or asynchronously. Without
+       wait, it returns the current state straight away, with a hint for
+       when the client should reconnect, so it doesn't hold a worker
+       thread under WSGI."""
+
+    def __init__(self, user, last_event_id=None, timestamp=None,
+                 long_poll=False, max_age=None, wait=True):
+        self.user = user
+        self.last_event_id = last_event_id
+        self.long_poll = long_poll
+        self.wait = wait
+        if not wait:
+            max_age = 0
+        elif max_age is None:
+            if long_poll:
+                max_age = NOW_PLAYING_LONG_POLL_TIMEOUT
+            else:
+                max_age = NOW_PLAYING_MAX_AGE
+        self.max_age = max_age
+        # Allow the current time to be overridden, mostly for testing
+        self.offset = datetime.timedelta(0)
+        if timestamp is not None:
+            self.offset = timestamp - timezone.now()
+        self.version = None
+        self.active = False
+        self.snapshot = None
+
+    def now(self):
+        return timezone.now() + self.offset
+
+    def _refresh(self):
+        version = get_schedule_version()
+        if self.version is not None and version == self.version:
+            return
+        self.version = version
+        self.active = check_schedule() and (
+            not settings.WAFER_HIDE_SCHEDULE or self.user.is_staff)
+        if self.active:
+            self.snapshot = get_schedule_snapshot()
+
+    def get_state(self, now):
+        """Return the event id and data for the state at the given time.
+
+           The event id is a digest of the data, so clients can tell us
+           what they last saw."""
+        self._refresh()
+        data = {'active': self.active}
+        if self.active:
+            data['venues'] = now_playing(self.snapshot, now)
+        event_id = hashlib.md5(json.dumps(data, sort_keys=True).encode(
+            'utf-8')).hexdigest()
+        return event_id, data
+
+    def get_wait(self, now):
+        """Return the number of seconds until the state may change"""
+        wait = NOW_PLAYING_POLL_INTERVAL
+        if self.active:
+            change = self.snapshot.timeline.next_change(now)
+            if change is not None:
+                wait = min(wait, (change - now).total_seconds())
+        return max(wait, 0)
+
+    def get_retry(self):
+        """Return the number of seconds until a client that doesn't wait
+           should reconnect"""
+        return max(math.ceil(self.get_wait(self.now())), 1)
+
+    def next_message(self, final=False):
+        """Return the message to send for the current state, if any, and
+           whether the stream is finished."""
+        event_id, data = self.get_state(self.now())
+        changed = event_id != self.last_event_id
+        self.last_event_id = event_id
+        if self.long_poll:
+            if changed or final:
+                data['id'] = event_id
+                if not self.wait:
+                    data['retry'] = self.get_retry()
+                return json.dumps(data), True
+            return None, False
+        if changed:
+            message = 'id: %s\ndata: %s\n\n' % (event_id, json.dumps(data))
+        else:
+            # Comments keep the connection open through proxies, and let
+            # us notice clients that have gone away
+            message = ': keepalive\n\n'
+        if not self.wait:
+            # The client reconnects when the state may change
+            message += 'retry: %d\n\n' % (self.get_retry() * 1000)
+        return message, final
+
+    def _start(self):
+        if self.long_poll or not self.wait:
+            return None
+        return 'retry: %d\n\n' % (NOW_PLAYING_POLL_INTERVAL * 1000)
+
+    def __iter__(self):
+        deadline = time.monotonic() + self.max_age
+        message = self._start()
+        if message:
+            yield message
+        while True:
+            remaining = deadline - time.monotonic()
+            message, done = self.next_message(final=remaining <= 0)
+            if message:
+                yield message
+            if done or remaining <= 0:
+                return
+            time.sleep(min(self.get_wait(self.now()), remaining))
+
+    async def __aiter__(self):
+        deadline = time.monotonic() + self.max_age
+        message = self._start()
+        if message:
+            yield message
+        while True:
+            remaining = deadline - time.monotonic()
+            message, done = await sync_to_async(self.next_message)(
+                final=remaining <= 0)
+            if message:
+                yield message
+            if done or remaining <= 0:
+                return
+            await asyncio.sleep(min(self.get_wait(self.now()), remaining))
+
+
+class NowPlayingView(View):
+    """Push the current and next item in each venue to live displays.
+
+       By default, this is a stream of server-sent events. With the poll
+       parameter, this waits until the state differs from the given
+       last_event_id (or times out) and returns it as JSON.
+
+       We only wait for changes under ASGI. Under WSGI, each waiting
+       client would hold a worker thread, so we return the current state
+       at once, and tell the client when to reconnect."""
+
+    def get(self, request):
+        long_poll = 'poll' in request.GET
+        last_event_id = (request.headers.get('Last-Event-ID') or
+                         request.GET.get('last_event_id'))
+        is_async = isinstance(request, ASGIRequest)
+        stream = NowPlayingStream(
+            request.user, last_event_id,
+            timestamp=parse_timestamp(request.GET.get('timestamp')),
+            long_poll=long_poll, wait=is_async)
+        if is_async:
+            content = stream.__aiter__()
+        else:
+            content = iter(stream)
+        if long_poll:
+            content_type = 'application/json'
+        else:
+            content_type = 'text/event-stream'
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Cache-Control'] = 'no-cache'
+        # Don't let nginx buffer the events
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def get_validation_info(request):
@@ -357,6 +958,36 @@ def get_validation_info(request):
     return Response({'Validation Status': errors})
 
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def get_changes_info(request):
+    """API endpoint listing the changes to the schedule after the
+       sequence number given by 'since', for clients polling the
+       schedule."""
+    if settings.WAFER_HIDE_SCHEDULE and not request.user.is_staff:
+        raise PermissionDenied
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return Response({'detail': 'Invalid sequence number'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    changes = get_schedule_changes(since, SCHEDULE_CHANGES_LIMIT + 1)
+    more = len(changes) > SCHEDULE_CHANGES_LIMIT
+    changes = changes[:SCHEDULE_CHANGES_LIMIT]
+    return Response({
+        'since': since,
+        'latest': changes[-1].pk if changes else since,
+        'more': more,
+        'changes': [
+            {'seq': change.pk,
+             'kind': change.kind,
+             'id': change.object_id,
+             'action': change.action,
+             'timestamp': change.timestamp.isoformat()}
+            for change in changes],
+    })
+
+
 class ScheduleItemViewSet(viewsets.ModelViewSet):
     """
     API endpoint that allows groups to be viewed or edited.
@@ -365,11 +996,46 @@ class ScheduleItemViewSet(viewsets.ModelViewSet):
     serializer_class = ScheduleItemSerializer
     permission_classes = (IsAdminUser, )
 
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if actions and 'batch' in actions.values():
+            # The batch returns the validation state once its changes
+            # are committed, so it can't run inside ATOMIC_REQUESTS
+            view = transaction.non_atomic_requests(view)
+        return view
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Apply a list of changes to the schedule items in a single
+           transaction and revision, and return the new validation
+           state of the schedule, so the editor only needs one request
+           for changes like swapping two talks.
+
+           The validation state is computed after the transaction
+           commits, when the batched updates have been applied."""
+        serializer = ScheduleBatchSerializer(
+            data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        # The schedule version and validation state are updated once the
+        # transaction is committed
+        with batch_schedule_updates():
+            with transaction.atomic(), revisions.create_revision():
+                result = serializer.save()
+                revisions.set_user(request.user)
+                revisions.set_comment("Updated using Schedule Editor")
+        items = self.get_serializer(result['items'], many=True)
+        return Response({
+            'items': items.data,
+            'deleted': result['deleted'],
+            'Validation Status': validate_schedule(),
+        })
+
 
 class ScheduleEditView(TemplateView):
     template_name = 'wafer.schedule/edit_schedule.html'
 
-    def _slot_context(self, slot, venues):
+    def _slot_context(self, slot, venues, slot_items):
         slot_context = {
             'name': slot.name,
             'start_time': slot.get_start_time(),
@@ -382,21 +1048,34 @@ class ScheduleEditView(TemplateView):
                 'name': venue.name,
                 'id': venue.id,
             }
-            for schedule_item in slot.scheduleitem_set.all():
-                if schedule_item.venue.name == venue.name:
-                    venue_context['scheduleitem_id'] = schedule_item.id
-                    if schedule_item.talk:
-                        talk = schedule_item.talk
-                        venue_context['title'] = talk.title
-                        venue_context['talk'] = talk
-                    if (schedule_item.page and
-                            not schedule_item.page.exclude_from_static):
-                        page = schedule_item.page
-                        venue_context['title'] = page.name
-                        venue_context['page'] = page
+            schedule_item = slot_items.get((slot.pk, venue.pk))
+            if schedule_item:
+                venue_context['scheduleitem_id'] = schedule_item.id
+                if schedule_item.talk:
+                    talk = schedule_item.talk
+                    venue_context['title'] = talk.title
+                    venue_context['talk'] = talk
+                if (schedule_item.page and
+                        not schedule_item.page.exclude_from_static):
+                    page = schedule_item.page
+                    venue_context['title'] = page.name
+                    venue_context['page'] = page
             slot_context['venues'].append(venue_context)
         return slot_context
 
+    def _slot_items(self, block):
+        """Return a dictionary of the schedule items in the block, keyed
+           by (slot id, venue id)."""
+        slot_items = {}
+        scheduled = ScheduleItem.slots.through.objects.filter(
+            slot__block=block).select_related(
+                'scheduleitem__talk', 'scheduleitem__page').order_by(
+                    'scheduleitem_id')
+        for row in scheduled:
+            item = row.scheduleitem
+            slot_items[(row.slot_id, item.venue_id)] = item
+        return slot_items
+
     def get_context_data(self, block_id=None, **kwargs):
         context = super().get_context_data(**kwargs)
 
@@ -408,90 +1087,367 @@ class ScheduleEditView(TemplateView):
 
         public_talks = Talk.objects.filter(Q(status=ACCEPTED) |
                                            Q(status=CANCELLED))
-        public_talks = public_talks.order_by("talk_type", "talk_id")
-        venues = Venue.objects.filter(blocks__in=[block])
-        slots = Slot.objects.all().select_related(
-            'previous_slot').prefetch_related(
-            'scheduleitem_set', 'slot_set').order_by(
-                'end_time', 'start_time')
+        public_talks = list(public_talks.select_related(
+            'talk_type', 'track').order_by("talk_type", "talk_id"))
+        scheduled_talks = set(ScheduleItem.objects.filter(
+            talk__isnull=False).values_list('talk_id', flat=True))
+        venues = list(Venue.objects.filter(blocks__in=[block]))
+        # Slot.block is set when the slot is saved, so this only loads
+        # the slots in the block
+        slots = Slot.objects.filter(block=block).select_related(
+            'previous_slot').order_by('end_time', 'start_time')
+        slot_items = self._slot_items(block)
         aggregated_slots = []
 
         for slot in slots:
-            if block != slot.get_block():
-                continue
-            aggregated_slots.append(self._slot_context(slot, venues))
+            aggregated_slots.append(
+                self._slot_context(slot, venues, slot_items))
 
         context['this_block'] = block
         context['venues'] = venues
         context['slots'] = aggregated_slots
         context['talks_all'] = public_talks
-        context['talks_unassigned'] = public_talks.filter(scheduleitem=None)
+        context['talks_unassigned'] = set(
+            talk for talk in public_talks
+            if talk.pk not in scheduled_talks)
         context['pages'] = Page.objects.all()
         context['all_blocks'] = blocks
-        context['validation_errors'] = validate_schedule()
+        # Checking the whole schedule can be slow, so if we don't
+        # already have the validation state, the editor fetches it
+        # from the validation API once the page has loaded
+        state = get_cached_schedule_validation()
+        if state is None:
+            context['validation_pending'] = True
+            context['validation_errors'] = []
+        else:
+            context['validation_errors'] = validate_schedule(state)
         return context
 
 
+def schedule_version_etag(request, **kwargs):
+    """Use the schedule version as the ETag"""
+    return get_schedule_version()
+
+
+def _ical_event_key(item, fields):
+    """The cache key for the VEVENT for a schedule item.
+
+       The item's last_updated time changes when the item or its slots
+       change, but not when the talk, page or venue is edited, so we
+       include a digest of the event details as well."""
+    digest = hashlib.md5(repr(fields).encode('utf8')).hexdigest()
+    updated = item.last_updated.timestamp() if item.last_updated else ''
+    return 'wafer_ical_event:%s:%s:%s' % (item.pk, updated, digest)
+
+
+def _ical_event_fields(item, domain):
+    return (
+        ('dtstamp', item.last_updated),
+        ('summary', item.get_title()),
+        ('location', item.venue.name),
+        ('dtstart', item.get_start_datetime()),
+        ('duration', datetime.timedelta(
+            minutes=item.get_duration_minutes())),
+        ('class', 'PUBLIC'),
+        ('uid', '%s@%s' % (item.pk, domain)),
+        ('url', item.get_url()),
+    )
+
+
+def generate_ical_events(items, domain):
+    """Generate the serialized VEVENTs for the schedule items.
+
+       The events are looked up in the cache, and rendered and stored
+       if missing, ICAL_BATCH_SIZE items at a time."""
+    cache = caches[settings.WAFER_CACHE]
+    for start in range(0, len(items), ICAL_BATCH_SIZE):
+        batch = items[start:start + ICAL_BATCH_SIZE]
+        keys = []
+        for item in batch:
+            fields = _ical_event_fields(item, domain)
+            keys.append((_ical_event_key(item, fields), fields))
+        cached = cache.get_many([key for key, _fields in keys])
+        missing = {}
+        for key, fields in keys:
+            if key not in cached:
+                sched_event = Event()
+                for name, value in fields:
+                    sched_event.add(name, value)
+                cached[key] = missing[key] = sched_event.to_ical()
+            yield cached[key]
+        if missing:
+            cache.set_many(missing, ICAL_EVENT_TIMEOUT)
+
+
+def generate_ical(items, site):
+    """Generate an iCal file for the schedule items, in chunks."""
+    calendar = Calendar()
+    calendar.add('prodid', '-//%s Schedule//%s//' % (site.name, site.domain))
+    calendar.add('version', '2.0')
+    # We add the events between the calendar header and footer
+    header, footer = calendar.to_ical().rsplit(b'END:VCALENDAR', 1)
+    yield header
+    yield from generate_ical_events(items, site.domain)
+    yield b'END:VCALENDAR' + footer
+
+
 @method_decorator(
-    condition(last_modified_func=schedule_version_last_modified),
+    condition(etag_func=schedule_version_etag,
+              last_modified_func=schedule_version_last_modified),
     name='dispatch')
-class ICalView(View, BuildableMixin):
+class ICalView(View, PrecompressedBuildMixin, BuildableMixin):
     build_path = 'schedule/schedule.ics'
 
-    def get(self, request):
+    def get_items(self):
+        """The schedule items to include in the calendar"""
+        return get_schedule_snapshot().items
+
+    def get(self, request, **kwargs):
         """Create a iCal file from the schedule"""
         # Heavily inspired by https://djangosnippets.org/snippets/2223/ and
         # the icalendar documentation
-        calendar = Calendar()
         site = get_current_site(request)
-        calendar.add('prodid', '-//%s Schedule//%s//' % (site.name, site.domain))
-        calendar.add('version', '2.0')
-
-        # Since we don't need to format anything here, we can just use a list
-        # of schedule items
-        for item in ScheduleItem.objects.all():
-            sched_event = Event()
-            sched_event.add('dtstamp', item.last_updated)
-            sched_event.add('summary', item.get_title())
-            sched_event.add('location', item.venue.name)
-            sched_event.add('dtstart', item.get_start_datetime())
-            sched_event.add('duration', datetime.timedelta(minutes=item.get_duration_minutes()))
-            sched_event.add('class', 'PUBLIC')
-            sched_event.add('uid', '%s@%s' % (item.pk, site.domain))
-            sched_event.add('url', item.get_url())
-            calendar.add_component(sched_event)
-        response = HttpResponse(calendar.to_ical(), content_type="text/calendar")
+        response = StreamingHttpResponse(
+            generate_ical(self.get_items(), site),
+            content_type="text/calendar")
         response['Content-Disposition'] = 'attachment; filename=schedule.ics'
         return response
 
     def get_content(self):
         """Return just the iCal data for bakery"""
         response = self.get(self.request)
-        return response.content
+        return b''.join(response.streaming_content)
 
     @property
     def build_method(self):
         return self.build
 
-    def build(self):
+    def get_build_inputs(self):
+        """The static calendars only change with the schedule"""
+        return [get_schedule_version()]
+
+    def build_ical(self, build_path):
         logger.debug("Building iCal schedule in %s" % (
-            self.build_path,
+            build_path,
         ))
-        self.request = self.create_request(self.build_path)
-        path = os.path.join(settings.BUILD_DIR, self.build_path)
-        self.prep_directory(self.build_path)
+        self.request = self.create_request(build_path)
+        path = os.path.join(settings.BUILD_DIR, build_path)
+        self.prep_directory(build_path)
         self.build_file(path, self.get_content())
 
+    def build(self):
+        self.build_ical(self.build_path)
+
+
+class FilteredICalView(ICalView):
+    """Base class for the iCal feeds of part of the schedule.
+
+       Subclasses define the keys of the feeds that each schedule item
+       is in, and the model and field those keys refer to."""
+    model = None
+    lookup_field = 'pk'
+    # Path to build each feed to, formatted with the key
+    build_path = None
+
+    def item_keys(self, item):
+        """Return the keys (as strings) of the feeds that include
+           this schedule item"""
+        raise NotImplementedError
+
+    def get_items(self):
+        key = self.kwargs['key']
+        items = [item for item in get_schedule_snapshot().items
+                 if key in self.item_keys(item)]
+        if not items and not self.model.objects.filter(
+                **{self.lookup_field: key}).exists():
+            raise Http404
+        return items
+
+    def get_build_keys(self):
+        """The feeds to build, which are those with schedule items"""
+        keys = set()
+        for item in get_schedule_snapshot().items:
+            keys.update(self.item_keys(item))
+        return sorted(keys)
+
+    def build(self):
+        for key in self.get_build_keys():
+            self.kwargs = {'key': key}
+            self.build_ical(self.build_path % key)
+
+
+class VenueICalView(FilteredICalView):
+    model = Venue
+    build_path = 'schedule/venue/%s/schedule.ics'
+
+    def item_keys(self, item):
+        return [str(item.venue_id)]
+
+
+class TrackICalView(FilteredICalView):
+    model = Track
+    build_path = 'schedule/track/%s/schedule.ics'
+
+    def item_keys(self, item):
+        if item.talk and item.talk.track_id:
+            return [str(item.talk.track_id)]
+        return []
+
+
+class TalkTypeICalView(FilteredICalView):
+    model = TalkType
+    build_path = 'schedule/talk_type/%s/schedule.ics'
+
+    def item_keys(self, item):
+        if item.talk and item.talk.talk_type_id:
+            return [str(item.talk.talk_type_id)]
+        return []
+
+
+class SpeakerICalView(FilteredICalView):
+    model = get_user_model()
+    lookup_field = 'username'
+    build_path = 'schedule/speaker/%s/schedule.ics'
+
+    def item_keys(self, item):
+        if item.talk:
+            return [user.username for user in item.talk.authors.all()]
+        if item.page:
+            return [user.username for user in item.page.people.all()]
+        return []
+
+
+def staff_schedule_version_etag(request, **kwargs):
+    """The schedule version ETag, for the views restricted to staff.
+
+       We don't return a version for other users, so they can't bypass
+       the permission check with a conditional request."""
+    if not request.user.is_staff:
+        return None
+    return schedule_version_etag(request, **kwargs)
+
+
+def staff_schedule_version_last_modified(request, **kwargs):
+    if not request.user.is_staff:
+        return None
+    return schedule_version_last_modified(request, **kwargs)
+
+
+def _json_event(item, emails):
+    """The JSON export data for a schedule item, given the email
+       addresses of the speakers"""
+    sched_event = {}
+    sched_event['id'] = item.pk
+    sched_event['start_time'] = item.get_start_datetime().isoformat()
+    sched_event['duration'] = item.get_duration_minutes()
+    sched_event['room_id'] = item.venue.pk
+    sched_event['title'] = item.get_title()
+    sched_event['url'] = item.get_url()
+    authors = []
+    if item.talk is not None:
+        if item.talk.track:
+            sched_event['track'] = item.talk.track.name
+        else:
+            sched_event['track'] = 'No Track'
+        # We're not rendering anything, so this is presumably 'safe'
+        sched_event['description'] = item.talk.abstract.raw
+        sched_event['video_allowed'] = item.talk.video
+        for person in item.talk.authors.all():
+            authors.append(person)
+    else:
+        # Presumably a page, which may not have an author or description
+        sched_event['track'] = 'No Track'
+        # More complex logic is probably needed here
+        sched_event['video_allowed'] = True
+        sched_event['description'] = item.page.content.raw
+        for person in item.page.people.all():
+            authors.append(person)
+    sched_event['authors'] = []
+    for person in authors:
+        person_data = {
+            'name': person.userprofile.display_name(),
+            'email': emails.get(person.pk, '')
+        }
+        sched_event['authors'].append(person_data)
+    sched_event['license'] = settings.WAFER_VIDEO_LICENSE
+    sched_event['license_url'] = settings.WAFER_VIDEO_LICENSE_URL
+    return sched_event
+
+
+def _stream_json(data, encoded=()):
+    """Encode a dictionary as JSON, in chunks.
+
+       List values are encoded an element at a time. The elements of the
+       lists for the keys in encoded are already encoded. The result is
+       the same as json.dumps(data, sort_keys=True)."""
+    yield '{'
+    for pos, key in enumerate(sorted(data)):
+        if pos:
+            yield ', '
+        yield '%s: ' % json.dumps(key)
+        value = data[key]
+        if not isinstance(value, list):
+            yield json.dumps(value, sort_keys=True)
+            continue
+        yield '['
+        for elem_pos, elem in enumerate(value):
+            if elem_pos:
+                yield ', '
+            if key in encoded:
+                yield elem
+            else:
+                yield json.dumps(elem, sort_keys=True)
+        yield ']'
+    yield '}'
+
 
 @method_decorator(
-    condition(last_modified_func=schedule_version_last_modified),
+    condition(etag_func=staff_schedule_version_etag,
+              last_modified_func=staff_schedule_version_last_modified),
     name='dispatch')
 class JsonDataView(View, BuildableMixin):
     build_path = "schedule/schedule.json"
 
     # Version of the json export, so tools can hopefully track changes
     # sanely
-    FORMAT_VERSION = "0.1"
+    FORMAT_VERSION = "0.2"
+
+    # How long we keep the event digests for each schedule version, for
+    # the 'since' delta requests
+    DIGEST_TIMEOUT = 60 * 60 * 24
+
+    def _events_key(self, version):
+        return 'wafer_schedule_json_events:%s' % version
+
+    def _digests_key(self, version):
+        return 'wafer_schedule_json_digests:%s' % version
+
+    def get_events(self, snapshot):
+        """Return the events, as (id, encoded event) pairs, and a digest
+           of each event, so we can tell which events have changed
+           between versions.
+
+           The events are only encoded once for each schedule version,
+           and shared between processes via the wafer cache. The version
+           is part of the key, so processes that are briefly on different
+           versions don't overwrite each other's events."""
+        cache = caches[settings.WAFER_CACHE]
+        cached = cache.get(self._events_key(snapshot.version))
+        if cached is not None:
+            return cached
+        events = []
+        digests = {}
+        emails = snapshot.get_emails()
+        for item in snapshot.items:
+            encoded = json.dumps(_json_event(item, emails), sort_keys=True)
+            events.append((item.pk, encoded))
+            digests[item.pk] = hashlib.md5(
+                encoded.encode('utf8')).hexdigest()
+        cache.set_many({
+            self._events_key(snapshot.version): (events, digests),
+            self._digests_key(snapshot.version): digests,
+        }, self.DIGEST_TIMEOUT)
+        return events, digests
 
     def get(self, request):
         """Create a json data blob from the schedule"""
@@ -504,17 +1460,17 @@ class JsonDataView(View, BuildableMixin):
             raise PermissionDenied
         site = get_current_site(request)
 
+        snapshot = get_schedule_snapshot()
+
         data = {
            'conference name': site.name,
            'domain': site.domain,
            'version': self.FORMAT_VERSION,
+           'schedule_version': snapshot.version,
         }
 
         data['venues'] = []
-
-        data['events'] = []
-
-        for venue in Venue.objects.all():
+        for venue in snapshot.venues:
             venue_data = {}
             venue_data['id'] = venue.pk
             venue_data['name'] = venue.name
@@ -522,43 +1478,23 @@ class JsonDataView(View, BuildableMixin):
             venue_data['details'] = venue.notes
             data['venues'].append(venue_data)
 
-        for item in ScheduleItem.objects.all():
-            sched_event = {}
-            sched_event['id'] = item.pk
-            sched_event['start_time'] = item.get_start_datetime().isoformat()
-            sched_event['duration'] = item.get_duration_minutes()
-            sched_event['room_id'] = item.venue.pk
-            sched_event['title'] = item.get_title()
-            sched_event['url'] = item.get_url()
-            authors = []
-            if item.talk is not None:
-                if item.talk.track:
-                    sched_event['track'] = item.talk.track
-                else:
-                    sched_event['track'] = 'No Track'
-                # We're not rendering anything, so this is presumably 'safe'
-                sched_event['description'] = item.talk.abstract.raw
-                sched_event['video_allowed'] = item.talk.video
-                for person in item.talk.authors.all():
-                    authors.append(person)
-            else:
-                # Presumably a page, which may not have an author or description
-                sched_event['track'] = 'No Track'
-                # More complex logic is probably needed here
-                sched_event['video_allowed'] = True
-                sched_event['description'] = item.page.content.raw
-                for person in item.page.people.all():
-                    authors.append(person)
-            sched_event['authors'] = []
-            for person in authors:
-                person_data = {
-                    'name': person.userprofile.display_name(),
-                    'email': person.email
-                }
-                sched_event['authors'].append(person_data)
-            sched_event['license'] = settings.WAFER_VIDEO_LICENSE
-            sched_event['license_url'] = settings.WAFER_VIDEO_LICENSE_URL
-            data['events'].append(sched_event)
-
-        response = JsonResponse(data, json_dumps_params={'sort_keys': True})
+        events, digests = self.get_events(snapshot)
+        since = request.GET.get('since')
+        old_digests = None
+        if since:
+            old_digests = caches[settings.WAFER_CACHE].get(
+                self._digests_key(since))
+        if old_digests is not None:
+            # Only include the events that have changed. If we don't
+            # know the requested version, we fall back to returning
+            # everything, without the 'since' key
+            data['since'] = since
+            events = [(pk, encoded) for pk, encoded in events
+                      if old_digests.get(pk) != digests[pk]]
+            data['deleted'] = sorted(set(old_digests) - set(digests))
+        data['events'] = [encoded for _pk, encoded in events]
+
+        response = StreamingHttpResponse(
+            _stream_json(data, encoded=('events',)),
+            content_type='application/json')
         return response
@@ -324,6 +324,10 @@ BAKERY_VIEWS = (
     'wafer.schedule.views.ScheduleView',
     'wafer.schedule.views.ScheduleXmlView',
     'wafer.schedule.views.ICalView',
+    'wafer.schedule.views.VenueICalView',
+    'wafer.schedule.views.TrackICalView',
+    'wafer.schedule.views.TalkTypeICalView',
+    'wafer.schedule.views.SpeakerICalView',
     'wafer.sponsors.views.ShowSponsors',
     'wafer.sponsors.views.ShowPackages',
     'wafer.sponsors.views.SponsorView',
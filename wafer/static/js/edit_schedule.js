@@ -103,6 +103,7 @@
         var newItem = document.querySelectorAll('[id=scheduleItemnull]')[0];
 
         newItem.id = 'scheduleItem' + scheduleItemId;
+        newItem.setAttribute('data-scheduleitem-id', scheduleItemId);
 
         // Add a close button, since we've deleted it if one
         // existed, and we're not going back through the template
@@ -118,15 +119,53 @@
         closeButton.appendChild(buttonSpan);
         closeButton.addEventListener('click', handleClickDelete, false);
         newItem.insertBefore(closeButton, newItem.childNodes[0]);
-
-        $.get('/schedule/api/validate/', updateValidation);
     }
 
+    function handleBatchUpdate(response) {
+        // The batch API returns the changed items and the new
+        // validation state, so we don't need to fetch it separately
+        response.items.forEach(handleItemUpdate);
+        updateValidation(response);
+    }
 
-    function handleItemDelete() {
-        console.log(this);
+    function postBatch(operations, success) {
+        $.post(
+            '/schedule/api/scheduleitems/batch/',
+            JSON.stringify({operations: operations}), success);
+    }
 
-        $.get('/schedule/api/validate/', updateValidation);
+    // The attributes of a cell that describe the item in it
+    var itemAttributes = ['id', 'data-scheduleitem-id', 'data-talk-id',
+                          'data-page-id', 'data-type'];
+    var itemClasses = ['table-success', 'table-info', 'draggable'];
+
+    function swapCells(cell, other) {
+        // Exchange the items shown in two cells. We move the nodes,
+        // rather than copying them, so the delete buttons keep their
+        // event listeners
+        var nodes = Array.from(cell.childNodes);
+        Array.from(other.childNodes).forEach(function (node) {
+            cell.appendChild(node);
+        });
+        nodes.forEach(function (node) {
+            other.appendChild(node);
+        });
+        itemAttributes.forEach(function (name) {
+            var value = cell.getAttribute(name);
+            var otherValue = other.getAttribute(name);
+            [[cell, otherValue], [other, value]].forEach(function (pair) {
+                if (pair[1] === null) {
+                    pair[0].removeAttribute(name);
+                } else {
+                    pair[0].setAttribute(name, pair[1]);
+                }
+            });
+        });
+        itemClasses.forEach(function (name) {
+            var hasClass = cell.classList.contains(name);
+            cell.classList.toggle(name, other.classList.contains(name));
+            other.classList.toggle(name, hasClass);
+        });
     }
 
     function handleDrop(e) {
@@ -145,6 +184,24 @@
         var scheduleItemType = data.getAttribute('data-type');
 
         var curScheduleItemId = e.target.getAttribute('data-scheduleitem-id');
+        if (scheduleItemId) {
+            // Moving an item that's already in the schedule. If there's
+            // an item in this cell, the two items swap places
+            if (data === e.target) {
+                return false;
+            }
+            var operation;
+            if (curScheduleItemId) {
+                operation = {action: 'swap', item: scheduleItemId,
+                             other: curScheduleItemId};
+            } else {
+                operation = {action: 'move', item: scheduleItemId,
+                             venue: venue, slots: [slot]};
+            }
+            swapCells(data, e.target);
+            postBatch([operation], updateValidation);
+            return false;
+        }
         if (curScheduleItemId)
         {
             var curType = e.target.getAttribute('data-type');
@@ -181,24 +238,14 @@
         }
 
         var ajaxData = {
+            action: 'place',
             talk: talkId,
-            page: pageId
+            page: pageId,
+            venue: venue,
+            slots: [slot]
         };
-        if (scheduleItemId) {
-            $.ajax({
-                method: 'PATCH',
-                url: '/schedule/api/scheduleitems/' + scheduleItemId + '/',
-                data: JSON.stringify(ajaxData),
-                success: handleItemUpdate
-            });
-        } else {
-            ajaxData.venue = venue;
-            ajaxData.slots = [slot];
-            console.log(ajaxData);
-            $.post(
-                '/schedule/api/scheduleitems/',
-                JSON.stringify(ajaxData), handleItemUpdate);
-        }
+        console.log(ajaxData);
+        postBatch([ajaxData], handleBatchUpdate);
 
         return false;
     }
@@ -237,13 +284,8 @@
             unassigned.hidden = false;
         }
 
-        $.ajax(
-            {
-                type: 'DELETE',
-                url: '/schedule/api/scheduleitems/' + scheduleItemId + '/',
-                success: handleItemDelete
-            }
-        );
+        postBatch([{action: 'delete', item: scheduleItemId}],
+                  updateValidation);
     }
 
     function getCookie(name) {
@@ -298,4 +340,10 @@
     [].forEach.call(deletableItems, function (deletableItem) {
         deletableItem.addEventListener('click', handleClickDelete, false);
     });
+
+    // Checking the schedule may be slow, so the validation errors are
+    // loaded after the editor if they weren't ready
+    if (document.getElementById('validationMessages').hasAttribute('data-pending')) {
+        $.get('/schedule/api/validate/', updateValidation);
+    }
 })();
@@ -1,12 +1,14 @@
 from django.conf import settings
 from django.core import validators
+from django.core.cache import caches
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.template.defaultfilters import slugify
 from django.urls import reverse
 from django.utils.functional import lazy
 from django.utils.text import format_lazy
 from django.utils.translation import gettext, gettext_lazy as _
-from django.utils.timezone import now
+from django.utils.timezone import localtime, now
 
 import reversion
 from markitup.fields import MarkupField
@@ -280,7 +282,7 @@ class Talk(models.Model):
         authors = list(self.authors.all())
         # Corresponding authors first
         authors.sort(
-            key=lambda author: u'' if author == self.corresponding_author
+            key=lambda author: u'' if author.pk == self.corresponding_author_id
                                else author.userprofile.display_name())
         names = [author.userprofile.display_name() for author in authors]
         if len(names) <= settings.WAFER_SCHEDULE_MAX_AUTHORS:
@@ -335,6 +337,9 @@ class Talk(models.Model):
     withdrawn = property(fget=lambda x: x.status == WITHDRAWN)
 
     def _is_among_authors(self, user):
+        if not user.is_authenticated:
+            # Such as the user the static site is built as
+            return False
         if self.corresponding_author.username == user.username:
             return True
         # not chaining with logical-or to avoid evaluation of the queryset
@@ -465,3 +470,32 @@ class Score(models.Model):
         unique_together = (('review', 'aspect'),)
         verbose_name = _('score')
         verbose_name_plural = _('scores')
+
+
+SPEAKERS_VERSION_KEY = 'wafer_speakers_version'
+
+
+def get_speakers_version():
+    """Return the current version of the speakers, as a string"""
+    version = caches[settings.WAFER_CACHE].get(SPEAKERS_VERSION_KEY)
+    if not version:
+        version = update_speakers_version()
+    return version
+
+
+def update_speakers_version(*args, **kwargs):
+    """Store the speakers version in the wafer cache, so it's shared
+    between processes.
+
+    The version changes whenever the talks, talk types or users do, so
+    the speakers page can cache the speakers for each version."""
+    version = localtime().isoformat()
+    caches[settings.WAFER_CACHE].set(SPEAKERS_VERSION_KEY, version,
+                                     timeout=None)
+    return version
+
+
+for sender in (Talk, TalkType):
+    post_save.connect(update_speakers_version, sender=sender)
+    post_delete.connect(update_speakers_version, sender=sender)
+m2m_changed.connect(update_speakers_version, sender=Talk.authors.through)
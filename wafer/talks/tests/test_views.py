@@ -1,7 +1,14 @@
 """Tests for wafer.talk views."""
 
+import os
+import pickle
+import shutil
+import tempfile
+
 import mock
 
+from django.conf import settings
+from django.core.cache import cache, caches
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 
@@ -9,8 +16,10 @@ from wafer.tests.api_utils import SortedResultsClient
 from wafer.tests.utils import create_user, mock_avatar_url
 from wafer.talks.models import (
     Talk, TalkUrl, Track, ACCEPTED, REJECTED, SUBMITTED, UNDER_CONSIDERATION,
-    CANCELLED, PROVISIONAL, WITHDRAWN)
+    CANCELLED, PROVISIONAL, WITHDRAWN, get_speakers_version)
 from wafer.talks.tests.fixtures import create_talk, create_talk_type
+from wafer.talks.views import TalkView
+from wafer.utils import QueryTracker
 
 
 class UsersTalksTests(TestCase):
@@ -362,6 +371,42 @@ class TalkViewTests(TestCase):
             follow=True)
         self.assertEqual(response.status_code, 200)
 
+class TalkBuildTests(TestCase):
+    def setUp(self):
+        self.build_dir = tempfile.mkdtemp()
+        self.talk_a = create_talk("Talk A", ACCEPTED, "author_a")
+        self.talk_a.authors.add(create_user("author_b"))
+        TalkUrl.objects.create(talk=self.talk_a, description="Slides",
+                               url="https://example.com/slides")
+        self.talk_c = create_talk("Talk C", CANCELLED, "author_c")
+        self.talk_s = create_talk("Talk S", SUBMITTED, "author_s")
+
+    def tearDown(self):
+        shutil.rmtree(self.build_dir)
+
+    @mock.patch('wafer.users.models.UserProfile.avatar_url', mock_avatar_url)
+    def test_build(self):
+        """Test that the public talks are built, with the authors and
+           urls loaded for all the talks at once"""
+        with self.settings(BUILD_DIR=self.build_dir):
+            with QueryTracker() as tracker:
+                TalkView().build_method()
+        for table in ('talks_talk', 'auth_user', 'talks_talkurl'):
+            self.assertEqual(
+                len([query for query in tracker.queries
+                     if 'FROM "%s"' % table in query['sql']]), 1, table)
+        path = os.path.join(self.build_dir, self.talk_a.get_absolute_url()[1:],
+                            'index.html')
+        with open(path) as f:
+            page = f.read()
+        self.assertIn('author_b', page)
+        self.assertIn('https://example.com/slides', page)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.build_dir, self.talk_c.get_absolute_url()[1:])))
+        self.assertFalse(os.path.exists(os.path.join(
+            self.build_dir, self.talk_s.get_absolute_url()[1:])))
+
+
 class TalkDeleteViewTests(TestCase):
     def setUp(self):
         self.talk_a = create_talk("Talk A", ACCEPTED, "author_a")
@@ -822,6 +867,63 @@ class SpeakerTests(TestCase):
         types = list(response.context['speaker_rows'])
         self.assertGreater(types.index('Test 1'), types.index('Test 2'))
 
+    @mock.patch('wafer.users.models.UserProfile.avatar_url', mock_avatar_url)
+    def test_cached(self):
+        """Test that the speakers are looked up once, until the talks or
+           users change"""
+        create_talk('Talk D', ACCEPTED, 'author_d', talk_type=self.talk_type1)
+        with QueryTracker() as tracker:
+            response = self.client.get(reverse('wafer_talks_speakers'))
+        self.assertEqual(
+            len([query for query in tracker.queries
+                 if 'FROM "talks_talk_authors"' in query['sql']]), 1)
+        self.assertEqual(len(response.context['speaker_rows']['Talk'][0]), 1)
+        with QueryTracker() as tracker:
+            response = self.client.get(reverse('wafer_talks_speakers'))
+        self.assertFalse([query for query in tracker.queries
+                          if 'FROM "talks_talk_authors"' in query['sql']])
+        self.assertEqual(len(response.context['speaker_rows']['Talk'][0]), 1)
+        # Changes to the talks and users show up
+        talk_e = create_talk('Talk E', SUBMITTED, 'author_e',
+                             talk_type=self.talk_type1)
+        talk_e.status = ACCEPTED
+        talk_e.save()
+        user = talk_e.corresponding_author
+        user.first_name = 'Eve'
+        user.save()
+        response = self.client.get(reverse('wafer_talks_speakers'))
+        self.assertEqual(
+            [profile.display_name() for profile in
+             response.context['speaker_rows']['Talk'][0]],
+            ['author_d', 'Eve'])
+        # Logging in doesn't change the version
+        response = self.client.get(reverse('wafer_talks_speakers'))
+        self.client.login(username='author_d', password='author_d_password')
+        with QueryTracker() as tracker:
+            self.client.get(reverse('wafer_talks_speakers'))
+        self.assertFalse([query for query in tracker.queries
+                          if 'FROM "talks_talk_authors"' in query['sql']])
+
+    @mock.patch('wafer.users.models.UserProfile.avatar_url', mock_avatar_url)
+    def test_cached_shared(self):
+        """Test that the speakers and their version are kept in the wafer
+           cache, without the speakers' passwords"""
+        talk = create_talk('Talk D', ACCEPTED, 'author_d',
+                           talk_type=self.talk_type1)
+        self.client.get(reverse('wafer_talks_speakers'))
+        wafer_cache = caches[settings.WAFER_CACHE]
+        self.assertEqual(wafer_cache.get('wafer_speakers_version'),
+                         get_speakers_version())
+        self.assertNotIn(
+            talk.corresponding_author.password.encode(),
+            pickle.dumps(wafer_cache.get('wafer_speakers')))
+        # Other processes have their own default cache
+        cache.clear()
+        with QueryTracker() as tracker:
+            self.client.get(reverse('wafer_talks_speakers'))
+        self.assertFalse([query for query in tracker.queries
+                          if 'FROM "talks_talk_authors"' in query['sql']])
+
 
 class TalkSlugUrlTests(TestCase):
     """Check that we can lookup a talk via correct and incorrect slugs"""
@@ -1,11 +1,10 @@
-from itertools import groupby
-
 from django.conf import settings
 from django.contrib.auth.mixins import (
     LoginRequiredMixin, PermissionRequiredMixin)
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
 from django.core.exceptions import PermissionDenied, ValidationError
-from django.db.models import Q, F
+from django.db.models import Q
 from django.http import Http404
 from django.http import HttpResponseRedirect
 from django.urls import reverse_lazy
@@ -22,11 +21,13 @@ from reversion import revisions
 from wafer.talks.models import (
     Review, Talk, TalkType, TalkUrl, Track,
     ACCEPTED, CANCELLED, PROVISIONAL, SUBMITTED, UNDER_CONSIDERATION,
-    WITHDRAWN)
+    WITHDRAWN, SPEAKERS_VERSION_KEY, get_speakers_version)
 from wafer.talks.forms import ReviewForm, get_talk_form_class
 from wafer.talks.serializers import TalkSerializer, TalkUrlSerializer, ReviewSerializer
 from wafer.users.models import UserProfile
-from wafer.utils import order_results_by, PaginatedBuildableListView
+from wafer.utils import (
+    build_state, model_fields, order_results_by, PaginatedBuildableListView,
+    PreloadedBuildMixin)
 
 
 class EditOwnTalksMixin(object):
@@ -45,10 +46,10 @@ class UsersTalks(PaginatedBuildableListView):
     build_prefix = 'talks'
     paginate_by = 100
 
-    def get_queryset(self):
-        # self.request will be None when we come here via the static site
-        # renderer
-        if self.request and Talk.can_view_all(self.request.user):
+    def _get_talks(self, user=None):
+        """The talks the user can see, or the talks anyone can see if
+           there's no user"""
+        if user is not None and Talk.can_view_all(user):
             talks = Talk.objects.all()
         else:
             talks = Talk.objects.filter(
@@ -56,22 +57,38 @@ class UsersTalks(PaginatedBuildableListView):
                 | Q(status__in=(SUBMITTED, UNDER_CONSIDERATION, PROVISIONAL),
                     talk_type__show_pending_submissions=True)
             )
-        if self.request:
-            if self.request.GET.get('sort') == 'track' and Track.objects.count() > 0:
-                talks = talks.order_by('talk_type', 'track')
-            elif self.request.GET.get('sort') == 'lang' and Talk.LANGUAGES:
-                talks = talks.order_by('talk_type', 'language')
-            elif self.request.GET.get('sort') == 'title':
-                talks = talks.order_by('talk_type', 'title')
-            else:
-                talks = talks.order_by('talk_type', 'talk_id')
-        else:
-            talks = talks.order_by('talk_type', 'talk_id')
         return talks.prefetch_related(
             "talk_type", "corresponding_author", "authors", "authors__userprofile",
             "track"
         )
 
+    def get_static_queryset(self):
+        """The talks in the static talk list, which doesn't need a
+           request"""
+        return self._get_talks().order_by('talk_type', 'talk_id')
+
+    def get_queryset(self):
+        # self.request will be None when we come here via the static site
+        # renderer
+        if not self.request:
+            return self.get_static_queryset()
+        talks = self._get_talks(self.request.user)
+        if self.request.GET.get('sort') == 'track' and Track.objects.count() > 0:
+            talks = talks.order_by('talk_type', 'track')
+        elif self.request.GET.get('sort') == 'lang' and Talk.LANGUAGES:
+            talks = talks.order_by('talk_type', 'language')
+        elif self.request.GET.get('sort') == 'title':
+            talks = talks.order_by('talk_type', 'title')
+        else:
+            talks = talks.order_by('talk_type', 'talk_id')
+        return talks
+
+    def get_build_inputs(self):
+        """The data the static talk list is built from"""
+        return [build_state(model_fields(talk), str(talk.talk_type),
+                            str(talk.track), talk.get_authors_display_name())
+                for talk in self.get_static_queryset()]
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["languages"] = Talk.LANGUAGES
@@ -83,7 +100,7 @@ class UsersTalks(PaginatedBuildableListView):
         return context
 
 
-class TalkView(BuildableDetailView):
+class TalkView(PreloadedBuildMixin, BuildableDetailView):
     template_name = 'wafer.talks/talk.html'
     model = Talk
 
@@ -96,6 +113,25 @@ class TalkView(BuildableDetailView):
             # We cleanup the directory created
             self.unbuild_object(obj)
 
+    def get_build_queryset(self):
+        """The talks, with the authors, urls and schedule items that the
+           pages show"""
+        return self.get_queryset().select_related(
+            'talk_type', 'track', 'corresponding_author').prefetch_related(
+            'authors__userprofile', 'urls', 'scheduleitem_set__venue',
+            'scheduleitem_set__slots')
+
+    def get_build_inputs(self, obj):
+        """The data the static page of the talk is built from"""
+        return [
+            model_fields(obj), str(obj.talk_type), str(obj.track),
+            [(author.username, author.userprofile.display_name())
+             for author in obj.authors.all()],
+            [model_fields(url) for url in obj.urls.all()],
+            [(str(item.venue), item.get_start_time(), item.get_duration())
+             for item in obj.scheduleitem_set.all()],
+        ]
+
     def create_request(self, path):
         request = super().create_request(path)
         request.user = AnonymousUser()
@@ -287,24 +323,55 @@ class Speakers(BuildableListView):
     def _by_row(self, speakers, n):
         return [speakers[i:i + n] for i in range(0, len(speakers), n)]
 
+    def get_speakers(self):
+        """Return the speakers of the accepted talks, as a list of
+           (talk type name, speakers) pairs, ordered by talk type.
+
+           Talk types that don't show their speakers are left out. The
+           result is shared between processes via the wafer cache, until
+           the talks or users change. Only the user fields the page shows
+           are loaded, so we don't cache password hashes."""
+        cache = caches[settings.WAFER_CACHE]
+        # Fetch the version and speakers together, to save a cache query
+        cached = cache.get_many([SPEAKERS_VERSION_KEY, 'wafer_speakers'])
+        version = cached.get(SPEAKERS_VERSION_KEY) or get_speakers_version()
+        speakers = cached.get('wafer_speakers')
+        if speakers and speakers[0] == version:
+            return speakers[1]
+        # The distinct talk types of each speaker, in the order they are
+        # listed in
+        speaker_types = Talk.authors.through.objects.filter(
+            Q(talk__talk_type__isnull=True) |
+            Q(talk__talk_type__show_speakers=True),
+            talk__status=ACCEPTED).order_by(
+            'talk__talk_type', 'user__first_name', 'user__last_name',
+            'user__username').values_list(
+            'talk__talk_type__name', 'user_id').distinct()
+        speaker_types = list(speaker_types)
+        profiles = UserProfile.objects.select_related('user').only(
+            'user__username', 'user__first_name', 'user__last_name',
+            'user__email').in_bulk(
+            set(user_id for _talk_type, user_id in speaker_types),
+            field_name='user_id')
+        speakers = {}
+        for talk_type, user_id in speaker_types:
+            speakers.setdefault(talk_type, []).append(profiles[user_id])
+        speakers = list(speakers.items())
+        cache.set('wafer_speakers', (version, speakers), timeout=None)
+        return speakers
+
+    def get_build_inputs(self):
+        """The data the static speakers page is built from"""
+        return [(talk_type,
+                 [(speaker.user.username, speaker.display_name(),
+                   speaker.user.email) for speaker in speakers])
+                for talk_type, speakers in self.get_speakers()]
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        speakers = UserProfile.objects.filter(
-            user__talks__status='A').distinct().prefetch_related(
-            'user').order_by('user__talks__talk_type',
-                             'user__first_name',
-                             'user__last_name',
-                             'user__username').annotate(
-            talk_type=F('user__talks__talk_type__name'),
-            show_speakers=F('user__talks__talk_type__show_speakers'))
-        bytype = groupby(speakers, lambda x: x.talk_type)
         context['speaker_rows'] = {}
-        for talk_type, type_speakers in bytype:
-            type_speakers = list(type_speakers)
-            # We explicitly check for False, as no talk type will give us None for
-            # show_speakers and we want to default to including that
-            if type_speakers and type_speakers[0].show_speakers is not False:
-                context["speaker_rows"][talk_type] = self._by_row(type_speakers, 4)
+        for talk_type, speakers in self.get_speakers():
+            context["speaker_rows"][talk_type] = self._by_row(speakers, 4)
         return context
 
 
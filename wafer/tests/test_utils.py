@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for wafer utilities."""
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import skipUnless
+
+from django.test import TestCase
+
+from wafer import utils
+from wafer.schedule.views import ICalView
+from wafer.tests.utils import create_user
+from wafer.users.views import UsersView
+
+
+class PrecompressedBuildTests(TestCase):
+
+    def setUp(self):
+        self.build_dir = tempfile.mkdtemp()
+        self.index = os.path.join(self.build_dir, 'users', 'index.html')
+        create_user('john')
+
+    def tearDown(self):
+        shutil.rmtree(self.build_dir)
+
+    def _build(self):
+        with self.settings(BUILD_DIR=self.build_dir):
+            UsersView().build_method()
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_compressed_copies(self):
+        self._build()
+        content = self._read(self.index)
+        self.assertIn(b'john', content)
+        self.assertEqual(gzip.decompress(self._read(self.index + '.gz')),
+                         content)
+        with self.settings(BUILD_DIR=self.build_dir):
+            ICalView().build_method()
+        ics = os.path.join(self.build_dir, 'schedule', 'schedule.ics')
+        self.assertEqual(gzip.decompress(self._read(ics + '.gz')),
+                         self._read(ics))
+
+    @skipUnless(utils.brotli, 'brotli is not installed')
+    def test_brotli(self):
+        self._build()
+        self.assertEqual(
+            utils.brotli.decompress(self._read(self.index + '.br')),
+            self._read(self.index))
+
+    def test_unchanged_files_not_written(self):
+        self._build()
+        old_time = 1000000000
+        for path in (self.index, self.index + '.gz'):
+            os.utime(path, (old_time, old_time))
+        self._build()
+        self.assertEqual(os.stat(self.index).st_mtime, old_time)
+        self.assertEqual(os.stat(self.index + '.gz').st_mtime, old_time)
+        # A missing copy is replaced
+        os.unlink(self.index + '.gz')
+        self._build()
+        self.assertEqual(os.stat(self.index).st_mtime, old_time)
+        self.assertTrue(os.path.exists(self.index + '.gz'))
+        # A change is written
+        create_user('jane')
+        self._build()
+        self.assertNotEqual(os.stat(self.index).st_mtime, old_time)
+        self.assertIn(b'jane', gzip.decompress(
+            self._read(self.index + '.gz')))
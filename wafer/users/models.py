@@ -5,8 +5,7 @@ logger = logging.getLogger(__name__)
 from django.conf import settings
 from django.contrib.auth.models import User, Group
 from django.db import models
-from django.db.models import Q
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils.module_loading import import_string
 from django.utils.translation import gettext_lazy as _
@@ -20,7 +19,8 @@ except ImportError:
 
 from wafer.kv.models import KeyValue
 from wafer.talks.models import (ACCEPTED, SUBMITTED, UNDER_CONSIDERATION,
-                                PROVISIONAL, CANCELLED)
+                                PROVISIONAL, CANCELLED,
+                                update_speakers_version)
 
 
 PROFILE_GROUP = 'Online Profiles'
@@ -43,21 +43,29 @@ class UserProfile(models.Model):
     def __str__(self):
         return u'%s' % self.user
 
+    def _talks(self, statuses):
+        if hasattr(self.user, 'preloaded_talks') and not any(
+                talk.status in statuses
+                for talk in self.user.preloaded_talks):
+            # The talks preloaded for the static site tell us there
+            # aren't any, so we don't need to ask the database
+            return self.user.talks.none()
+        return self.user.talks.filter(status__in=statuses)
+
     def accepted_talks(self):
-        return self.user.talks.filter(status=ACCEPTED)
+        return self._talks((ACCEPTED,))
 
     def provisional_talks(self):
-        return self.user.talks.filter(status=PROVISIONAL)
+        return self._talks((PROVISIONAL,))
 
     def pending_talks(self):
-        return self.user.talks.filter(Q(status=SUBMITTED) |
-                                      Q(status=UNDER_CONSIDERATION))
+        return self._talks((SUBMITTED, UNDER_CONSIDERATION))
 
     def cancelled_talks(self):
-        return self.user.talks.filter(status=CANCELLED)
+        return self._talks((CANCELLED,))
 
     def published_talks(self):
-        return self.user.talks.filter(status__in=(ACCEPTED, CANCELLED))
+        return self._talks((ACCEPTED, CANCELLED))
 
     def avatar_url(self, size=96, https=True, default='mm'):
         if not self.user.email:
@@ -119,3 +127,16 @@ def add_default_groups(sender, instance, created, raw=False, **kwargs):
                 instance.groups.add(group)
             except ObjectDoesNotExist:
                 logger.warning("Specified default group %s not found" % grp_name)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    """The speakers page shows the users' names and avatars"""
+    # Logging in only updates last_login, which isn't shown
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    update_speakers_version()
+
+
+post_delete.connect(update_speakers_version, sender=User)
+post_save.connect(update_speakers_version, sender=UserProfile)
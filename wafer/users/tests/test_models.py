@@ -2,7 +2,11 @@
 # vim:fileencoding=utf-8 ai ts=4 sts=4 et sw=4
 """Tests for wafer.user.models"""
 
+from django.contrib.auth import get_user_model
+from django.db.models import Prefetch, QuerySet
 from django.test import TestCase
+from wafer.talks.models import ACCEPTED
+from wafer.talks.tests.fixtures import create_talk
 from wafer.tests.utils import create_user
 
 
@@ -12,3 +16,18 @@ class UserModelTestCase(TestCase):
         """Test that str(user) works correctly"""
         user = create_user('test')
         self.assertEqual(str(user.userprofile), 'test')
+
+    def test_talks_preloaded(self):
+        """Test that the talk lists are querysets, even when the talks
+           were preloaded for the static site"""
+        user = create_talk('Talk', ACCEPTED, 'author').corresponding_author
+        user = get_user_model().objects.select_related(
+            'userprofile').prefetch_related(
+            Prefetch('talks', to_attr='preloaded_talks')).get(pk=user.pk)
+        profile = user.userprofile
+        with self.assertNumQueries(0):
+            self.assertIsInstance(profile.cancelled_talks(), QuerySet)
+            self.assertFalse(profile.cancelled_talks().exists())
+        self.assertIsInstance(profile.accepted_talks(), QuerySet)
+        self.assertEqual([talk.title for talk in profile.accepted_talks()],
+                         ['Talk'])
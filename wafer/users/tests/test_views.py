@@ -2,14 +2,20 @@
 # vim:fileencoding=utf-8 ai ts=4 sts=4 et sw=4
 """Tests for wafer.user.views"""
 
+import os
+import shutil
+import tempfile
+
 import mock
 
 from django.test import Client, TestCase
 
 from wafer.users.models import PROFILE_GROUP
+from wafer.users.views import ProfileView
 from wafer.talks.models import ACCEPTED
 from wafer.talks.tests.fixtures import create_talk
 from wafer.tests.utils import create_group, create_user, mock_avatar_url
+from wafer.utils import QueryTracker
 
 
 class UserProfilePermissionTests(TestCase):
@@ -198,3 +204,59 @@ class UserProfileViewTests(TestCase):
 
             user2_view = self.client.get('/users/test2/').content
             self.assertTrue(b'https://github.com/bbb' not in user2_view)
+
+
+class ProfileBuildTests(TestCase):
+    """Test building the static profile pages"""
+
+    def setUp(self):
+        self.build_dir = tempfile.mkdtemp()
+        self.group = create_group(PROFILE_GROUP)
+        for username in ('test1', 'test2', 'test3'):
+            user = create_talk(title="Talk by %s" % username,
+                               status=ACCEPTED,
+                               username=username).corresponding_author
+            user.userprofile.kv.create(
+                group=self.group, key='github',
+                value='https://github.com/%s' % username)
+        create_user('test4')
+
+    def tearDown(self):
+        shutil.rmtree(self.build_dir)
+
+    def _read(self, username):
+        with open(os.path.join(self.build_dir, 'users', username,
+                               'index.html')) as f:
+            return f.read()
+
+    @mock.patch('wafer.users.models.UserProfile.avatar_url', mock_avatar_url)
+    def test_build(self):
+        with self.settings(BUILD_DIR=self.build_dir):
+            ProfileView().build_method()
+        page = self._read('test1')
+        self.assertIn('Talk by test1', page)
+        self.assertIn('https://github.com/test1', page)
+        self.assertNotIn('test2', page)
+        self.assertIn('test4', self._read('test4'))
+
+    @mock.patch('wafer.users.models.UserProfile.avatar_url', mock_avatar_url)
+    def test_preloaded(self):
+        """Test that the profiles, talks and profile links are loaded
+           for all the users at once"""
+        with self.settings(BUILD_DIR=self.build_dir,
+                           WAFER_PUBLIC_ATTENDEE_LIST=False):
+            with QueryTracker() as tracker:
+                ProfileView().build_method()
+        for table in ('auth_group', 'auth_user', 'kv_keyvalue'):
+            self.assertEqual(
+                len([query for query in tracker.queries
+                     if 'FROM "%s"' % table in query['sql']]), 1, table)
+        # The talk lists are querysets, so only the speakers' pages look
+        # up their talks again
+        self.assertEqual(
+            len([query for query in tracker.queries
+                 if 'FROM "talks_talk"' in query['sql']]), 1 + 3 * 2)
+        # Without a published talk, the profile isn't public
+        self.assertFalse(os.path.exists(
+            os.path.join(self.build_dir, 'users', 'test4')))
+        self.assertIn('https://github.com/test2', self._read('test2'))
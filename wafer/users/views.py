@@ -4,7 +4,7 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser, Group
 from django.core.exceptions import PermissionDenied
-from django.db.models import Q
+from django.db.models import Prefetch, Q
 from django.http import Http404
 from django.urls import reverse
 from django.views.generic import UpdateView
@@ -13,12 +13,15 @@ from bakery.views import BuildableDetailView
 from rest_framework import viewsets
 from rest_framework.permissions import IsAdminUser
 
+from wafer.kv.models import KeyValue
 from wafer.talks.models import (
     ACCEPTED, CANCELLED, PROVISIONAL, SUBMITTED, UNDER_CONSIDERATION)
 from wafer.users.forms import UserForm, UserProfileForm
 from wafer.users.serializers import UserSerializer
 from wafer.users.models import UserProfile, PROFILE_GROUP
-from wafer.utils import PaginatedBuildableListView
+from wafer.utils import (
+    PaginatedBuildableListView, PrecompressedBuildMixin, PreloadedBuildMixin,
+    model_fields)
 
 log = logging.getLogger(__name__)
 
@@ -41,6 +44,11 @@ class UsersView(PaginatedBuildableListView):
         qs = qs.order_by('first_name', 'last_name', 'username')
         return qs
 
+    def get_build_inputs(self):
+        """The data the static user list is built from"""
+        return [(user.username, user.userprofile.display_name())
+                for user in self.get_queryset().select_related('userprofile')]
+
 
 class Hide404Mixin(object):
     """Generic handling for user objects.
@@ -61,32 +69,55 @@ class Hide404Mixin(object):
         return result
 
 
-class ProfileView(Hide404Mixin, BuildableDetailView):
+class ProfileView(Hide404Mixin, PreloadedBuildMixin, PrecompressedBuildMixin,
+                  BuildableDetailView):
     template_name = 'wafer.users/profile.html'
     model = get_user_model()
     slug_field = 'username'
     slug_url_kwarg = 'username'
     # avoid a clash with the user object used by the menus
     context_object_name = 'profile_user'
+    _profile_group = None
 
     def get_url(self, obj):
         return reverse('wafer_user_profile', args=(obj.username,))
 
+    def create_request(self, path):
+        request = super().create_request(path)
+        # Add a user with no permissions
+        request.user = AnonymousUser()
+        return request
+
     def build_object(self, obj):
         """Override django-bakery to skip profiles that raise 403"""
         if obj.username in ('.', '..'):
             log.warning('Skipping build of user %s, bad username', obj.username)
             return
         try:
-            build_path = self.get_build_path(obj)
-            self.request = self.create_request(build_path)
-            self.request.user = AnonymousUser()
-            self.set_kwargs(obj)
-            self.build_file(build_path, self.get_content())
+            super().build_object(obj)
         except PermissionDenied:
             # cleanup directory
             self.unbuild_object(obj)
 
+    def get_build_queryset(self):
+        """The users, with the profiles, talks and profile links that
+           the pages show"""
+        return self.get_queryset().select_related(
+            'userprofile').prefetch_related(
+            Prefetch('talks', to_attr='preloaded_talks'),
+            Prefetch('userprofile__kv', queryset=KeyValue.objects.filter(
+                group=self.get_profile_group())))
+
+    def get_build_inputs(self, obj):
+        """The data the static profile page is built from"""
+        profile = obj.userprofile
+        return [
+            model_fields(obj, exclude=('password', 'last_login')),
+            model_fields(profile),
+            [model_fields(kv) for kv in profile.kv.all()],
+            [model_fields(talk) for talk in obj.preloaded_talks],
+        ]
+
     def get_object(self, *args, **kwargs):
         object_ = super().get_object(*args, **kwargs)
         if not settings.WAFER_PUBLIC_ATTENDEE_LIST:
@@ -95,28 +126,34 @@ class ProfileView(Hide404Mixin, BuildableDetailView):
                 raise PermissionDenied()
         return object_
 
+    def get_profile_group(self):
+        # Only looked up once for the static site
+        if self._profile_group is None:
+            self._profile_group = Group.objects.get_by_natural_key(
+                PROFILE_GROUP)
+        return self._profile_group
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['can_edit'] = self.can_edit(context['object'])
         # Add social and code profile info
-        group = Group.objects.get_by_natural_key(PROFILE_GROUP)
+        group = self.get_profile_group()
 
         context['social_sites'] = {}
         context['code_sites'] = {}
 
-        profile = self.get_object().userprofile
+        profile = context['object'].userprofile
+        # Use the profile links preloaded for the static site, if we can
+        values = dict((kv.key, kv.value) for kv in profile.kv.all()
+                      if kv.group_id == group.pk)
 
         for field in settings.SOCIAL_MEDIA_ENTRIES:
-            if profile.kv.filter(group=group, key=field).exists():
-                value = profile.kv.get(group=group, key=field).value
-                if value:
-                    context['social_sites'][settings.SOCIAL_MEDIA_ENTRIES[field]] = value
+            if values.get(field):
+                context['social_sites'][settings.SOCIAL_MEDIA_ENTRIES[field]] = values[field]
 
         for field in settings.CODE_HOSTING_ENTRIES:
-            if profile.kv.filter(group=group, key=field).exists():
-                value = profile.kv.get(group=group, key=field).value
-                if value:
-                    context['code_sites'][settings.CODE_HOSTING_ENTRIES[field]] = value
+            if values.get(field):
+                context['code_sites'][settings.CODE_HOSTING_ENTRIES[field]] = values[field]
 
         return context
 
@@ -1,4 +1,8 @@
 import functools
+import gzip
+import hashlib
+import json
+import mimetypes
 import os
 import unicodedata
 from django.core.cache import caches
@@ -6,8 +10,23 @@ from django.conf import settings
 
 from django.contrib.auth.models import AnonymousUser
 
+from bakery.filesystem import ObjectMetadata
 from bakery.views import BuildableListView
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# The content types we write compressed copies of in the static build
+PRECOMPRESS_CONTENT_TYPES = (
+    'text/html', 'application/xml', 'text/xml', 'application/json',
+    'text/calendar',
+)
+# The suffixes of the compressed copies
+PRECOMPRESSED_SUFFIXES = ('.gz', '.br')
+
 
 def normalize_unicode(u):
     """Replace non-ASCII characters with closest ASCII equivalents
@@ -52,6 +71,23 @@ def cache_result(cache_key, timeout):
     return decorator
 
 
+def model_fields(obj, exclude=()):
+    """Return the names and values of the concrete fields of a model
+       instance, for use as the inputs of a build state."""
+    return [(field.name, field.value_from_object(obj))
+            for field in obj._meta.concrete_fields
+            if field.name not in exclude]
+
+
+def build_state(*inputs):
+    """Hash the inputs a page of the static site is built from.
+
+       The incremental static build compares these, to decide which
+       pages need to be rebuilt."""
+    data = json.dumps(inputs, default=str, sort_keys=True)
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+
 class QueryTracker(object):
     """ Track queries to database. """
 
@@ -73,7 +109,80 @@ class QueryTracker(object):
         return connection.queries[:]
 
 
-class PaginatedBuildableListView(BuildableListView):
+class PrecompressedBuildMixin(object):
+    """Mixin for buildable views, that only writes files that have
+       changed, so their modification times are left alone, and writes
+       gzip and brotli (if brotli is installed) compressed copies next
+       to them, for the web server to serve."""
+
+    def _write_if_changed(self, target_path, content, metadata):
+        """Write the file, unless it already has the content.
+
+           Returns True if the file was written"""
+        if self.fs.exists(target_path):
+            with self.fs.open(target_path, 'rb') as f:
+                old_hash = hashlib.sha256(f.read()).digest()
+            if old_hash == hashlib.sha256(content).digest():
+                return False
+        with self.fs.open(target_path, 'wb', metadata=metadata) as f:
+            f.write(content)
+        return True
+
+    def build_file(self, target_path, content):
+        if self.is_gzippable(target_path):
+            # django-bakery replaces the file with a gzipped one (for S3)
+            return super().build_file(target_path, content)
+        target_path = str(target_path)
+        content_type = mimetypes.guess_type(target_path)[0]
+        written = self._write_if_changed(
+            target_path, content,
+            ObjectMetadata(content_type or 'application/octet-stream'))
+        if content_type not in PRECOMPRESS_CONTENT_TYPES:
+            return
+        compressors = [('.gz', 'gzip',
+                        lambda data: gzip.compress(data, mtime=0))]
+        if brotli is not None:
+            compressors.append(('.br', 'br', brotli.compress))
+        for suffix, encoding, compress in compressors:
+            path = target_path + suffix
+            # An unchanged file only needs the copies that are missing
+            if written or not self.fs.exists(path):
+                self._write_if_changed(path, compress(content),
+                                       ObjectMetadata(content_type, encoding))
+
+
+class PreloadedBuildMixin(object):
+    """Mixin for buildable detail views, that builds the pages from a
+       queryset that preloads what the pages show, rather than looking
+       up each object, and its related objects, again.
+
+       Views override get_build_queryset to add the select_related and
+       prefetch_related calls."""
+
+    # The object being built
+    preloaded_object = None
+
+    def get_build_queryset(self):
+        return self.get_queryset()
+
+    def build_queryset(self):
+        for obj in self.get_build_queryset():
+            self.build_object(obj)
+
+    def build_object(self, obj):
+        self.preloaded_object = obj
+        try:
+            super().build_object(obj)
+        finally:
+            self.preloaded_object = None
+
+    def get_object(self, *args, **kwargs):
+        if self.preloaded_object is not None:
+            return self.preloaded_object
+        return super().get_object(*args, **kwargs)
+
+
+class PaginatedBuildableListView(PrecompressedBuildMixin, BuildableListView):
     """BuildableListView subclass that handles pagination"""
 
     build_prefix = '.'